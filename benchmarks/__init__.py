@@ -0,0 +1,6 @@
+"""
+Micro benchmarks for the hot paths of the service
+
+Run a benchmark as a module from the project root, e.g.
+    python -m benchmarks.item_search
+"""
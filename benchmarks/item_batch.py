@@ -0,0 +1,98 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Item batch benchmark
+
+Adds the same Items to an Order through the Flask test client with one
+POST /api/orders/{id}/items per Item and with one
+POST /api/orders/{id}/items:batch, and prints the cost of every Item
+both ways. The Orders are stored in the configured database and deleted
+afterwards.
+
+Usage:
+    python -m benchmarks.item_batch [--items 300] [--rounds 3]
+"""
+import argparse
+import time
+from wsgi import app
+from service.models import db, Order
+from benchmarks.order_batch import make_payloads
+
+
+def make_items(count: int) -> list:
+    """Returns the payloads of some Items"""
+    return [
+        {
+            "product_id": number,
+            "name": f"line {number}",
+            "quantity": 2,
+            "unit_price": 5.0,
+            "total_price": 10.0,
+            "description": "benchmark line",
+        }
+        for number in range(count)
+    ]
+
+
+def one_at_a_time(client, order_id: int, items: list) -> None:
+    """Adds the Items with one request each"""
+    for item in items:
+        resp = client.post(f"/api/orders/{order_id}/items", json=dict(item, order_id=order_id))
+        assert resp.status_code == 201, resp.get_data(as_text=True)
+
+
+def batched(client, order_id: int, items: list) -> None:
+    """Adds the Items with one request"""
+    resp = client.post(f"/api/orders/{order_id}/items:batch", json=items)
+    assert resp.status_code == 201, resp.get_data(as_text=True)
+
+
+def main():
+    """Runs the benchmark and prints the cost of every Item"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    with app.app_context():
+        client = app.test_client()
+        items = make_items(args.items)
+        ids = []
+        print(f"Orders of {args.items} Items, best of {args.rounds}")
+        print(f"{'path':<18} {'seconds':>8} {'ms/item':>10}")
+        costs = {}
+        try:
+            for name, add in (("POST /items", one_at_a_time), ("POST /items:batch", batched)):
+                best = None
+                for _ in range(args.rounds):
+                    resp = client.post("/api/orders", json=make_payloads(1, 0)[0])
+                    ids.append(resp.get_json()["id"])
+                    start = time.perf_counter()
+                    add(client, ids[-1], items)
+                    seconds = time.perf_counter() - start
+                    best = seconds if best is None else min(best, seconds)
+                costs[name] = best * 1000 / args.items
+                print(f"{name:<18} {best:>8.2f} {costs[name]:>10.3f}")
+        finally:
+            db.session.query(Order).filter(Order.id.in_(ids)).delete()
+            db.session.commit()
+        speedup = costs["POST /items"] / costs["POST /items:batch"]
+        print(f"{'speedup':<18} {speedup:>18.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Item name search benchmark
+
+Times item name searches as the number of Items grows, to show which
+ones stay sub-linear: ILIKE '%term%' in the database with the
+ix_item_name_trgm index and without it (dropped in a transaction that
+is rolled back), the NgramIndex used when pg_trgm is not available and
+a Python scan of every name. The Items are stored in the configured
+database and deleted afterwards.
+
+Usage:
+    python -m benchmarks.item_search [--sizes 10000,40000,160000] [--repeat 10]
+"""
+import argparse
+import random
+import string
+import timeit
+from wsgi import app
+from service.models import db, Order, Item
+from service.models.migrations import ITEM_NAME_TRGM_INDEX, create_trigram_index
+from service.models.search import NgramIndex
+from benchmarks.order_batch import make_payloads
+
+WORDS = ["ruler", "drill", "hammer", "pencil", "eraser", "stapler", "marker"]
+METHODS = ("trgm ms", "no index ms", "ngram ms", "scan ms")
+
+
+def make_names(start: int, count: int) -> dict:
+    """Returns item names keyed by position, a word plus a random suffix"""
+    rng = random.Random(2820 + start)
+    return {
+        key: f"{rng.choice(WORDS)} {''.join(rng.choices(string.ascii_lowercase, k=6))}"
+        for key in range(start, start + count)
+    }
+
+
+def make_terms() -> list:
+    """
+    Returns the terms searched for
+
+    The words match a fixed share of the Items, so their results grow
+    with the data. The random suffixes are selective: a three letter one
+    matches a few dozen Items at most, and the suffix of the first name
+    matches the same single Item at every size.
+    """
+    first = make_names(0, 1)[0].split()[1]
+    return ["ruler", "ill", "stap", first[1:4], first, "zzz"]
+
+
+TERMS = make_terms()
+
+
+def scan(names: dict, term: str) -> set:
+    """Finds the names containing a term by looking at every one"""
+    term = term.lower()
+    return {key for key, name in names.items() if term in name.lower()}
+
+
+def load_items(order_id: int, names: dict) -> None:
+    """Inserts Items with some names into an Order"""
+    rows = [
+        {"order_id": order_id, "product_id": key, "name": name, "quantity": 1, "unit_price": 1.0, "total_price": 1.0}
+        for key, name in names.items()
+    ]
+    connection = db.session.connection()
+    for start in range(0, len(rows), 5000):
+        connection.execute(Item.__table__.insert(), rows[start:start + 5000])
+    db.session.commit()
+    with db.engine.connect() as autocommit:
+        autocommit.execution_options(isolation_level="AUTOCOMMIT").execute(db.text("ANALYZE item"))
+
+
+def time_query(connection, term: str, repeat: int) -> tuple:
+    """Returns the matches and the milliseconds of an ILIKE search, and whether the index served it"""
+    query = db.select(Item.id).where(Item.name.ilike(f"%{term}%"))
+    plan = "\n".join(row[0] for row in connection.execute(db.text("EXPLAIN " + str(
+        query.compile(db.engine, compile_kwargs={"literal_binds": True})
+    ))))
+    matches = len(connection.execute(query).all())
+    seconds = timeit.timeit(lambda: connection.execute(query).all(), number=repeat)
+    return matches, seconds * 1000 / repeat, ITEM_NAME_TRGM_INDEX in plan
+
+
+def database_timings(repeat: int, has_index: bool) -> dict:
+    """Returns the milliseconds of every term with the trigram index and without it"""
+    timings = {}
+    with db.engine.connect() as connection:
+        if has_index:
+            for term in TERMS:
+                _, elapsed, used = time_query(connection, term, repeat)
+                timings[(term, "trgm ms")] = elapsed if used else None
+        transaction = connection.begin()
+        try:
+            connection.execute(db.text(f"DROP INDEX IF EXISTS {ITEM_NAME_TRGM_INDEX}"))
+            for term in TERMS:
+                timings[(term, "matches")], timings[(term, "no index ms")], _ = time_query(connection, term, repeat)
+        finally:
+            transaction.rollback()
+    return timings
+
+
+def memory_timings(names: dict, index: NgramIndex, repeat: int) -> dict:
+    """Returns the milliseconds of every term with the NgramIndex and a scan"""
+    timings = {}
+    for term in TERMS:
+        assert scan(names, term) == index.search(term)
+        scan_seconds = timeit.timeit(lambda t=term: scan(names, t), number=repeat)
+        index_seconds = timeit.timeit(lambda t=term: index.search(t), number=repeat)
+        timings[(term, "scan ms")] = scan_seconds * 1000 / repeat
+        timings[(term, "ngram ms")] = index_seconds * 1000 / repeat
+    return timings
+
+
+def format_ms(value) -> str:
+    """Formats a timing, or a dash when it was not taken"""
+    return f"{'-':>11}" if value is None else f"{value:>11.2f}"
+
+
+def print_growth(results: dict, sizes: list) -> None:
+    """Prints how much slower every method got from the smallest to the largest size"""
+    first, last = sizes[0], sizes[-1]
+    print(f"\nGrowth from {first} to {last} Items ({last / first:.0f}x the rows)")
+    print(f"{'term':<10} " + " ".join(f"{method:>11}" for method in METHODS))
+    for term in TERMS:
+        growth = []
+        for method in METHODS:
+            before, after = results[first].get((term, method)), results[last].get((term, method))
+            growth.append(None if before is None or after is None else after / max(before, 1e-6))
+        print(f"{term!r:<10} " + " ".join(f"{'-':>11}" if value is None else f"{value:>10.1f}x" for value in growth))
+
+
+def main():
+    """Runs the benchmark and prints the timings"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10000,40000,160000", help="comma separated numbers of Items")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+
+    with app.app_context():
+        with db.engine.begin() as connection:
+            create_trigram_index(connection)
+            has_index = connection.execute(
+                db.text("SELECT 1 FROM pg_indexes WHERE indexname = :name"), {"name": ITEM_NAME_TRGM_INDEX}
+            ).first() is not None
+        if not has_index:
+            print(f"pg_trgm is not available: no {ITEM_NAME_TRGM_INDEX} timings")
+
+        order = Order().deserialize(make_payloads(1, 0)[0])
+        order.create()
+        names, index, results = {}, NgramIndex(), {}
+        try:
+            print(f"{'items':>8} {'term':<10} {'matches':>8} " + " ".join(f"{method:>11}" for method in METHODS))
+            for size in sizes:
+                added = make_names(len(names), size - len(names))
+                load_items(order.id, added)
+                names.update(added)
+                for key, name in added.items():
+                    index.add(key, name)
+                results[size] = database_timings(args.repeat, has_index)
+                results[size].update(memory_timings(names, index, args.repeat))
+                for term in TERMS:
+                    print(
+                        f"{size:>8} {term!r:<10} {results[size][(term, 'matches')]:>8} "
+                        + " ".join(format_ms(results[size].get((term, method))) for method in METHODS)
+                    )
+        finally:
+            db.session.query(Order).filter(Order.id == order.id).delete()
+            db.session.commit()
+        if len(sizes) > 1:
+            print_growth(results, sizes)
+
+
+if __name__ == "__main__":
+    main()
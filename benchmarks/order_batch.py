@@ -0,0 +1,118 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Order batch benchmark
+
+Creates the same Orders through the Flask test client with one
+POST /api/orders per Order and with POST /api/orders:batch, and prints
+the Orders created per second both ways. The Orders are stored in the
+configured database and deleted afterwards.
+
+Usage:
+    python -m benchmarks.order_batch [--orders 2000] [--items 3] [--batch 1000]
+"""
+import argparse
+import time
+from wsgi import app
+from service.models import db, Order
+from service.models.order import OrderStatus
+
+
+def make_payloads(count: int, items: int) -> list:
+    """Returns the payloads of some Orders with some Items each"""
+    return [
+        {
+            "customer_id": number % 5000,
+            "order_date": "2024-01-01",
+            "status": OrderStatus.STARTED.name,
+            "shipping_address": f"{number} Mercer St, New York, NY 10012",
+            "total_amount": 100.0,
+            "payment_method": "CREDIT",
+            "shipping_cost": 5.0,
+            "expected_date": "2024-01-08",
+            "order_notes": "benchmark",
+            "items": [
+                {
+                    "order_id": None,
+                    "product_id": item,
+                    "name": f"item {item}",
+                    "quantity": 1,
+                    "unit_price": 5.0,
+                    "total_price": 5.0,
+                    "description": "benchmark item",
+                }
+                for item in range(items)
+            ],
+        }
+        for number in range(count)
+    ]
+
+
+def one_at_a_time(client, payloads: list) -> list:
+    """Creates the Orders with one request each, returns their ids"""
+    ids = []
+    for payload in payloads:
+        resp = client.post("/api/orders", json=payload)
+        assert resp.status_code == 201, resp.get_data(as_text=True)
+        ids.append(resp.get_json()["id"])
+    return ids
+
+
+def batched(client, payloads: list, size: int) -> list:
+    """Creates the Orders with batches of some size, returns their ids"""
+    ids = []
+    for start in range(0, len(payloads), size):
+        resp = client.post("/api/orders:batch", json=payloads[start:start + size])
+        assert resp.status_code == 201, resp.get_data(as_text=True)
+        ids += [result["id"] for result in resp.get_json()["results"]]
+    return ids
+
+
+def main():
+    """Runs the benchmark and prints the throughput"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        client = app.test_client()
+        payloads = make_payloads(args.orders, args.items)
+        print(f"{args.orders} Orders with {args.items} Items")
+        print(f"{'path':<18} {'seconds':>8} {'orders/s':>10}")
+        rates = {}
+        ids = []
+        try:
+            for name, create in (
+                ("POST /orders", lambda: one_at_a_time(client, payloads)),
+                (f"batches of {args.batch}", lambda: batched(client, payloads, args.batch)),
+            ):
+                start = time.perf_counter()
+                ids += create()
+                seconds = time.perf_counter() - start
+                rates[name] = args.orders / seconds
+                print(f"{name:<18} {seconds:>8.2f} {rates[name]:>10.0f}")
+        finally:
+            db.session.query(Order).filter(Order.id.in_(ids)).delete()
+            db.session.commit()
+        speedup = rates[f"batches of {args.batch}"] / rates["POST /orders"]
+        print(f"{'speedup':<18} {speedup:>18.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Order encoding benchmark
+
+Compares the cost per Order of encoding a listing the old way, with
+serialize(), flask-restx marshal() and the json module, with the field
+plan compiled from order_model and orjson. The Orders are built in
+memory, the database is not read.
+
+Usage:
+    python -m benchmarks.order_encoding [--orders 1000] [--items 3]
+"""
+import argparse
+import json
+import timeit
+from wsgi import app
+from service import api
+from service.common import representation
+from service.routes import order_model, order_plan
+from tests.factories import OrderFactory, ItemFactory
+
+
+def make_orders(count: int, items: int) -> list:
+    """Returns transient Orders with some Items each"""
+    orders = []
+    for _ in range(count):
+        order = OrderFactory()
+        for _ in range(items):
+            order.items.append(ItemFactory(order=None, order_id=order.id))
+        orders.append(order)
+    return orders
+
+
+def marshalled(orders) -> bytes:
+    """Encodes Orders with serialize(), marshal() and json"""
+    data = api.marshal([order.serialize() for order in orders], order_model)
+    return json.dumps(data).encode("utf-8")
+
+
+def planned(orders) -> bytes:
+    """Encodes Orders with the field plan and the fast encoder"""
+    return representation.dumps(order_plan.render_many(orders))
+
+
+def main():
+    """Runs the benchmark and prints the timings"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with app.app_context():
+        orders = make_orders(args.orders, args.items)
+        assert json.loads(marshalled(orders)) == json.loads(planned(orders))
+        encoder = "orjson" if representation.orjson else "json"
+        print(f"{args.orders} Orders with {args.items} Items, microseconds per Order")
+        timings = {}
+        for name, encode in (("marshal + json", marshalled), (f"plan + {encoder}", planned)):
+            seconds = timeit.timeit(lambda e=encode: e(orders), number=args.repeat)
+            timings[name] = seconds * 1e6 / args.repeat / args.orders
+            print(f"{name:<16} {timings[name]:>8.1f}")
+        speedup = timings["marshal + json"] / timings[f"plan + {encoder}"]
+        print(f"{'speedup':<16} {speedup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Order listing benchmark
+
+Compares streaming a listing of every Order with its Items through the
+ORM reader and the Core reader, reading only and reading and rendering
+with the field plan. The rows are inserted with INSERT ... SELECT from
+generate_series inside a transaction that is rolled back at the end, so
+run it against a test database.
+
+Usage:
+    python -m benchmarks.order_listing [--sizes 10000 100000 1000000] [--items 2]
+"""
+import argparse
+import time
+from wsgi import app
+from service.models import Order, Item, db
+from service.models.order_query import OrderQuery
+from service.models.order_readers import OrmReader, CoreReader
+from service.routes import order_plan
+
+BATCH_SIZE = 1000
+
+
+def insert_orders(count: int, items: int) -> None:
+    """Inserts Orders with some Items each in the current transaction"""
+    orders, order_items = (f'"{model.__table__.name}"' for model in (Order, Item))
+    db.session.execute(
+        db.text(
+            f"INSERT INTO {orders} (customer_id, order_date, status, shipping_address,"
+            " total_amount, payment_method, shipping_cost, order_notes)"
+            " SELECT n % 5000, DATE '2024-01-01' + n % 365, 'STARTED', n || ' Main Street',"
+            " n % 1000 + 0.5, 'CREDIT_CARD', 4.99, 'benchmark'"
+            " FROM generate_series(1, :count) AS n"
+        ),
+        {"count": count},
+    )
+    db.session.execute(
+        db.text(
+            f"INSERT INTO {order_items} (order_id, product_id, name, quantity,"
+            " unit_price, total_price, description)"
+            f" SELECT o.id, i, 'product ' || i, i, 9.5, i * 9.5, 'benchmark item'"
+            f" FROM {orders} AS o CROSS JOIN generate_series(1, :items) AS i"
+        ),
+        {"items": items},
+    )
+
+
+def read(reader_class, render: bool) -> int:
+    """Streams every Order through a reader and returns how many were read"""
+    reader = reader_class(OrderQuery({"sort_by": "id:asc"}))
+    count = 0
+    for order in reader.stream(reader.ordered(), BATCH_SIZE):
+        if render:
+            order_plan.render(order)
+        count += 1
+    db.session.expunge_all()
+    return count
+
+
+def measure(reader_class, render: bool, size: int) -> float:
+    """Returns the microseconds per Order of a streamed listing"""
+    start = time.perf_counter()
+    count = read(reader_class, render)
+    assert count == size, f"read {count} of {size} Orders"
+    return (time.perf_counter() - start) * 1e6 / size
+
+
+def main():
+    """Runs the benchmark and prints the timings"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--items", type=int, default=2)
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Orders with {args.items} Items, microseconds per Order")
+        print(f"{'orders':>8} {'orm':>8} {'core':>8} {'orm+plan':>9} {'core+plan':>10} {'speedup':>8}")
+        for size in args.sizes:
+            try:
+                db.session.query(Order).delete()
+                insert_orders(size, args.items)
+                timings = [
+                    measure(reader_class, render, size)
+                    for render in (False, True)
+                    for reader_class in (OrmReader, CoreReader)
+                ]
+            finally:
+                db.session.rollback()
+            speedup = timings[2] / timings[3]
+            print(
+                f"{size:>8} {timings[0]:>8.1f} {timings[1]:>8.1f}"
+                f" {timings[2]:>9.1f} {timings[3]:>10.1f} {speedup:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
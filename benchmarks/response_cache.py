@@ -0,0 +1,114 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Response cache benchmark
+
+Times GET /api/orders/<id>, GET /api/orders/<id>/items and a single Item
+through the Flask test client with every cache turned off, with only the
+caches of the encoded Order documents, and with the response cache. The
+Orders are stored in the configured database and deleted afterwards.
+
+Usage:
+    python -m benchmarks.response_cache [--items 20] [--repeat 2000]
+"""
+import argparse
+import timeit
+from datetime import date
+from wsgi import app
+from service.models import db, Order, Item
+from service.models.order import OrderStatus
+from service.common.cache import order_cache, response_cache
+from service.common.shared_cache import shared_cache
+
+MIB = 1024 * 1024
+
+
+def make_order(items: int) -> Order:
+    """Stores an Order with some Items and returns it"""
+    # pylint: disable=unexpected-keyword-arg
+    order = Order(
+        customer_id=2820,
+        order_date=date(2024, 1, 1),
+        status=OrderStatus.STARTED,
+        shipping_address="251 Mercer St, New York, NY 10012",
+        total_amount=100.0,
+        payment_method="CREDIT",
+        shipping_cost=5.0,
+        expected_date=date(2024, 1, 8),
+        order_notes="benchmark",
+    )
+    for number in range(items):
+        order.items.append(
+            Item(
+                product_id=number,
+                name=f"item {number}",
+                quantity=1,
+                unit_price=5.0,
+                total_price=5.0,
+                description="benchmark item",
+            )
+        )
+    db.session.add(order)
+    db.session.commit()
+    return order
+
+
+def configure(mode: str, directory: str) -> None:
+    """Turns the caches of a mode on and the others off"""
+    order_cache.configure(32 * MIB if mode != "uncached" else 0, 0)
+    shared_cache.configure(directory if mode != "uncached" else None, 64 * MIB)
+    response_cache.configure(16 * MIB if mode == "response" else 0, 0)
+
+
+def main():
+    """Runs the benchmark and prints the timings"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        directory = shared_cache.directory
+        order = make_order(args.items)
+        urls = {
+            "order": f"/api/orders/{order.id}",
+            "summary": f"/api/orders/{order.id}?view=summary",
+            "items": f"/api/orders/{order.id}/items",
+            "item": f"/api/orders/{order.id}/items/{order.items[0].id}",
+        }
+        client = app.test_client()
+        print(f"Order with {args.items} Items, microseconds per request")
+        print(f"{'request':<10} {'uncached':>10} {'documents':>10} {'response':>10} {'speedup':>8}")
+        try:
+            for name, url in urls.items():
+                timings = {}
+                for mode in ("uncached", "documents", "response"):
+                    configure(mode, directory)
+                    assert client.get(url).status_code == 200
+                    seconds = timeit.timeit(lambda u=url: client.get(u), number=args.repeat)
+                    timings[mode] = seconds * 1e6 / args.repeat
+                print(
+                    f"{name:<10} {timings['uncached']:>10.0f} {timings['documents']:>10.0f} "
+                    f"{timings['response']:>10.0f} {timings['uncached'] / timings['response']:>7.1f}x"
+                )
+        finally:
+            db.session.delete(order)
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,9 @@ from flask import Flask
 from flask_restx import Api
 from service import config
 from service.common import log_handlers
+from service.common import representation
+from service.common.representation import output_json
+from service.common.compression import compressor
 
 # NOTE: Do not change the order of this code
 # The Flask app must be created
@@ -44,7 +47,7 @@ api = None  # pylint: disable=invalid-name
 ############################################################
 # Initialize the Flask instance
 ############################################################
-def create_app():
+def create_app():  # pylint: disable=too-many-locals
     """Initialize the core application."""
     # Create Flask application
     app = Flask(__name__)
@@ -68,18 +71,43 @@ def create_app():
         authorizations=authorizations,
         prefix="/api",
     )
+    # responses are encoded with orjson, a declared dependency
+    api.representation("application/json")(output_json)
 
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
-    from service.models import db
+    from service.models import db, Order, Item, order_readers
 
     db.init_app(app)
+    Order.configure_loading(
+        app.config["ORDER_ITEMS_COLLECTION_LOADING"],
+        app.config["ORDER_ITEMS_SINGLE_LOADING"],
+    )
+    Item.configure_search(app.config["ITEM_SEARCH_BACKEND"])
+    order_readers.configure_reader(app.config["ORDER_LIST_READER"])
 
     with app.app_context():
         # Dependencies require we import the routes AFTER the Flask app is created
         # pylint: disable=wrong-import-position, wrong-import-order, unused-import
         from service import routes, models  # noqa: F401 E402
         from service.common import error_handlers, cli_commands  # noqa: F401, E402
+        from service.common.cache import order_cache, response_cache, missing_cache  # noqa: E402
+        from service.common.shared_cache import shared_cache  # noqa: E402
+        from service.common.singleflight import flights  # noqa: E402
+        from service.common.assets import asset_store  # noqa: E402
+
+        order_cache.configure(app.config["ORDER_CACHE_MAX_BYTES"], app.config["ORDER_CACHE_TTL"])
+        response_cache.configure(app.config["RESPONSE_CACHE_MAX_BYTES"], app.config["RESPONSE_CACHE_TTL"])
+        missing_cache.configure(app.config["MISSING_CACHE_MAX_BYTES"], app.config["MISSING_CACHE_TTL"])
+        flights.enabled = app.config["SINGLE_FLIGHT"]
+        shared_cache.configure(
+            app.config["SHARED_CACHE_DIR"], app.config["SHARED_CACHE_MAX_BYTES"], app.config["SHARED_CACHE_TTL"]
+        )
+        compressor.configure(
+            app.config["COMPRESSION"], app.config["COMPRESSION_MIN_SIZE"], app.config["COMPRESSION_LEVEL"]
+        )
+        app.after_request(compressor.compress)
+        asset_store.configure(app.config["ASSET_DIR"])
 
         try:
             db.create_all()
@@ -95,6 +123,8 @@ def create_app():
         app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
         app.logger.info(70 * "*")
 
+        if representation.orjson is None:  # pragma: no cover
+            app.logger.warning("orjson is not installed: responses are encoded with the json module")
         app.logger.info("Service initialized!")
 
         return app
@@ -0,0 +1,184 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Static Assets
+
+build_assets() copies the files of service/static to content-hashed
+names, e.g. js/rest_api.3f2a9c1b04.js, next to gzip (and brotli)
+precompressed copies, and writes a manifest that maps the source paths
+to the hashed ones. A hashed file never changes, so it is served with a
+one year immutable Cache-Control, and index.html is rewritten to point at
+the hashed files while it is itself revalidated on every load.
+
+The assets are built once, at image build time, into ASSET_DIR:
+    python -m service.common.assets [SOURCE] [TARGET]
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+from flask import abort, send_from_directory
+from service import config
+from service.common import compression, status
+
+MANIFEST = "manifest.json"
+HASH_LENGTH = 10
+
+# Hashed assets never change, so browsers and proxies may keep them a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# src="static/js/rest_api.js" and href="static/css/..." in the page
+STATIC_URL = re.compile(r'((?:src|href)\s*=\s*")static/([^"]+)(")')
+
+
+def hashed_name(path: str, data: bytes) -> str:
+    """Returns the name of a file with the hash of its contents"""
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    root, ext = os.path.splitext(path)
+    return f"{root}.{digest}{ext}"
+
+
+def _write(path: str, data: bytes) -> None:
+    """Writes a file, making its directory when needed"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def build_assets(source: str, target: str, level: int = 9) -> dict:
+    """
+    Builds the hashed and precompressed copies of the static files
+
+    Args:
+        source (str): the directory of the static files
+        target (str): the directory the assets are written to
+        level (int): the gzip level of the precompressed copies
+
+    Returns:
+        dict: the manifest, source path -> hashed path and encodings
+    """
+    if not os.path.isdir(source):
+        raise FileNotFoundError(f"No static files in {source}")
+    manifest = {}
+    for folder, _, names in os.walk(source):
+        for name in sorted(names):
+            full_path = os.path.join(folder, name)
+            path = os.path.relpath(full_path, source).replace(os.sep, "/")
+            with open(full_path, "rb") as file:
+                data = file.read()
+            hashed = hashed_name(path, data)
+            _write(os.path.join(target, hashed), data)
+            encodings = []
+            mimetype = mimetypes.guess_type(path)[0] or ""
+            if mimetype.startswith(compression.COMPRESSIBLE_TYPES):
+                for encoding in compression.available_encodings():
+                    body = compression.compress_bytes(data, encoding, level)
+                    if len(body) < len(data):
+                        _write(os.path.join(target, hashed + SUFFIXES[encoding]), body)
+                        encodings.append(encoding)
+            manifest[path] = {"path": hashed, "encodings": encodings}
+    with open(os.path.join(target, MANIFEST), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+######################################################################
+#  A S S E T   S T O R E
+######################################################################
+class AssetStore:
+    """
+    Serves the built assets of a directory
+
+    Args:
+        directory (str): where build_assets() wrote the assets, an empty
+            or unbuilt directory leaves the pages on their static files
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory
+        self.manifest = {}
+        self.encodings = {}
+        self._pages = {}
+
+    def configure(self, directory: str) -> None:
+        """Loads the manifest of the assets built in a directory"""
+        self.directory = directory
+        self.manifest, self.encodings, self._pages = {}, {}, {}
+        path = os.path.join(directory, MANIFEST) if directory else None
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                self.manifest = json.load(file)
+            self.encodings = {entry["path"]: entry["encodings"] for entry in self.manifest.values()}
+
+    @property
+    def built(self) -> bool:
+        """Returns True when there are built assets to serve"""
+        return bool(self.manifest)
+
+    def page(self, name: str) -> str:
+        """Returns a page with its static URLs pointing at the hashed assets"""
+        if name not in self._pages:
+            with open(os.path.join(self.directory, self.manifest[name]["path"]), encoding="utf-8") as file:
+                html = file.read()
+            self._pages[name] = STATIC_URL.sub(self._rewrite, html)
+        return self._pages[name]
+
+    def _rewrite(self, match) -> str:
+        """Replaces one static URL with the URL of its hashed asset"""
+        entry = self.manifest.get(match.group(2))
+        if entry is None:
+            return match.group(0)
+        return f"{match.group(1)}assets/{entry['path']}{match.group(3)}"
+
+    def send(self, filename: str):
+        """
+        Returns the response of a hashed asset, precompressed when accepted
+
+        Raises:
+            NotFound: when the file is not one of the built assets
+        """
+        if filename not in self.encodings:
+            abort(status.HTTP_404_NOT_FOUND, f"Asset '{filename}' was not found.")
+        encoding = compression.negotiate(self.encodings[filename])
+        mimetype = mimetypes.guess_type(filename)[0]
+        stored = filename + SUFFIXES[encoding] if encoding else filename
+        response = send_from_directory(self.directory, stored, mimetype=mimetype, etag=True)
+        response.headers["Cache-Control"] = IMMUTABLE
+        if self.encodings[filename]:
+            response.vary.add("Accept-Encoding")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+
+# The assets served by the app, configured by create_app
+asset_store = AssetStore()
+
+
+def main(argv=None):
+    """Builds the assets from the command line"""
+    args = sys.argv[1:] if argv is None else argv
+    source = args[0] if args else config.STATIC_DIR
+    target = args[1] if len(args) > 1 else config.ASSET_DIR
+    manifest = build_assets(source, target)
+    print(f"Built {len(manifest)} assets in {target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Read-through Cache
+
+A bounded in-process LRU cache with a time to live and a memory budget
+in bytes. The least recently used entries are evicted once the budget
+is exceeded and entries older than the TTL are treated as missing.
+
+Readers take a token from the cache before they read the database and
+hand it back when they store what they read. Every invalidation moves
+the cache to a new generation, so a value read before a concurrent
+write committed is never stored after that write invalidated it.
+
+order_cache holds the JSON documents of Orders in front of the shared
+cache of the workers and both are invalidated after every commit that
+writes Orders or Items. response_cache holds the final bodies of the
+GET responses of Orders and Items in front of both and missing_cache
+remembers the ids that were looked up and not found.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from service.models.commit_hooks import after_commit
+from service.models import Order, Item
+from service.common import metrics
+from service.common.shared_cache import shared_cache
+
+logger = logging.getLogger("flask.app")
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by the size of its values
+
+    Args:
+        max_bytes (int): the memory budget, 0 disables the cache
+        ttl (float): seconds an entry stays fresh, 0 for no expiry
+        clock: returns the current time in seconds
+    """
+
+    def __init__(self, max_bytes: int = 0, ttl: float = 0, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Returns True when the cache has a memory budget"""
+        return self.max_bytes > 0
+
+    def configure(self, max_bytes: int, ttl: float) -> None:
+        """Sets the memory budget and the TTL and empties the cache"""
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clear()
+
+    @staticmethod
+    def size_of(value) -> int:
+        """Estimates the memory of a value by the length of its JSON"""
+        return len(json.dumps(value, separators=(",", ":"), default=str))
+
+    def token(self) -> int:
+        """Returns the token a reader passes to set() after reading"""
+        return self._generation
+
+    def get(self, key):
+        """Returns a cached value, or None when it is missing or stale"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires = entry
+            if expires is not None and self.clock() >= expires:
+                self._remove(key, size)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, token: int = None, size: int = None) -> bool:
+        """
+        Stores a value unless the cache was invalidated since token
+
+        Returns:
+            bool: True when the value was stored
+        """
+        if not self.enabled:
+            return False
+        size = self.size_of(value) if size is None else size
+        if size > self.max_bytes:
+            return False
+        expires = self.clock() + self.ttl if self.ttl else None
+        with self._lock:
+            if token is not None and token != self._generation:
+                return False
+            if key in self._entries:
+                self._remove(key, self._entries[key][1])
+            self._entries[key] = (value, size, expires)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, (_, old_size, _) = next(iter(self._entries.items()))
+                self._remove(old_key, old_size)
+                self.evictions += 1
+        return True
+
+    def _remove(self, key, size) -> None:
+        """Drops an entry while holding the lock"""
+        del self._entries[key]
+        self._bytes -= size
+
+    def delete(self, *keys) -> None:
+        """Invalidates some keys"""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(keys)
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._remove(key, entry[1])
+
+    def clear(self) -> None:
+        """Invalidates every key"""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Returns the counters of the cache"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+######################################################################
+#  O R D E R   C A C H E
+######################################################################
+# (generation, version, JSON document) of an Order keyed by its id. The
+# generation is the one of the shared cache the document was read at, so
+# a write committed by another worker makes the entry stale here too.
+# Configured by create_app.
+order_cache = LRUCache()
+metrics.register("order_cache", order_cache.stats)
+
+# (generation, ETag, encoded body) of the responses of GET requests keyed
+# by the resource, the Order it belongs to and the variant asked for, so
+# a hit skips the database, marshalling and JSON encoding. Entries of an
+# older generation are stale and left to be evicted.
+response_cache = LRUCache()
+metrics.register("response_cache", response_cache.stats)
+
+# The generation of the Order (of all Orders for an Item) at the time a
+# lookup found no Order or Item keyed by the resource and its ids, so
+# repeated lookups of missing ids are answered without a query until a
+# write could have created them
+missing_cache = LRUCache()
+metrics.register("missing_cache", missing_cache.stats)
+# the memory of an entry: the key tuple and a short generation string
+MISSING_ENTRY_SIZE = 160
+
+
+def changed_orders(changes):
+    """
+    Returns the ids of the Orders that some committed changes touched
+
+    Returns None when a bulk statement touched Orders or Items that are
+    not known individually.
+    """
+    order_ids = set()
+    for change in changes:
+        if change.model is Order:
+            if change.id is None:
+                return None
+            order_ids.add(change.id)
+        elif change.model is Item:
+            if change.id is None:
+                return None
+            # an Item moved to another Order changes both of them
+            order_ids.add(change.values.get("order_id"))
+            order_ids.add(change.previous.get("order_id"))
+    order_ids.discard(None)
+    return order_ids
+
+
+@after_commit
+def invalidate_orders(changes):
+    """Drops the cached Orders that a commit wrote, in every worker"""
+    order_ids = changed_orders(changes)
+    if order_ids is None:
+        shared_cache.clear()
+        order_cache.clear()
+        response_cache.clear()
+        missing_cache.clear()
+    elif order_ids:
+        shared_cache.invalidate(*order_ids)
+        order_cache.delete(*order_ids)
@@ -16,8 +16,11 @@
 """
 Flask CLI Command Extensions
 """
+import click
 from flask import current_app as app  # Import Flask application
 from service.models.persistent_base import db
+from service.models import migrations, order_rollup
+from service.common.shared_cache import shared_cache
 
 
 ######################################################################
@@ -34,3 +37,50 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+    # the cached documents are of Orders that no longer exist
+    shared_cache.purge()
+
+
+######################################################################
+# Commands to migrate the schema of an existing database
+# Usage:
+#   flask db-upgrade [--target VERSION]
+#   flask db-downgrade [--target VERSION]
+######################################################################
+@app.cli.command("db-upgrade")
+@click.option("--target", type=int, default=None, help="Stop at this version")
+def db_upgrade(target):
+    """
+    Applies the pending schema migrations without dropping any data
+    """
+    for migration in migrations.upgrade(target):
+        click.echo(f"Applied {migration.version}: {migration.description}")
+    click.echo(f"Schema is at version {migrations.current_version()}")
+
+
+@app.cli.command("db-downgrade")
+@click.option(
+    "--target", type=int, default=None, help="Go back to this version (default: previous)"
+)
+def db_downgrade(target):
+    """
+    Reverts schema migrations back to a version
+    """
+    for migration in migrations.downgrade(target):
+        click.echo(f"Reverted {migration.version}: {migration.description}")
+    click.echo(f"Schema is at version {migrations.current_version()}")
+
+
+######################################################################
+# Command to recompute the daily Order rollup
+# Usage:
+#   flask rollup-rebuild
+######################################################################
+@app.cli.command("rollup-rebuild")
+def rollup_rebuild():
+    """
+    Recomputes the daily Order rollup from the Orders
+    """
+    with db.engine.begin() as connection:
+        buckets = order_rollup.rebuild(connection)
+    click.echo(f"Rebuilt {buckets} rollup buckets")
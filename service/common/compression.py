@@ -0,0 +1,182 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Response Compression
+
+Compresses responses with brotli, when the brotli package is installed,
+or gzip, as negotiated with the Accept-Encoding header of the request.
+Bodies below a size threshold and media types that do not compress are
+sent as they are. Streamed responses are compressed chunk by chunk as
+they are generated, so a listing read from a server side cursor stays
+streamed.
+
+The bytes of a compressed response differ but its representation does
+not, so a strong ETag is made weak and If-None-Match still matches it.
+
+Usage:
+    compressor.configure(enabled=True, min_size=1024, level=6)
+    app.after_request(compressor.compress)
+"""
+import gzip
+import threading
+import zlib
+from flask import request
+from service.common import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# Media types worth compressing, matched by prefix
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "image/svg+xml",
+    "text/",
+)
+
+
+def available_encodings() -> list:
+    """Returns the content codings that can be produced, best first"""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def negotiate(encodings) -> str:
+    """
+    Returns the best of some content codings accepted by the request
+
+    Args:
+        encodings (list): the codings that can be sent, best first
+
+    Returns:
+        str: the coding to use, or None to send the body as it is
+    """
+    return request.accept_encodings.best_match(encodings)
+
+
+def brotli_quality(level: int) -> int:
+    """Maps a gzip level (1-9) to a brotli quality of similar cost"""
+    return min(11, max(0, level - 2))
+
+
+def compress_bytes(data: bytes, encoding: str, level: int = 6) -> bytes:
+    """Compresses a whole body with gzip or brotli"""
+    if encoding == "br":
+        return brotli.compress(data, quality=brotli_quality(level))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_chunks(chunks, encoding: str, level: int = 6):
+    """Compresses an iterator of byte strings as they are produced"""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=brotli_quality(level))
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+######################################################################
+#  R E S P O N S E   C O M P R E S S O R
+######################################################################
+class ResponseCompressor:
+    """
+    Compresses the responses of the service after each request
+
+    Args:
+        enabled (bool): False sends every response as it is
+        min_size (int): smallest body in bytes that is compressed
+        level (int): the gzip level, 1 (fastest) to 9 (smallest)
+    """
+
+    def __init__(self, enabled: bool = True, min_size: int = 1024, level: int = 6):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.level = level
+        self._lock = threading.Lock()
+        self.compressed = self.streamed = self.bytes_in = self.bytes_out = 0
+
+    def configure(self, enabled: bool, min_size: int, level: int) -> None:
+        """Changes the settings of the compressor"""
+        self.enabled = enabled
+        self.min_size = min_size
+        self.level = level
+
+    def compressible(self, response) -> bool:
+        """Returns True when a response could be compressed"""
+        return (
+            self.enabled
+            and 200 <= response.status_code < 300
+            and response.status_code not in (204, 206)
+            and not response.direct_passthrough
+            and "Content-Encoding" not in response.headers
+            and (response.mimetype or "").startswith(COMPRESSIBLE_TYPES)
+        )
+
+    def compress(self, response):
+        """Compresses a response when the client accepts it (after_request)"""
+        if not self.compressible(response):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate(available_encodings())
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_chunks(response.iter_encoded(), encoding, self.level)
+            response.headers.pop("Content-Length", None)
+            with self._lock:
+                self.streamed += 1
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            body = compress_bytes(data, encoding, self.level)
+            response.set_data(body)
+            with self._lock:
+                self.compressed += 1
+                self.bytes_in += len(data)
+                self.bytes_out += len(body)
+
+        response.headers["Content-Encoding"] = encoding
+        tag, weak = response.get_etag()
+        if tag and not weak:
+            response.set_etag(tag, weak=True)
+        return response
+
+    def stats(self) -> dict:
+        """Returns the counters of the compressed responses"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "encodings": available_encodings(),
+                "compressed": self.compressed,
+                "streamed": self.streamed,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+            }
+
+
+# Compresses the responses of the app, configured by create_app
+compressor = ResponseCompressor()
+metrics.register("compression", compressor.stats)
@@ -18,8 +18,9 @@ Module: error_handlers
 """
 # from flask import jsonify
 from flask import current_app as app  # Import Flask application
+from flask import request
 from service import api
-from service.models.persistent_base import DataValidationError
+from service.models.persistent_base import DataValidationError, StaleVersionError
 from . import status
 
 
@@ -36,3 +37,21 @@ def request_validation_error(error):
         "error": "Bad Request",
         "message": message,
     }, status.HTTP_400_BAD_REQUEST
+
+
+@api.errorhandler(StaleVersionError)
+def stale_version_error(error):
+    """Handles writes of records that another request changed first"""
+    message = str(error)
+    app.logger.warning(message)
+    if request.if_match:
+        return {
+            "status_code": status.HTTP_412_PRECONDITION_FAILED,
+            "error": "Precondition Failed",
+            "message": message,
+        }, status.HTTP_412_PRECONDITION_FAILED
+    return {
+        "status_code": status.HTTP_409_CONFLICT,
+        "error": "Conflict",
+        "message": message,
+    }, status.HTTP_409_CONFLICT
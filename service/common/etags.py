@@ -0,0 +1,81 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Entity Tags
+
+Strong ETags derived from the version counter of a record. Because the
+tag only depends on the id, the version and the requested projection,
+a conditional GET can be answered with 304 Not Modified after reading
+the version alone, without loading or serializing the record.
+
+The If-Match header of a write is checked against the version the
+record is read at, and the write itself is guarded by that version, so
+a client only overwrites the version it has seen.
+
+Usage:
+    tag = make_etag("order", order.id, order.version, fields)
+    if not_modified(tag):
+        return "", status.HTTP_304_NOT_MODIFIED, etag_header(tag)
+    if not version_matches(make_etag("order", order.id, order.version)):
+        return "", status.HTTP_412_PRECONDITION_FAILED
+"""
+import hashlib
+from flask import request
+from werkzeug.http import quote_etag
+
+
+def make_etag(kind: str, key, version, variant=None) -> str:
+    """
+    Returns the (unquoted) strong ETag of a version of a record
+
+    Args:
+        kind (str): the type of the record, e.g. "order"
+        key: the primary key of the record
+        version (int): the version counter of the record
+        variant (list): the fields of a partial representation, if any
+    """
+    tag = f"{kind}-{key}-v{version}"
+    if variant:
+        digest = hashlib.sha1(",".join(variant).encode("utf-8")).hexdigest()
+        tag = f"{tag}-{digest[:10]}"
+    return tag
+
+
+def etag_header(tag: str) -> dict:
+    """Returns the response header that carries an ETag"""
+    return {"ETag": quote_etag(tag)}
+
+
+def not_modified(tag: str) -> bool:
+    """Returns True when the If-None-Match header of the request matches a tag"""
+    # If-None-Match uses the weak comparison (RFC 9110, 13.1.2)
+    return request.if_none_match.contains_weak(tag)
+
+
+def version_matches(tag: str) -> bool:
+    """
+    Returns False when the If-Match header of the request names other versions
+
+    The tags of partial representations of the version match too, and so do
+    weak tags: they come from compressing the same representation.
+    """
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return True
+    return any(
+        candidate == tag or candidate.startswith(f"{tag}-")
+        for candidate in if_match.as_set(include_weak=True)
+    )
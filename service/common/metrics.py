@@ -0,0 +1,92 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Service Metrics
+
+Components register a function that returns their counters and
+GET /metrics reports all of them as one JSON document.
+
+Usage:
+    metrics.register("order_cache", order_cache.stats)
+"""
+import threading
+
+_providers = {}
+
+# upper bounds, in milliseconds, of the buckets of a latency histogram
+LATENCY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def register(name: str, provider) -> None:
+    """Registers a function that returns the counters of a component"""
+    _providers[name] = provider
+
+
+def snapshot() -> dict:
+    """Returns the current counters of every registered component"""
+    return {name: provider() for name, provider in sorted(_providers.items())}
+
+
+class LatencyStats:
+    """
+    Counts how long some operations took, by name and outcome
+
+    Every name keeps its count, the count of each outcome, the total and
+    the largest latency, and a histogram of the latencies in
+    LATENCY_BUCKETS, the last bucket counting everything slower.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def observe(self, name: str, seconds: float, outcome: str = "ok") -> None:
+        """Records how long an operation took and how it ended"""
+        millis = seconds * 1000
+        bucket = next(
+            (index for index, bound in enumerate(LATENCY_BUCKETS) if millis <= bound),
+            len(LATENCY_BUCKETS),
+        )
+        with self._lock:
+            stats = self._stats.setdefault(
+                name,
+                {"count": 0, "outcomes": {}, "total_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS) + 1)},
+            )
+            stats["count"] += 1
+            stats["outcomes"][outcome] = stats["outcomes"].get(outcome, 0) + 1
+            stats["total_ms"] += millis
+            stats["max_ms"] = max(stats["max_ms"], millis)
+            stats["buckets"][bucket] += 1
+
+    def stats(self) -> dict:
+        """Returns the latencies of every name, with the mean and the histogram"""
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}ms"]
+        with self._lock:
+            return {
+                name: {
+                    "count": stats["count"],
+                    "outcomes": dict(stats["outcomes"]),
+                    "mean_ms": round(stats["total_ms"] / stats["count"], 3),
+                    "max_ms": round(stats["max_ms"], 3),
+                    "histogram": dict(zip(labels, stats["buckets"])),
+                }
+                for name, stats in sorted(self._stats.items())
+            }
+
+    def clear(self) -> None:
+        """Forgets every latency"""
+        with self._lock:
+            self._stats.clear()
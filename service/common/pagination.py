@@ -0,0 +1,236 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Keyset (cursor) pagination
+
+Pages are addressed by the sort key values of the row at the edge of the
+previous page instead of by an offset, so every page costs one indexed
+range scan no matter how deep into the result set the client is.
+
+A cursor is an opaque url-safe token that records the sort keys it was
+issued for, the key values of the edge row and the direction to move in.
+
+NULL sort keys count as larger than every value, as PostgreSQL and its
+indexes order them by default: NULLS LAST ascending, NULLS FIRST
+descending. The position of a row with a NULL key is sought with IS NULL.
+"""
+import base64
+import binascii
+import json
+from collections import namedtuple
+from datetime import date
+from urllib.parse import urlencode
+
+from flask import request
+from sqlalchemy import and_, or_, false
+from service.models.persistent_base import db, DataValidationError
+
+NEXT = "next"
+PREV = "prev"
+
+Page = namedtuple("Page", ["items", "next_cursor", "prev_cursor"])
+
+
+######################################################################
+#  C U R S O R   E N C O D I N G
+######################################################################
+def _key_name(column) -> str:
+    """Returns the name a sort key is recorded under in a cursor"""
+    return column.key
+
+
+def _dump_value(value):
+    """Converts a sort key value into something JSON can carry"""
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _load_value(column, value):
+    """Converts a cursor value back into the Python type of the column"""
+    if value is not None and column.type.python_type is date:
+        return date.fromisoformat(value)
+    return value
+
+
+def encode_cursor(sort_keys, row, direction) -> str:
+    """
+    Creates an opaque cursor pointing at a row
+
+    Args:
+        sort_keys (list): (column, descending) pairs the page is sorted by
+        row: the model instance at the edge of the page
+        direction (str): NEXT to continue after the row, PREV to go before it
+    """
+    payload = {
+        "k": [_key_name(column) for column, _ in sort_keys],
+        "v": [_dump_value(getattr(row, column.key)) for column, _ in sort_keys],
+        "d": direction,
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(sort_keys, cursor: str):
+    """
+    Decodes a cursor issued by encode_cursor
+
+    Returns:
+        tuple: the key values and the direction of the cursor
+
+    Raises:
+        DataValidationError: if the cursor is malformed or was issued
+            for a different sort order
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        names, values, direction = payload["k"], payload["v"], payload["d"]
+        if names != [_key_name(column) for column, _ in sort_keys]:
+            raise DataValidationError(
+                "Invalid cursor: it was issued for a different sort order"
+            )
+        if direction not in (NEXT, PREV) or len(values) != len(sort_keys):
+            raise DataValidationError("Invalid cursor: malformed position")
+        values = [
+            _load_value(column, value)
+            for (column, _), value in zip(sort_keys, values)
+        ]
+    except (
+        binascii.Error,
+        UnicodeError,
+        ValueError,
+        KeyError,
+        TypeError,
+    ) as error:
+        raise DataValidationError(f"Invalid cursor: {cursor}") from error
+
+    return values, direction
+
+
+######################################################################
+#  K E Y S E T   Q U E R I E S
+######################################################################
+def _larger(column, value):
+    """Returns the predicate for sort key values larger than a value, NULLs included"""
+    if value is None:
+        return false()
+    if getattr(column, "nullable", True):
+        return or_(column > value, column.is_(None))
+    return column > value
+
+
+def _smaller(column, value):
+    """Returns the predicate for sort key values smaller than a value"""
+    if value is None:
+        return column.is_not(None)
+    return column < value
+
+
+def _equal(column, value):
+    """Returns the predicate for a sort key value, which may be NULL"""
+    return column.is_(None) if value is None else column == value
+
+
+def _seek(sort_keys, values, forward: bool):
+    """
+    Builds the predicate that selects rows after (or before) a position
+
+    For keys (a DESC, b DESC) this expands to:
+        a < :a OR (a = :a AND b < :b)
+    which every database can serve from a matching composite index.
+    """
+    clauses = []
+    for index, (column, descending) in enumerate(sort_keys):
+        value = values[index]
+        # moving forward on a descending key means smaller values
+        if descending == forward:
+            step = _smaller(column, value)
+        else:
+            step = _larger(column, value)
+        equal = [_equal(sort_keys[i][0], values[i]) for i in range(index)]
+        clauses.append(and_(*equal, step))
+    return or_(*clauses)
+
+
+def ordering(column, descending: bool):
+    """Returns the ORDER BY criterion of a sort key, NULLs as the largest values"""
+    if descending:
+        return column.desc().nulls_first()
+    return column.asc().nulls_last()
+
+
+def _ordering(sort_keys, forward: bool) -> list:
+    """Returns the ORDER BY criteria for walking the keys in a direction"""
+    return [ordering(column, descending == forward) for column, descending in sort_keys]
+
+
+def keyset_paginate(query, sort_keys, limit: int, cursor: str = None) -> Page:
+    """
+    Returns one page of a query using keyset pagination
+
+    Args:
+        query: the filtered ORM query or Core SELECT to page through (must
+            not be ordered yet)
+        sort_keys (list): (column, descending) pairs ending in a unique column
+        limit (int): the maximum number of rows on the page
+        cursor (str): the cursor returned with the previous page, if any
+    """
+    forward = True
+    if cursor:
+        values, direction = decode_cursor(sort_keys, cursor)
+        forward = direction == NEXT
+        query = query.filter(_seek(sort_keys, values, forward))
+
+    # fetch one extra row to learn whether there is another page
+    query = query.order_by(*_ordering(sort_keys, forward)).limit(limit + 1)
+    # an ORM query runs itself, a Core SELECT is run by the session
+    rows = query.all() if hasattr(query, "all") else db.session.execute(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if not forward:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or not forward:
+            next_cursor = encode_cursor(sort_keys, rows[-1], NEXT)
+        if cursor and (has_more or forward):
+            prev_cursor = encode_cursor(sort_keys, rows[0], PREV)
+
+    return Page(rows, next_cursor, prev_cursor)
+
+
+def page_headers(page: Page) -> dict:
+    """
+    Returns the response headers that advertise the neighbouring pages
+
+    The raw cursors are sent in X-Next-Cursor / X-Prev-Cursor and the
+    complete URLs in a standard Link header.
+    """
+    headers = {}
+    links = []
+    for rel, cursor in (("next", page.next_cursor), ("prev", page.prev_cursor)):
+        if not cursor:
+            continue
+        headers[f"X-{rel.capitalize()}-Cursor"] = cursor
+        args = request.args.to_dict(flat=False)
+        args["cursor"] = [cursor]
+        links.append(f'<{request.base_url}?{urlencode(args, doseq=True)}>; rel="{rel}"')
+    if links:
+        headers["Link"] = ", ".join(links)
+    return headers
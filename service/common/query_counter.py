@@ -0,0 +1,60 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Query Counter
+
+Records the SQL statements sent to the database while it is active so
+that tests can assert how many round trips a code path costs.
+
+Usage:
+    with QueryCounter() as counter:
+        client.get("/api/orders")
+    assert counter.count == 2
+"""
+from sqlalchemy import event
+from service.models.persistent_base import db
+
+
+class QueryCounter:
+    """Context manager that counts the statements executed on the engine"""
+
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        """Returns the number of statements executed so far"""
+        return len(self.statements)
+
+    def matching(self, text: str) -> list:
+        """Returns the statements that contain some text"""
+        return [statement for statement in self.statements if text in statement]
+
+    def _record(self, conn, cursor, statement, *args):
+        """Engine event listener that remembers each statement"""
+        # pylint: disable=unused-argument
+        self.statements.append(statement)
+
+    def __enter__(self):
+        if self.engine is None:
+            self.engine = db.engine
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+        return False
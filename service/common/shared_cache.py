@@ -0,0 +1,281 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Shared Cache
+
+A cache of pre-encoded JSON documents that every gunicorn worker on a
+host reads from. The documents are files in a directory that should be
+on a tmpfs such as /dev/shm, so reading one is a copy out of shared
+memory, and they are replaced atomically with os.replace().
+
+Keys are versioned with a generation counter per Order that lives in a
+memory-mapped file. Invalidating an Order bumps its counter, which every
+worker sees on its next read, and the documents written under the old
+generation can no longer be found. A reader takes the generation before
+it reads the database and writes its document under that generation, so
+a document read before a concurrent write committed is never visible
+after it. Bumping the epoch invalidates every key at once.
+
+Writes made by other hosts are only seen once a document is older than
+the TTL. Stale documents are deleted when the directory grows over its
+budget. The default directory is named after a hash of the database URI,
+so instances of the service that use different databases on the same
+host never share documents.
+"""
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from service.common import metrics
+
+logger = logging.getLogger("flask.app")
+
+SLOTS = 1 << 16
+_COUNTER = struct.Struct("<Q")
+GENERATIONS_FILE = "generations"
+
+
+def default_directory(database_uri: str) -> str:
+    """Returns a directory for a database on the shared memory tmpfs when there is one"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    digest = hashlib.sha256(database_uri.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(base, f"orders-cache-{digest}")
+
+
+######################################################################
+#  G E N E R A T I O N   T A B L E
+######################################################################
+class GenerationTable:
+    """
+    Invalidation counters shared by the processes that map the same file
+
+    Slot 0 holds the epoch, the last slot counts the invalidations of any
+    key and every integer key is mapped to one of the slots in between;
+    two keys that share a slot are just invalidated together. Without a
+    path the counters live in this process only.
+    """
+
+    def __init__(self, path: str = None, slots: int = SLOTS):
+        self.slots = slots
+        self.path = path
+        size = (slots + 2) * _COUNTER.size
+        if path is None:
+            self._fd = None
+            self._map = bytearray(size)
+            return
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def _slot(self, key: int) -> int:
+        """Returns the slot that holds the counter of an integer key"""
+        if key is None:
+            return self.slots + 1
+        # not hash(), which differs between processes for strings
+        return 1 + int(key) % self.slots
+
+    def generation(self, key=None) -> str:
+        """Returns the current generation of a key, or of all keys for None"""
+        epoch = _COUNTER.unpack_from(self._map, 0)[0]
+        counter = _COUNTER.unpack_from(self._map, self._slot(key) * _COUNTER.size)[0]
+        return f"{epoch}.{counter}"
+
+    def _increment(self, slots) -> None:
+        """Adds one to some slots while holding the file lock"""
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for slot in slots:
+                offset = slot * _COUNTER.size
+                value = _COUNTER.unpack_from(self._map, offset)[0]
+                _COUNTER.pack_into(self._map, offset, value + 1)
+        finally:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def bump(self, *keys) -> None:
+        """Invalidates some keys"""
+        self._increment({self._slot(key) for key in keys} | {self._slot(None)})
+
+    def bump_all(self) -> None:
+        """Invalidates every key"""
+        self._increment([0])
+
+    def close(self) -> None:
+        """Unmaps the shared file"""
+        if self._fd is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._fd = None
+
+
+######################################################################
+#  S H A R E D   C A C H E
+######################################################################
+class SharedCache:
+    """
+    Pre-encoded documents shared by the workers of a host
+
+    Args:
+        directory (str): where the documents live, None keeps only the
+            generation counters in this process and caches nothing
+        max_bytes (int): the size the documents may grow to on disk
+        ttl (float): seconds a document stays fresh, 0 for no expiry
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = 0, ttl: float = 0):
+        self.directory = None
+        self.max_bytes = 0
+        self.ttl = 0
+        self.generations = GenerationTable()
+        self._lock = threading.Lock()
+        self._written = 0
+        self.hits = self.misses = self.writes = self.evictions = 0
+        self.configure(directory, max_bytes, ttl)
+
+    @property
+    def enabled(self) -> bool:
+        """Returns True when documents are stored"""
+        return self.directory is not None and self.max_bytes > 0
+
+    def configure(self, directory: str, max_bytes: int, ttl: float = 0) -> None:
+        """Points the cache at a directory shared by the workers"""
+        self.generations.close()
+        self.directory = directory or None
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        if self.directory is None:
+            self.generations = GenerationTable()
+            return
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self.generations = GenerationTable(os.path.join(self.directory, GENERATIONS_FILE))
+
+    def generation(self, key=None) -> str:
+        """
+        Returns the generation a reader must pass to set()
+
+        Without a key it is the generation of all keys, which changes
+        whenever any key is invalidated.
+        """
+        return self.generations.generation(key)
+
+    def _path(self, namespace: str, key, generation: str) -> str:
+        """Returns the file that holds a document"""
+        return os.path.join(self.directory, f"{namespace}-{key}-{generation}")
+
+    def get(self, namespace: str, key, generation: str = None):
+        """Returns the bytes of a current document, or None"""
+        if not self.enabled:
+            return None
+        generation = generation or self.generation(key)
+        try:
+            with open(self._path(namespace, key, generation), "rb") as file:
+                if self.ttl and os.fstat(file.fileno()).st_mtime < time.time() - self.ttl:
+                    # written before a change made by another host, maybe
+                    data = None
+                else:
+                    data = file.read()
+        except FileNotFoundError:
+            data = None
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def set(self, namespace: str, key, data: bytes, generation: str) -> bool:
+        """Stores the document of a key as of the generation it was read at"""
+        if not self.enabled or len(data) > self.max_bytes:
+            return False
+        path = self._path(namespace, key, generation)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(data)
+        os.replace(temporary, path)
+        self.writes += 1
+        with self._lock:
+            self._written += len(data)
+            sweep = self._written > self.max_bytes // 10
+            if sweep:
+                self._written = 0
+        if sweep:
+            self.sweep()
+        return True
+
+    def invalidate(self, *keys) -> None:
+        """Makes the documents of some keys unreachable in every worker"""
+        self.generations.bump(*keys)
+
+    def clear(self) -> None:
+        """Makes every document unreachable in every worker"""
+        self.generations.bump_all()
+
+    def purge(self) -> None:
+        """Deletes every document, e.g. after the database was recreated"""
+        self.clear()
+        if self.directory is not None:
+            # none of the documents is of the new epoch
+            self.sweep()
+
+    def sweep(self) -> None:
+        """Deletes stale documents, then the oldest ones over the budget"""
+        documents = []
+        for entry in os.scandir(self.directory):
+            if entry.name == GENERATIONS_FILE or entry.name.endswith(".tmp"):
+                continue
+            namespace_key, _, generation = entry.name.rpartition("-")
+            key = namespace_key.partition("-")[2]
+            try:
+                stat = entry.stat()
+                if generation != self.generation(int(key)):
+                    os.remove(entry.path)
+                    continue
+            except (FileNotFoundError, ValueError):
+                continue
+            documents.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in documents)
+        for _, size, path in sorted(documents):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self) -> dict:
+        """Returns the counters of this worker"""
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+
+# Documents of Orders and of their Item lists keyed by Order id,
+# configured by create_app
+shared_cache = SharedCache()
+metrics.register("shared_cache", shared_cache.stats)
@@ -0,0 +1,108 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Single Flight
+
+Coalesces identical concurrent reads within a worker. The first request
+for a key runs the read and every request for the same key that arrives
+while it is in flight waits for it and shares its result, or its error,
+instead of running the same query again.
+
+The shared result must not be changed by the callers, so reads return
+encoded bytes or values that are only read afterwards.
+
+Usage:
+    body = flights.do(("orders", args), lambda: encode(read_orders()))
+"""
+import threading
+from service.common import metrics
+
+
+class _Call:
+    """A read in flight and the requests waiting for it"""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs one read per key at a time and shares it with concurrent callers
+
+    Args:
+        enabled (bool): False runs every read on its own
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = self.coalesced = self.errors = 0
+
+    def do(self, key, function):
+        """
+        Returns the result of function() for a key
+
+        Raises:
+            the exception of the read when the read of the key failed
+        """
+        if not self.enabled:
+            return function()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as error:
+            call.error = error
+            self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> dict:
+        """Returns the counters of the coalesced reads"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+            }
+
+
+# Reads of GET requests keyed by route and arguments, configured by create_app
+flights = SingleFlight()
+metrics.register("singleflight", flights.stats)
@@ -3,6 +3,7 @@ Global Configuration for Application
 """
 import os
 import logging
+from service.common.shared_cache import default_directory
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -15,6 +16,70 @@ SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 # SQLALCHEMY_POOL_SIZE = 2
 
+# How the items of an Order are loaded (selectin, joined, subquery or lazy)
+ORDER_ITEMS_COLLECTION_LOADING = os.getenv("ORDER_ITEMS_COLLECTION_LOADING", "selectin")
+ORDER_ITEMS_SINGLE_LOADING = os.getenv("ORDER_ITEMS_SINGLE_LOADING", "joined")
+
+# How Order listings are read: core (Core SELECTs into lightweight records)
+# or orm (Order instances)
+ORDER_LIST_READER = os.getenv("ORDER_LIST_READER", "core")
+
+# Item name search backend: auto, trigram (PostgreSQL pg_trgm) or ngram
+ITEM_SEARCH_BACKEND = os.getenv("ITEM_SEARCH_BACKEND", "auto")
+
+# Read order statistics from the daily rollup when the filters allow it
+ORDER_STATS_FROM_ROLLUP = os.getenv("ORDER_STATS_FROM_ROLLUP", "true").lower() == "true"
+
+# Keyset pagination of order listings
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# Number of rows fetched per round trip when streaming order listings
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# POST /orders:batch: the most Orders per request and per transaction
+ORDER_BATCH_MAX_SIZE = int(os.getenv("ORDER_BATCH_MAX_SIZE", "10000"))
+ORDER_BATCH_CHUNK_SIZE = int(os.getenv("ORDER_BATCH_CHUNK_SIZE", "500"))
+# POST /orders/{id}/items:batch: the most Items per request, one transaction
+ITEM_BATCH_MAX_SIZE = int(os.getenv("ITEM_BATCH_MAX_SIZE", "5000"))
+# POST /orders:ship and the other bulk transitions: the most ids per request,
+# and the most Orders a filter may match
+TRANSITION_MAX_IDS = int(os.getenv("TRANSITION_MAX_IDS", "10000"))
+
+# In-process cache of serialized orders for GET /orders/{id}
+# (memory budget in bytes, 0 disables it, and time to live in seconds)
+ORDER_CACHE_MAX_BYTES = int(os.getenv("ORDER_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+ORDER_CACHE_TTL = float(os.getenv("ORDER_CACHE_TTL", "300"))
+
+# In-process cache of the Order and Item ids that were not found
+MISSING_CACHE_MAX_BYTES = int(os.getenv("MISSING_CACHE_MAX_BYTES", str(1024 * 1024)))
+MISSING_CACHE_TTL = float(os.getenv("MISSING_CACHE_TTL", "60"))
+
+# Coalesce identical concurrent reads within a worker into one query, which
+# needs workers that serve requests in threads (gunicorn --worker-class gthread)
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+
+# In-process cache of encoded GET responses (budget in bytes, 0 to disable)
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+# Cache of order documents shared by the workers of a host (directory on a
+# tmpfs, one per database by default, empty to disable, its size budget in
+# bytes and TTL in seconds)
+SHARED_CACHE_DIR = os.getenv("SHARED_CACHE_DIR", default_directory(DATABASE_URI))
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+SHARED_CACHE_TTL = float(os.getenv("SHARED_CACHE_TTL", "300"))
+
+# Compress responses of at least COMPRESSION_MIN_SIZE bytes with gzip or
+# brotli (when installed) for clients that accept it, at a gzip level of 1-9
+COMPRESSION = os.getenv("COMPRESSION", "true").lower() == "true"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+
+# Hashed and precompressed static assets built by python -m service.common.assets
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+ASSET_DIR = os.getenv("ASSET_DIR", os.path.join(os.path.dirname(__file__), "assets"))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
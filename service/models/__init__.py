@@ -18,6 +18,8 @@ Models for Wishlist and Item
 All of the models are stored in this package
 """
 
-from .persistent_base import db, DataValidationError
+from .persistent_base import db, DataValidationError, StaleVersionError, unit_of_work
 from .item import Item
 from .order import Order
+from .order_rollup import OrderRollup
+from . import commit_hooks, migrations, order_batch, order_readers, order_transitions
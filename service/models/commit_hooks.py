@@ -0,0 +1,131 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Commit Hooks
+
+Lets other modules react to the rows a transaction wrote once, and only
+once, that transaction has committed. The rows are collected as they are
+flushed and handed to every registered callback after the commit; a
+rollback throws them away.
+
+Each change records the column values the row had when it was flushed
+because the instances are expired by the time the commit is over, and
+the previous values of the columns an UPDATE changed, e.g. the Order an
+Item was moved out of.
+Bulk UPDATE and DELETE statements only know their target model, so they
+are reported with an id of None meaning "any row of this model".
+
+Usage:
+    @after_commit
+    def forget(changes):
+        for change in changes:
+            ...
+"""
+import logging
+from collections import namedtuple
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("flask.app")
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+
+Change = namedtuple("Change", ["action", "model", "id", "values", "previous"], defaults=({},))
+
+_PENDING = "pending_changes"
+_callbacks = []
+
+
+def after_commit(callback):
+    """Registers a callback that receives the changes of each commit"""
+    _callbacks.append(callback)
+    return callback
+
+
+def record(session, change: Change) -> None:
+    """Adds a change made outside of the unit of work (e.g. Core statements)"""
+    session.info.setdefault(_PENDING, []).append(change)
+
+
+def _snapshot(instance) -> dict:
+    """Returns the loaded column values of an instance without loading more"""
+    state = inspect(instance)
+    return {
+        attr.key: state.dict[attr.key]
+        for attr in state.mapper.column_attrs
+        if attr.key in state.dict
+    }
+
+
+def _previous(instance) -> dict:
+    """Returns the values the changed columns of an instance had before the flush"""
+    state = inspect(instance)
+    previous = {}
+    for attr in state.mapper.column_attrs:
+        deleted = state.attrs[attr.key].history.deleted
+        if deleted:
+            previous[attr.key] = deleted[0]
+    return previous
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed(session, flush_context):
+    """Remembers the rows written by a flush until the commit"""
+    # pylint: disable=unused-argument
+    for action, instances in (
+        (INSERT, session.new),
+        (UPDATE, session.dirty),
+        (DELETE, session.deleted),
+    ):
+        for instance in instances:
+            if action == UPDATE and not session.is_modified(instance):
+                continue
+            values = _snapshot(instance)
+            previous = _previous(instance) if action == UPDATE else {}
+            record(session, Change(action, type(instance), values.get("id"), values, previous))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk(orm_execute_state):
+    """Remembers the models touched by bulk UPDATE and DELETE statements"""
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        action = UPDATE if orm_execute_state.is_update else DELETE
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None:
+            record(orm_execute_state.session, Change(action, mapper.class_, None, {}))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session):
+    """Hands the changes of a committed transaction to the callbacks"""
+    changes = session.info.pop(_PENDING, [])
+    if not changes:
+        return
+    for callback in _callbacks:
+        try:
+            callback(changes)
+        except Exception:  # pylint: disable=broad-except
+            # the data is committed; a failing listener must not undo that
+            logger.exception("Commit hook %s failed", callback.__name__)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    """Forgets the changes of a transaction that was rolled back"""
+    session.info.pop(_PENDING, None)
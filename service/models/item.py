@@ -4,9 +4,17 @@ Persistent Base class for database CRUD functions
 
 import logging
 from .persistent_base import db, PersistentBase, DataValidationError
+from .commit_hooks import after_commit, DELETE
+from .search import NgramIndex
 
 logger = logging.getLogger("flask.app")
 
+# Backends for the substring search on item names:
+#   trigram - ILIKE served by the pg_trgm GIN index of the migrations
+#   ngram   - the in-process NgramIndex (for SQLite based test runs)
+#   auto    - trigram on PostgreSQL and ngram everywhere else
+ITEM_SEARCH_BACKENDS = ("auto", "trigram", "ngram")
+
 
 ######################################################################
 #  I T E M   M O D E L
@@ -27,6 +35,20 @@ class Item(db.Model, PersistentBase):
     unit_price = db.Column(db.Double)
     total_price = db.Column(db.Double)
     description = db.Column(db.String(1024))
+    # bumped on every UPDATE, the ETag of the Item is derived from it
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+
+    # Serves the items of an order and the product lookups within one
+    __table_args__ = (
+        db.Index("ix_item_order_id_product_id", order_id, product_id),
+        # finds the Items of a product across Orders, a page at a time
+        db.Index("ix_item_product_id_id", product_id, id),
+    )
+
+    __mapper_args__ = {"version_id_col": version}
+
+    search_backend = "auto"
+    name_index = NgramIndex()
 
     def __repr__(self):
         return f"<Item {self.name} id=[{self.id}] order[{self.order_id}]>"
@@ -88,6 +110,44 @@ class Item(db.Model, PersistentBase):
             cls.order_id == order_id, cls.product_id == product_id
         ).all()
 
+    @classmethod
+    def configure_search(cls, backend: str) -> None:
+        """Sets the backend used by find_by_name
+
+        Args:
+            backend (string): one of ITEM_SEARCH_BACKENDS
+        """
+        if backend not in ITEM_SEARCH_BACKENDS:
+            raise DataValidationError(
+                f"Unknown item search backend '{backend}', "
+                f"use one of {', '.join(ITEM_SEARCH_BACKENDS)}"
+            )
+        cls.search_backend = backend
+        cls.name_index.clear()
+
+    @classmethod
+    def uses_name_index(cls) -> bool:
+        """Returns True when name searches go through the in-process index"""
+        if cls.search_backend == "auto":
+            return db.engine.dialect.name != "postgresql"
+        return cls.search_backend == "ngram"
+
+    @classmethod
+    def search_names(cls, name) -> set:
+        """Returns the ids of the Items whose name contains a substring
+
+        The in-process index is filled from the database the first time
+        it is searched and kept up to date as Items are committed.
+        """
+        index = cls.name_index
+        if not index.loaded:
+            logger.info("Building the item name index ...")
+            rows = db.session.execute(db.select(cls.id, cls.name))
+            for item_id, item_name in rows:
+                index.add(item_id, item_name)
+            index.loaded = True
+        return index.search(name)
+
     @classmethod
     def find_by_name(cls, order_id, name):
         """Returns all Items with the given name
@@ -97,6 +157,31 @@ class Item(db.Model, PersistentBase):
             name (string): the name of the Items you want to match
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(
-            cls.order_id == order_id, cls.name.ilike(f"%{name}%")
-        ).all()
+        return cls.query.filter(cls.order_id == order_id, *cls.name_criteria(name)).all()
+
+    @classmethod
+    def name_criteria(cls, name) -> list:
+        """Returns the criteria that match the Items whose name contains a substring"""
+        criteria = [cls.name.ilike(f"%{name}%")]
+        if cls.uses_name_index():
+            # the ILIKE only rechecks the few candidate rows of the index
+            criteria.append(cls.id.in_(cls.search_names(name)))
+        return criteria
+
+
+@after_commit
+def update_name_index(changes):
+    """Keeps the in-process item name index in step with committed Items"""
+    index = Item.name_index
+    if not index.loaded:
+        return
+    for change in changes:
+        if change.model is not Item:
+            continue
+        if change.id is None:
+            # a bulk statement changed unknown rows, rebuild on next search
+            index.clear()
+        elif change.action == DELETE:
+            index.remove(change.id)
+        elif "name" in change.values:
+            index.add(change.id, change.values["name"])
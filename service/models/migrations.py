@@ -0,0 +1,292 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Schema Migrations
+
+db.create_all() only creates tables that are missing, so changes to
+tables that already hold data are shipped as numbered migrations. The
+versions that have been applied are recorded in the schema_migrations
+table and every step checks the catalog before changing anything, so a
+migration can be re-run safely against a database that already has it
+(for example one that was built by db.create_all()).
+
+Usage:
+    flask db-upgrade [--target VERSION]
+    flask db-downgrade [--target VERSION]
+"""
+import logging
+from collections import namedtuple
+from datetime import datetime, timezone
+from sqlalchemy.schema import CreateColumn
+from .persistent_base import db, DataValidationError
+from . import order_rollup
+
+logger = logging.getLogger("flask.app")
+
+Migration = namedtuple("Migration", ["version", "description", "upgrade", "downgrade"])
+
+schema_migrations = db.Table(
+    "schema_migrations",
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("description", db.String(256), nullable=False),
+    db.Column("applied_at", db.DateTime(timezone=True), nullable=False),
+)
+
+
+######################################################################
+#  M I G R A T I O N   S T E P S
+######################################################################
+def _index(table_name: str, index_name: str):
+    """Returns an index that is declared on one of the models"""
+    table = db.metadata.tables[table_name]
+    return next(index for index in table.indexes if index.name == index_name)
+
+
+def create_indexes(*names):
+    """Returns a step that creates model indexes that do not exist yet"""
+
+    def step(connection):
+        for table_name, index_name in names:
+            _index(table_name, index_name).create(connection, checkfirst=True)
+
+    return step
+
+
+def drop_indexes(*names):
+    """Returns a step that drops model indexes if they exist"""
+
+    def step(connection):
+        for table_name, index_name in names:
+            _index(table_name, index_name).drop(connection, checkfirst=True)
+
+    return step
+
+
+def add_columns(*names):
+    """Returns a step that adds model columns that do not exist yet"""
+
+    def step(connection):
+        preparer = connection.dialect.identifier_preparer
+        for table_name, column_name in names:
+            existing = {
+                column["name"] for column in db.inspect(connection).get_columns(table_name)
+            }
+            if column_name in existing:
+                continue
+            column = db.metadata.tables[table_name].c[column_name]
+            ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.execute(
+                db.text(f"ALTER TABLE {preparer.quote(table_name)} ADD COLUMN {ddl}")
+            )
+
+    return step
+
+
+def drop_columns(*names):
+    """Returns a step that drops model columns if they exist"""
+
+    def step(connection):
+        preparer = connection.dialect.identifier_preparer
+        for table_name, column_name in names:
+            connection.execute(
+                db.text(
+                    f"ALTER TABLE {preparer.quote(table_name)} "
+                    f"DROP COLUMN IF EXISTS {preparer.quote(column_name)}"
+                )
+            )
+
+    return step
+
+
+HOT_PATH_INDEXES = (
+    ("order", "ix_order_order_date_id"),
+    ("order", "ix_order_customer_id_order_date"),
+    ("order", "ix_order_status_order_date"),
+    ("order", "ix_order_total_amount_id"),
+    ("item", "ix_item_order_id_product_id"),
+)
+
+ITEM_NAME_TRGM_INDEX = "ix_item_name_trgm"
+
+
+def _has_pg_trgm(connection) -> bool:
+    """Returns True when the pg_trgm extension can be used"""
+    if connection.dialect.name != "postgresql":
+        return False
+    available = connection.execute(
+        db.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    ).first()
+    return available is not None
+
+
+def create_trigram_index(connection):
+    """Creates the pg_trgm GIN index that serves ILIKE '%name%' on items"""
+    if not _has_pg_trgm(connection):
+        logger.warning(
+            "pg_trgm is not available, item name searches are not index backed"
+        )
+        return
+    connection.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    connection.execute(
+        db.text(
+            f"CREATE INDEX IF NOT EXISTS {ITEM_NAME_TRGM_INDEX} "
+            "ON item USING gin (name gin_trgm_ops)"
+        )
+    )
+
+
+def drop_trigram_index(connection):
+    """Drops the pg_trgm GIN index on item names"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(db.text(f"DROP INDEX IF EXISTS {ITEM_NAME_TRGM_INDEX}"))
+
+
+def create_rollup(connection):
+    """Creates the daily Order rollup table and fills it from the Orders"""
+    order_rollup.OrderRollup.__table__.create(connection, checkfirst=True)
+    order_rollup.rebuild(connection)
+
+
+def drop_rollup(connection):
+    """Drops the daily Order rollup table"""
+    # not Table.drop(), which would also drop the orderstatus type of the orders
+    connection.execute(db.text("DROP TABLE IF EXISTS order_rollup"))
+
+
+MIGRATIONS = (
+    Migration(
+        1,
+        "Indexes for the order filters and sorts and item product lookups",
+        create_indexes(*HOT_PATH_INDEXES),
+        drop_indexes(*HOT_PATH_INDEXES),
+    ),
+    Migration(
+        2,
+        "Trigram index for item name substring searches",
+        create_trigram_index,
+        drop_trigram_index,
+    ),
+    Migration(
+        3,
+        "Daily Order rollup for the order statistics",
+        create_rollup,
+        drop_rollup,
+    ),
+    Migration(
+        4,
+        "Index for item lookups by product across orders",
+        create_indexes(("item", "ix_item_product_id_id")),
+        drop_indexes(("item", "ix_item_product_id_id")),
+    ),
+    Migration(
+        5,
+        "Version counters for the ETags of orders and items",
+        add_columns(("order", "version"), ("item", "version")),
+        drop_columns(("order", "version"), ("item", "version")),
+    ),
+)
+
+
+######################################################################
+#  M I G R A T I O N   R U N N E R
+######################################################################
+def applied_versions(connection) -> set:
+    """Returns the versions that have been applied to the database"""
+    schema_migrations.create(connection, checkfirst=True)
+    rows = connection.execute(db.select(schema_migrations.c.version))
+    return {row.version for row in rows}
+
+
+def current_version() -> int:
+    """Returns the highest migration version applied to the database"""
+    with db.engine.begin() as connection:
+        return max(applied_versions(connection), default=0)
+
+
+def _check_target(target):
+    """Makes sure a target version is one that exists"""
+    known = [migration.version for migration in MIGRATIONS]
+    if target is not None and target != 0 and target not in known:
+        raise DataValidationError(
+            f"Unknown schema version {target}, use 0 or one of {known}"
+        )
+
+
+def upgrade(target: int = None) -> list:
+    """
+    Applies the migrations that have not been applied yet
+
+    Each migration runs in its own transaction together with the row
+    that records it, so a failure leaves the schema at the last version
+    that was applied completely.
+
+    Args:
+        target (int): the version to stop at, the latest when None
+
+    Returns:
+        list: the migrations that were applied
+    """
+    _check_target(target)
+    applied = []
+    for migration in MIGRATIONS:
+        if target is not None and migration.version > target:
+            break
+        with db.engine.begin() as connection:
+            if migration.version in applied_versions(connection):
+                continue
+            logger.info("Applying migration %s: %s", *migration[:2])
+            migration.upgrade(connection)
+            connection.execute(
+                schema_migrations.insert().values(
+                    version=migration.version,
+                    description=migration.description,
+                    applied_at=datetime.now(timezone.utc),
+                )
+            )
+        applied.append(migration)
+    return applied
+
+
+def downgrade(target: int = None) -> list:
+    """
+    Reverts applied migrations, newest first
+
+    Args:
+        target (int): the version to go back to, the previous one when None
+
+    Returns:
+        list: the migrations that were reverted
+    """
+    _check_target(target)
+    if target is None:
+        target = max(current_version() - 1, 0)
+    reverted = []
+    for migration in reversed(MIGRATIONS):
+        if migration.version <= target:
+            break
+        with db.engine.begin() as connection:
+            if migration.version not in applied_versions(connection):
+                continue
+            logger.info("Reverting migration %s: %s", *migration[:2])
+            migration.downgrade(connection)
+            connection.execute(
+                schema_migrations.delete().where(
+                    schema_migrations.c.version == migration.version
+                )
+            )
+        reverted.append(migration)
+    return reverted
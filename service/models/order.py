@@ -20,7 +20,17 @@ Persistent Base class for database CRUD functions
 import logging
 from enum import Enum
 from datetime import date
-from sqlalchemy import desc
+from sqlalchemy import desc, event, inspect
+from sqlalchemy.orm import (
+    contains_eager,
+    joinedload,
+    lazyload,
+    load_only,
+    selectinload,
+    subqueryload,
+    Session,
+)
+from sqlalchemy.orm.attributes import set_committed_value
 from .persistent_base import db, PersistentBase, DataValidationError
 from .item import Item
 
@@ -30,6 +40,32 @@ logger = logging.getLogger("flask.app")
 ######################################################################
 #  O R D E R   M O D E L
 ######################################################################
+# Strategies that can be used to load the items of an Order
+ITEM_LOADERS = {
+    "selectin": selectinload,
+    "joined": joinedload,
+    "subquery": subqueryload,
+    "lazy": lazyload,
+}
+
+
+# Fields of the full Order representation and of the compact summary view
+ORDER_FIELDS = (
+    "id",
+    "customer_id",
+    "order_date",
+    "status",
+    "shipping_address",
+    "total_amount",
+    "payment_method",
+    "shipping_cost",
+    "expected_date",
+    "order_notes",
+    "items",
+)
+SUMMARY_FIELDS = ("id", "customer_id", "order_date", "status", "total_amount")
+
+
 class OrderStatus(Enum):
     """
     Enum for Order Statuses
@@ -64,29 +100,53 @@ class Order(db.Model, PersistentBase):
     shipping_cost = db.Column(db.Double)
     expected_date = db.Column(db.Date)
     order_notes = db.Column(db.String(1024))
-    items = db.relationship("Item", backref="order", passive_deletes=True)
+    # bumped on every UPDATE of the Order or of one of its Items, the ETag
+    # of the Order is derived from it
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    items = db.relationship(
+        "Item", backref="order", cascade="all, delete", passive_deletes=True
+    )
+
+    # Indexes for the filters and sorts of GET /orders, each ending in the
+    # id so that keyset pages can be read straight off the index
+    __table_args__ = (
+        db.Index("ix_order_order_date_id", order_date, id),
+        db.Index(
+            "ix_order_customer_id_order_date",
+            customer_id,
+            order_date.desc(),
+            id.desc(),
+        ),
+        db.Index("ix_order_status_order_date", status, order_date, id),
+        db.Index("ix_order_total_amount_id", total_amount, id),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+    # How the items are loaded when Orders are read. Listings use one batched
+    # SELECT ... WHERE order_id IN (...) and single fetches join the items in.
+    collection_loading = "selectin"
+    single_loading = "joined"
 
     def __repr__(self):
         return f"<Order {self.customer_id} id=[{self.id}]>"
 
-    def serialize(self):
-        """Converts an Order into a dictionary"""
-
-        order = {
-            "id": self.id,
-            "customer_id": self.customer_id,
-            "order_date": self.order_date.isoformat(),
-            "status": self.status.name,
-            "shipping_address": self.shipping_address,
-            "total_amount": self.total_amount,
-            "payment_method": self.payment_method,
-            "shipping_cost": self.shipping_cost,
-            "expected_date": self.expected_date.isoformat(),
-            "order_notes": self.order_notes,
-            "items": [],
-        }
-        for item in self.items:
-            order["items"].append(item.serialize())
+    def serialize(self, fields=None):
+        """Converts an Order into a dictionary
+
+        Args:
+            fields (list): the fields to include, all of them when None. Only
+                these attributes are read so deferred columns stay unloaded.
+        """
+        order = {}
+        for field in fields or ORDER_FIELDS:
+            value = getattr(self, field)
+            if field == "items":
+                value = [item.serialize() for item in self.items]
+            elif field == "status":
+                value = value.name
+            elif field in ("order_date", "expected_date"):
+                value = value.isoformat()
+            order[field] = value
         return order
 
     def deserialize(self, data):
@@ -140,7 +200,8 @@ class Order(db.Model, PersistentBase):
         """
         logger.info("Querying for orders from %s to %s", start_date, end_date or "now")
 
-        query = Order.query.filter(Order.order_date >= start_date)
+        query = Order.query.options(*Order.loader_options())
+        query = query.filter(Order.order_date >= start_date)
         if end_date:
             query = query.filter(Order.order_date <= end_date)
         return query.order_by(Order.order_date.desc()).all()
@@ -149,6 +210,91 @@ class Order(db.Model, PersistentBase):
     # CLASS METHODS
     ##################################################
 
+    @classmethod
+    def configure_loading(cls, collection: str, single: str) -> None:
+        """Sets the strategies used to load items for listings and single fetches
+
+        Args:
+            collection (string): one of ITEM_LOADERS used when listing Orders
+            single (string): one of ITEM_LOADERS used when fetching one Order
+        """
+        for strategy in (collection, single):
+            if strategy not in ITEM_LOADERS:
+                raise DataValidationError(
+                    f"Unknown item loading strategy '{strategy}', "
+                    f"use one of {', '.join(ITEM_LOADERS)}"
+                )
+        cls.collection_loading = collection
+        cls.single_loading = single
+
+    @classmethod
+    def loader_options(cls, single: bool = False) -> list:
+        """Returns the options that eagerly load the items of the Orders"""
+        strategy = cls.single_loading if single else cls.collection_loading
+        return [ITEM_LOADERS[strategy](cls.items)]
+
+    @classmethod
+    def find(cls, by_id, fields=None):
+        """Finds an Order by it's ID
+
+        Args:
+            by_id (integer): the id of the Order
+            fields (list): only load these fields (all of them when None)
+        """
+        logger.info("Processing lookup for id %s ...", by_id)
+        return db.session.get(
+            cls, by_id, options=cls.projection_options(fields, single=True)
+        )
+
+    @classmethod
+    def find_items_by_product_id(cls, product_id):
+        """Returns a query of the Items of a product in every Order
+
+        Each Item is joined to the summary fields of its Order in the same
+        SELECT, so no statement is sent per Order.
+
+        Args:
+            product_id (integer): the product_id of the Items you want to match
+        """
+        logger.info("Processing product_id query for %s across Orders ...", product_id)
+        summary = [getattr(cls, field) for field in SUMMARY_FIELDS]
+        return (
+            Item.query.join(Item.order)
+            .filter(Item.product_id == product_id)
+            .options(contains_eager(Item.order).load_only(*summary))
+        )
+
+    @staticmethod
+    def check_fields(fields) -> None:
+        """Makes sure that every field of a projection is an Order field"""
+        unknown = set(fields) - set(ORDER_FIELDS)
+        if unknown:
+            raise DataValidationError(
+                f"Unknown Order fields: {', '.join(sorted(unknown))}"
+            )
+
+    @classmethod
+    def projection_options(cls, fields, single: bool = False, extra=()) -> list:
+        """Returns the options that load only some fields of the Orders
+
+        Columns that are not asked for are deferred and the items are only
+        loaded when "items" is one of the fields.
+
+        Args:
+            fields (list): names from ORDER_FIELDS, or None for all of them
+            single (bool): True when a single Order is being fetched
+            extra (list): other columns that must be loaded, e.g. sort keys
+        """
+        if fields is None:
+            return cls.loader_options(single)
+        cls.check_fields(fields)
+        columns = [cls.id, cls.version, *extra]
+        columns += [getattr(cls, field) for field in fields if field != "items"]
+        options = [load_only(*columns)]
+        if "items" in fields:
+            options += cls.loader_options(single)
+        return options
+
     @classmethod
     def find_by_customer_id(cls, customer_ids):
         """Returns all Orders with the given customer id
@@ -157,7 +303,11 @@ class Order(db.Model, PersistentBase):
             customer_id (Integer): the customer_id of the Orders you want to match
         """
         logger.info("Processing name query for %s ...", customer_ids)
-        return cls.query.filter(cls.customer_id.in_(customer_ids)).order_by(desc(Order.order_date))
+        return (
+            cls.query.options(*cls.loader_options())
+            .filter(cls.customer_id.in_(customer_ids))
+            .order_by(desc(Order.order_date))
+        )
 
     @classmethod
     def find_by_total_amount(
@@ -177,9 +327,8 @@ class Order(db.Model, PersistentBase):
         if sort_by.lower() == "total_amount":
             sort_criterion = cls.total_amount.desc()
         return (
-            cls.query.filter(
-                cls.total_amount >= min_amount, cls.total_amount <= max_amount
-            )
+            cls.query.options(*cls.loader_options())
+            .filter(cls.total_amount >= min_amount, cls.total_amount <= max_amount)
             .order_by(sort_criterion)
             .all()
         )
@@ -194,4 +343,47 @@ class Order(db.Model, PersistentBase):
         :rtype: list
         """
         logger.info("Processing status query for %s ...", status.name)
-        return cls.query.filter(cls.status == status).all()
+        return (
+            cls.query.options(*cls.loader_options())
+            .filter(cls.status == status)
+            .all()
+        )
+
+
+######################################################################
+#  O R D E R   V E R S I O N S
+######################################################################
+@event.listens_for(Session, "after_flush")
+def _touch_orders_of_items(session, flush_context):
+    """Bumps the version of the Orders whose Items were written by a flush
+
+    The representation of an Order embeds its Items, so its ETag has to
+    change when they do. An Item moved to another Order changes both.
+    Orders that were only just inserted are skipped.
+    """
+    # pylint: disable=unused-argument
+    new_orders = {order.id for order in session.new if isinstance(order, Order)}
+    order_ids = set()
+    for collection in (session.new, session.dirty, session.deleted):
+        for item in collection:
+            if not isinstance(item, Item):
+                continue
+            if collection is session.dirty and not session.is_modified(item):
+                continue
+            order_ids.add(item.order_id)
+            order_ids.update(inspect(item).attrs.order_id.history.deleted)
+    order_ids -= new_orders
+    order_ids.discard(None)
+    if not order_ids:
+        return
+    table = Order.__table__
+    rows = session.connection().execute(
+        table.update()
+        .where(table.c.id.in_(order_ids))
+        .values(version=table.c.version + 1)
+        .returning(table.c.id, table.c.version)
+    )
+    for order_id, version in rows:
+        order = session.identity_map.get(session.identity_key(Order, order_id))
+        if order is not None:
+            set_committed_value(order, "version", version)
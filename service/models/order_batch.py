@@ -0,0 +1,287 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Batch Writes
+
+Creates many Orders, with their Items, or adds many Items to an Order,
+without going through the unit of work. Every record is validated up
+front with the same rules as a single create. Orders are then written a
+chunk at a time: one multi-row INSERT ... RETURNING of the Orders and
+one of their Items per chunk, in a transaction of its own, and a chunk
+that fails only fails its own records. The Items of an Order are all or
+nothing: one UPDATE of the Order and one INSERT of the Items in one
+transaction.
+
+The rows never become ORM instances in the session, so the changes are
+handed to the commit hooks and the daily rollup by hand.
+
+Usage:
+    results = create_orders(payloads, chunk_size=500)
+    results = add_items(order_id, payloads)
+"""
+import logging
+from decimal import Decimal
+from sqlalchemy.exc import SQLAlchemyError
+from .persistent_base import db, DataValidationError
+from .commit_hooks import record, Change, INSERT, UPDATE
+from .item import Item
+from .order import Order
+from . import order_rollup
+
+logger = logging.getLogger("flask.app")
+
+# the columns a client provides, the ids and versions come from the database
+ORDER_INSERT_COLUMNS = tuple(
+    column.key for column in Order.__table__.columns if column.key not in ("id", "version")
+)
+ITEM_INSERT_COLUMNS = tuple(
+    column.key for column in Item.__table__.columns if column.key not in ("id", "version")
+)
+
+# Python types accepted for the columns of each SQL type, and the function
+# that converts a string the database would also accept. Enums and dates
+# are already checked by deserialize().
+COLUMN_TYPES = {
+    db.Integer: ((int,), int, "an integer"),
+    db.Double: ((int, float, Decimal), float, "a number"),
+    db.String: ((str,), str, "a string"),
+}
+
+
+def _checked(instance, column, value):
+    """Returns the value of a column as it will be written"""
+    for column_type, (types, convert, description) in COLUMN_TYPES.items():
+        if not isinstance(column.type, column_type):
+            continue
+        try:
+            if isinstance(value, bool) or not isinstance(value, (str, *types)):
+                raise ValueError(value)
+            return convert(value) if isinstance(value, str) else value
+        except ValueError as error:
+            raise DataValidationError(
+                f"Invalid {type(instance).__name__}: {column.key} must be {description}"
+            ) from error
+    return value
+
+
+def check_columns(instance) -> None:
+    """
+    Checks the values of a deserialized record against its columns
+
+    Numbers sent as strings are converted, as the database would do it.
+
+    Raises:
+        DataValidationError: when a value has the wrong type or is too long
+    """
+    for column in instance.__table__.columns:
+        value = getattr(instance, column.key)
+        if value is None or isinstance(column.type, db.Enum):
+            continue
+        value = _checked(instance, column, value)
+        length = getattr(column.type, "length", None)
+        if length and len(value) > length:
+            raise DataValidationError(
+                f"Invalid {type(instance).__name__}: {column.key} is longer than {length} characters"
+            )
+        setattr(instance, column.key, value)
+
+
+def row_of(instance, columns) -> dict:
+    """Returns the values of some columns of a record"""
+    return {name: getattr(instance, name) for name in columns}
+
+
+def insert_rows(model, rows: list) -> list:
+    """Inserts rows with one multi-row INSERT ... RETURNING, returns their ids"""
+    if not rows:
+        return []
+    statement = db.insert(model).returning(model.id, sort_by_parameter_order=True)
+    return db.session.execute(statement, rows).scalars().all()
+
+
+def record_inserts(model, ids: list, rows: list) -> None:
+    """Hands rows inserted outside of the unit of work to the commit hooks"""
+    for row_id, row in zip(ids, rows):
+        record(db.session, Change(INSERT, model, row_id, dict(row, id=row_id)))
+
+
+######################################################################
+#  O R D E R S
+######################################################################
+def validate_order(payload) -> Order:
+    """
+    Returns the Order of a payload, with its Items, if it is valid
+
+    Raises:
+        DataValidationError: when the payload is not a valid Order
+    """
+    try:
+        order = Order().deserialize(payload)
+    except ValueError as error:  # e.g. a malformed date
+        raise DataValidationError(f"Invalid Order: {error}") from error
+    check_columns(order)
+    for item in order.items:
+        check_columns(item)
+    return order
+
+
+def _write_chunk(orders: list) -> list:
+    """Inserts a chunk of Orders with their Items and returns the Order ids"""
+    order_rows = [row_of(order, ORDER_INSERT_COLUMNS) for order in orders]
+    order_ids = insert_rows(Order, order_rows)
+    item_rows = [
+        dict(row_of(item, ITEM_INSERT_COLUMNS), order_id=order_id)
+        for order, order_id in zip(orders, order_ids)
+        for item in order.items
+    ]
+    item_ids = insert_rows(Item, item_rows)
+
+    record_inserts(Order, order_ids, order_rows)
+    record_inserts(Item, item_ids, item_rows)
+    order_rollup.apply(
+        db.session.connection(),
+        [],
+        [
+            order_rollup.OrderRow(order_id, *(row.get(column.key) for column in order_rollup.ROW_COLUMNS[1:]))
+            for order_id, row in zip(order_ids, order_rows)
+        ],
+    )
+    return order_ids
+
+
+def create_orders(payloads: list, chunk_size: int = 500) -> list:
+    """
+    Creates many Orders, a chunk per transaction
+
+    Args:
+        payloads (list): the Orders as they would be posted one at a time
+        chunk_size (int): the number of Orders written per transaction
+
+    Returns:
+        list: for every payload, in order, {"id": ...} when it was created
+            or {"error": ...} when it was not
+    """
+    results = {}
+    valid = []
+    for index, payload in enumerate(payloads):
+        try:
+            valid.append((index, validate_order(payload)))
+        except DataValidationError as error:
+            results[index] = {"error": str(error)}
+
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        try:
+            order_ids = _write_chunk([order for _, order in chunk])
+            db.session.commit()
+        except SQLAlchemyError as error:
+            db.session.rollback()
+            logger.error("Batch of %d Orders failed: %s", len(chunk), error)
+            message = f"Could not create Order: {getattr(error, 'orig', None) or error}"
+            for index, _ in chunk:
+                results[index] = {"error": message}
+            continue
+        for (index, _), order_id in zip(chunk, order_ids):
+            results[index] = {"id": order_id}
+    created = sum("id" in result for result in results.values())
+    logger.info("Created %d of %d Orders in a batch", created, len(payloads))
+    return [results[index] for index in range(len(payloads))]
+
+
+######################################################################
+#  I T E M S   O F   A N   O R D E R
+######################################################################
+def validate_item(payload, order_id: int) -> Item:
+    """
+    Returns the Item of a payload for an Order, if it is valid
+
+    Raises:
+        DataValidationError: when the payload is not a valid Item
+    """
+    if isinstance(payload, dict):
+        payload = dict(payload, order_id=order_id)
+    item = Item().deserialize(payload)
+    check_columns(item)
+    return item
+
+
+def _add_to_order(order_id: int, amount: float):
+    """
+    Adds to the total of an Order and bumps its version
+
+    Returns:
+        tuple: the OrderRows of the Order before and after, or None when
+            there is no such Order
+    """
+    connection = db.session.connection()
+    before = order_rollup.lock_rows(connection, Order.id == order_id)
+    if not before:
+        return None
+    table = Order.__table__
+    after = connection.execute(
+        table.update()
+        .where(table.c.id == order_id)
+        .values(
+            total_amount=db.func.coalesce(table.c.total_amount, 0) + amount,
+            version=table.c.version + 1,
+        )
+        .returning(*(table.c[column.key] for column in order_rollup.ROW_COLUMNS))
+    ).first()
+    return before[0], after
+
+
+def add_items(order_id: int, payloads: list):
+    """
+    Adds many Items to an Order in one transaction
+
+    The Items are all validated first and none is added when one of them
+    is not valid. The total amount of the Order grows by the total price
+    of the Items with one UPDATE, which also tells whether it exists.
+
+    Returns:
+        list: for every payload, in order, {"id": ...} when the Items were
+            added or {"error": ...} when they were not, and None when
+            there is no such Order
+    """
+    items, errors = [], {}
+    for index, payload in enumerate(payloads):
+        try:
+            items.append(validate_item(payload, order_id))
+        except DataValidationError as error:
+            errors[index] = str(error)
+    if errors:
+        rejected = "Not added because other Items of the batch are not valid"
+        return [{"error": errors.get(index, rejected)} for index in range(len(payloads))]
+
+    try:
+        order = _add_to_order(order_id, sum(item.total_price or 0 for item in items))
+        if order is None:
+            db.session.rollback()
+            return None
+        item_rows = [row_of(item, ITEM_INSERT_COLUMNS) for item in items]
+        item_ids = insert_rows(Item, item_rows)
+        before, after = order
+        record(db.session, Change(UPDATE, Order, order_id, dict(after._mapping)))
+        record_inserts(Item, item_ids, item_rows)
+        order_rollup.apply(db.session.connection(), [before], [after])
+        db.session.commit()
+    except SQLAlchemyError as error:
+        db.session.rollback()
+        logger.error("Adding %d Items to Order %s failed: %s", len(items), order_id, error)
+        raise DataValidationError(f"Could not add the Items: {getattr(error, 'orig', None) or error}") from error
+    logger.info("Added %d Items to Order %s", len(items), order_id)
+    return [{"id": item_id} for item_id in item_ids]
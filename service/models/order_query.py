@@ -0,0 +1,193 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Order Query Compiler
+
+Compiles the query string of GET /orders into a single SQL statement.
+Every filter is declared once in FILTERS with the argument it reads, how
+its value is parsed and the criterion it adds, and the sort keys are
+declared in SORT_KEYS. All of the arguments are validated up front so a
+bad request is rejected before anything is sent to the database.
+"""
+import logging
+from collections import namedtuple
+from datetime import datetime
+from functools import partial
+from service.common.pagination import ordering
+from .persistent_base import db, DataValidationError
+from .item import Item
+from .order import Order, OrderStatus
+
+logger = logging.getLogger("flask.app")
+
+
+######################################################################
+#  A R G U M E N T   P A R S E R S
+######################################################################
+def split_values(values) -> list:
+    """Flattens repeated and comma separated argument values"""
+    if isinstance(values, str):
+        values = [values]
+    return [value.strip() for raw in values for value in raw.split(",") if value.strip()]
+
+
+def parse_statuses(values) -> list:
+    """Parses one or more Order status names"""
+    try:
+        return [OrderStatus[name.upper()] for name in split_values(values)]
+    except KeyError as error:
+        raise DataValidationError(
+            f"{error.args[0]} is not a valid Order status. "
+            f"Use one of {', '.join(status.name for status in OrderStatus)}."
+        ) from error
+
+
+def parse_date(value):
+    """Parses a YYYY-MM-DD date"""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError) as error:
+        raise DataValidationError(
+            f"{value} is not a valid date. Please use YYYY-MM-DD."
+        ) from error
+
+
+def parse_amount(value) -> float:
+    """Parses a decimal price point"""
+    try:
+        return float(value)
+    except (TypeError, ValueError) as error:
+        raise DataValidationError(
+            "Please enter valid minimum and maximum values. They should be decimal values."
+        ) from error
+
+
+def parse_ids(values, name="id") -> list:
+    """Parses one or more integer ids"""
+    try:
+        return [int(value) for value in split_values(values)]
+    except ValueError as error:
+        raise DataValidationError(
+            f"{values} is not a valid {name}. Please enter an integer."
+        ) from error
+
+
+######################################################################
+#  F I L T E R   A N D   S O R T   D E C L A R A T I O N S
+######################################################################
+Filter = namedtuple("Filter", ["arg", "parse", "criterion"])
+
+FILTERS = (
+    Filter("status", parse_statuses, Order.status.in_),
+    Filter("order-start", parse_date, lambda start: Order.order_date >= start),
+    Filter("order-end", parse_date, lambda end: Order.order_date <= end),
+    Filter("total-min", parse_amount, lambda low: Order.total_amount >= low),
+    Filter("total-max", parse_amount, lambda high: Order.total_amount <= high),
+    Filter(
+        "customer-id",
+        partial(parse_ids, name="customer_id"),
+        Order.customer_id.in_,
+    ),
+    Filter(
+        "product_id",
+        partial(parse_ids, name="product_id"),
+        lambda ids: Order.items.any(Item.product_id.in_(ids)),
+    ),
+)
+
+# Columns the Orders can be sorted by. Sorting is descending unless the
+# key is suffixed with ":asc", e.g. sort_by=total_amount:asc,order_date
+SORT_KEYS = {
+    "order_date": Order.order_date,
+    "total_amount": Order.total_amount,
+    "id": Order.id,
+}
+DEFAULT_SORT = "order_date"
+
+
+def parse_sort(value) -> list:
+    """
+    Parses a sort specification into (column, descending) pairs
+
+    The id is appended as a final tiebreaker so that every row has a
+    unique position, which keyset pagination relies on.
+    """
+    sort_keys = {}
+    for key in split_values(value or DEFAULT_SORT):
+        name, _, direction = key.partition(":")
+        if name not in SORT_KEYS or direction.lower() not in ("", "asc", "desc"):
+            raise DataValidationError(
+                f"Cannot sort by '{key}'. Use one of {', '.join(SORT_KEYS)} "
+                "optionally followed by :asc or :desc."
+            )
+        sort_keys.setdefault(name, direction.lower() != "asc")
+    if "id" not in sort_keys:
+        sort_keys["id"] = list(sort_keys.values())[-1]
+    return [(SORT_KEYS[name], descending) for name, descending in sort_keys.items()]
+
+
+######################################################################
+#  O R D E R   Q U E R Y
+######################################################################
+class OrderQuery:
+    """
+    A validated set of filters and sort keys for listing Orders
+
+    Args:
+        args (dict): the parsed query string, keyed by argument name.
+            Arguments that are missing or None are not filtered on.
+
+    The parsed value of every filter that is applied is kept in values.
+    """
+
+    def __init__(self, args: dict):
+        self.args = args
+        self.values = {}
+        self.criteria = []
+        for flt in FILTERS:
+            raw = args.get(flt.arg)
+            if raw is None or raw == "":
+                continue
+            value = flt.parse(raw)
+            if value != []:
+                self.values[flt.arg] = value
+                self.criteria.append(flt.criterion(value))
+        self.sort_keys = parse_sort(args.get("sort_by"))
+
+    @property
+    def sort_columns(self) -> list:
+        """Returns the columns the Orders are sorted by"""
+        return [column for column, _ in self.sort_keys]
+
+    @property
+    def ordering(self) -> list:
+        """Returns the ORDER BY criteria of the sort keys, NULLs as the largest values"""
+        return [ordering(column, descending) for column, descending in self.sort_keys]
+
+    def filtered(self, options=()):
+        """Returns the filtered query without an ORDER BY"""
+        logger.info("Compiling Order query with %d filters", len(self.criteria))
+        return Order.query.options(*options).filter(*self.criteria)
+
+    def ordered(self, options=()):
+        """Returns the filtered query sorted by the sort keys"""
+        return self.filtered(options).order_by(*self.ordering)
+
+    def select(self, columns):
+        """Returns a Core SELECT of some Order columns with the filters"""
+        logger.info("Compiling Order select with %d filters", len(self.criteria))
+        return db.select(*columns).where(*self.criteria)
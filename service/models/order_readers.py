@@ -0,0 +1,231 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Order Readers
+
+Read paths for the Order listings. OrmReader loads Order instances with
+their Items eagerly loaded. CoreReader runs Core SELECTs of only the
+columns that are asked for and turns the rows into read-only records
+with __slots__, skipping the identity map, change tracking and the
+instrumented attributes. The Items of a batch of Orders are read with one
+SELECT ... WHERE order_id IN (...) ORDER BY order_id and grouped in one
+pass. Both readers hand out objects with the same attributes, so the
+field plans of the routes render either.
+
+Usage:
+    reader = make_reader(order_query, fields)
+    orders = reader.all(reader.ordered())
+"""
+import logging
+from service.common.pagination import keyset_paginate
+from .persistent_base import db, DataValidationError
+from .item import Item
+from .order import Order, ORDER_FIELDS
+
+logger = logging.getLogger("flask.app")
+
+ORDER_COLUMNS = tuple(field for field in ORDER_FIELDS if field != "items") + ("version",)
+ITEM_COLUMNS = (
+    "id",
+    "order_id",
+    "product_id",
+    "name",
+    "quantity",
+    "unit_price",
+    "total_price",
+    "description",
+)
+
+# Orders whose Items are read with one IN (...) list
+ITEMS_BATCH_SIZE = 500
+
+
+######################################################################
+#  R E C O R D S
+######################################################################
+class ItemRecord:
+    """A read-only Item row"""
+
+    # pylint: disable=too-few-public-methods, too-many-instance-attributes
+    __slots__ = ITEM_COLUMNS
+
+    def __init__(self, row):
+        (
+            self.id,
+            self.order_id,
+            self.product_id,
+            self.name,
+            self.quantity,
+            self.unit_price,
+            self.total_price,
+            self.description,
+        ) = row
+
+
+class OrderRecord:
+    """A read-only Order row with the columns that were selected"""
+
+    # pylint: disable=too-few-public-methods
+    __slots__ = ORDER_COLUMNS + ("items",)
+
+    def __init__(self, row):
+        for name, value in zip(row._fields, row):
+            setattr(self, name, value)
+        self.items = []
+
+
+def item_columns() -> list:
+    """Returns the Item columns of an ItemRecord, in order"""
+    return [getattr(Item, name) for name in ITEM_COLUMNS]
+
+
+def attach_items(records: list) -> list:
+    """Reads the Items of some OrderRecords and groups them by Order"""
+    by_id = {record.id: record for record in records}
+    order_ids = list(by_id)
+    for start in range(0, len(order_ids), ITEMS_BATCH_SIZE):
+        statement = (
+            db.select(*item_columns())
+            .where(Item.order_id.in_(order_ids[start:start + ITEMS_BATCH_SIZE]))
+            .order_by(Item.order_id, Item.id)
+        )
+        for row in db.session.execute(statement):
+            by_id[row.order_id].items.append(ItemRecord(row))
+    return records
+
+
+def find_order_items(order_id, criteria=()):
+    """
+    Returns the ItemRecords of an Order that match some criteria
+
+    The Order is outer joined to its Items, so one SELECT tells a missing
+    Order apart from an Order without matching Items.
+
+    Returns:
+        list: the ItemRecords, or None when there is no such Order
+    """
+    statement = (
+        db.select(Order.id.label("order_key"), *item_columns())
+        .select_from(Order)
+        .outerjoin(Item, db.and_(Item.order_id == Order.id, *criteria))
+        .where(Order.id == order_id)
+        .order_by(Item.id)
+    )
+    rows = db.session.execute(statement).all()
+    if not rows:
+        return None
+    return [ItemRecord(row[1:]) for row in rows if row.id is not None]
+
+
+######################################################################
+#  R E A D E R S
+######################################################################
+class OrmReader:
+    """Lists Orders as ORM instances with their Items eagerly loaded"""
+
+    def __init__(self, order_query, fields=None):
+        self.order_query = order_query
+        self.with_items = fields is None or "items" in fields
+        self.options = Order.projection_options(fields, extra=order_query.sort_columns)
+
+    def filtered(self):
+        """Returns the filtered query, for keyset pagination"""
+        return self.order_query.filtered(self.options)
+
+    def ordered(self):
+        """Returns the filtered query in the requested order"""
+        return self.order_query.ordered(self.options)
+
+    def load(self, rows) -> list:
+        """Returns the Orders of the rows of a page"""
+        return rows
+
+    def all(self, query) -> list:
+        """Returns every Order of a query"""
+        return query.all()
+
+    def stream(self, query, batch_size: int):
+        """Returns an iterator that reads the Orders in batches"""
+        if not self.with_items:
+            return query.yield_per(batch_size)
+        return self._pages(batch_size)
+
+    def _pages(self, batch_size: int):
+        """Reads the Orders with their Items one keyset page at a time"""
+        # the eager loaders of the Items cannot be combined with yield_per
+        cursor = None
+        while True:
+            page = keyset_paginate(self.filtered(), self.order_query.sort_keys, batch_size, cursor)
+            yield from page.items
+            if page.next_cursor is None:
+                return
+            cursor = page.next_cursor
+
+
+class CoreReader:
+    """Lists Orders as OrderRecords read with Core statements"""
+
+    def __init__(self, order_query, fields=None):
+        self.order_query = order_query
+        fields = fields or ORDER_FIELDS
+        Order.check_fields(fields)
+        self.with_items = "items" in fields
+        names = ["id", *(column.key for column in order_query.sort_columns)]
+        names += [field for field in fields if field != "items"]
+        self.columns = [getattr(Order, name) for name in dict.fromkeys(names)]
+
+    def filtered(self):
+        """Returns the filtered SELECT, for keyset pagination"""
+        return self.order_query.select(self.columns)
+
+    def ordered(self):
+        """Returns the filtered SELECT in the requested order"""
+        return self.filtered().order_by(*self.order_query.ordering)
+
+    def load(self, rows) -> list:
+        """Returns the OrderRecords of some rows, with their Items"""
+        records = [OrderRecord(row) for row in rows]
+        return attach_items(records) if self.with_items else records
+
+    def all(self, statement) -> list:
+        """Returns every OrderRecord of a SELECT"""
+        return self.load(db.session.execute(statement).all())
+
+    def stream(self, statement, batch_size: int):
+        """Returns an iterator that reads the OrderRecords in batches"""
+        result = db.session.execute(statement.execution_options(yield_per=batch_size))
+        for rows in result.partitions():
+            yield from self.load(rows)
+
+
+READERS = {"orm": OrmReader, "core": CoreReader}
+reader_class = CoreReader  # pylint: disable=invalid-name
+
+
+def configure_reader(name: str) -> None:
+    """Sets the reader used by make_reader, one of READERS"""
+    global reader_class  # pylint: disable=global-statement
+    if name not in READERS:
+        raise DataValidationError(
+            f"Unknown order reader '{name}', use one of {', '.join(READERS)}"
+        )
+    reader_class = READERS[name]
+
+
+def make_reader(order_query, fields=None):
+    """Returns the configured reader for a listing of some Order fields"""
+    return reader_class(order_query, fields)
@@ -0,0 +1,408 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Daily Order Rollup
+
+Keeps one row of pre-aggregated amounts for every (order_date, status,
+payment_method) bucket so that order statistics are read from a table
+that grows with the number of days instead of the number of Orders.
+
+The rollup is maintained in the same transaction as the Orders. Every
+flush that writes Orders, and every bulk UPDATE or DELETE of Orders,
+reads the rows of the Orders before the change, locking them, and after
+it. The difference is added to the buckets with one upsert of deltas
+(counts and sums added, LEAST and GREATEST of the minimums and
+maximums), so concurrent writers add up instead of overwriting each
+other. A bucket is only aggregated again from its Orders when an Order
+that leaves it held its minimum or maximum, or was its last Order. Its
+row is locked first, so the aggregate sees every writer that committed
+before. `flask rollup-rebuild` recomputes every bucket, e.g. after
+loading Orders with raw SQL.
+
+Orders without a payment method are rolled up under "".
+"""
+import logging
+from collections import namedtuple
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from .persistent_base import db
+from .order import Order, OrderStatus
+
+logger = logging.getLogger("flask.app")
+
+AMOUNTS = ("total_amount", "shipping_cost")
+
+_REMOVED = "rollup_removed_rows"
+
+# the columns of an Order that the rollup depends on
+OrderRow = namedtuple(
+    "OrderRow",
+    ["id", "order_date", "status", "payment_method", "total_amount", "shipping_cost"],
+)
+ROW_COLUMNS = (
+    Order.id,
+    Order.order_date,
+    Order.status,
+    Order.payment_method,
+    Order.total_amount,
+    Order.shipping_cost,
+)
+
+
+class OrderRollup(db.Model):
+    """
+    Class that represents the aggregated Orders of one day, status and
+    payment method
+    """
+
+    # pylint: disable=too-few-public-methods
+    __tablename__ = "order_rollup"
+
+    order_date = db.Column(db.Date(), primary_key=True)
+    status = db.Column(db.Enum(OrderStatus), primary_key=True)
+    payment_method = db.Column(db.String(64), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False)
+    total_amount_count = db.Column(db.Integer, nullable=False)
+    total_amount_sum = db.Column(db.Double)
+    total_amount_min = db.Column(db.Double)
+    total_amount_max = db.Column(db.Double)
+    shipping_cost_count = db.Column(db.Integer, nullable=False)
+    shipping_cost_sum = db.Column(db.Double)
+    shipping_cost_min = db.Column(db.Double)
+    shipping_cost_max = db.Column(db.Double)
+
+    def __repr__(self):
+        return f"<OrderRollup {self.order_date} {self.status} {self.payment_method}>"
+
+
+def _payment_method():
+    """Returns the payment method of an Order as it is keyed in the rollup"""
+    # a literal so that the SELECT and the GROUP BY use the same expression
+    return db.func.coalesce(Order.payment_method, db.literal_column("''"))
+
+
+def aggregate_select(buckets=None):
+    """Returns a SELECT of the rollup rows computed from the Orders"""
+    columns = [
+        Order.order_date,
+        Order.status,
+        _payment_method().label("payment_method"),
+        db.func.count(Order.id).label("order_count"),
+    ]
+    for amount in AMOUNTS:
+        column = getattr(Order, amount)
+        columns += [
+            db.func.count(column).label(f"{amount}_count"),
+            db.func.sum(column).label(f"{amount}_sum"),
+            db.func.min(column).label(f"{amount}_min"),
+            db.func.max(column).label(f"{amount}_max"),
+        ]
+    keys = (Order.order_date, Order.status, _payment_method())
+    query = db.select(*columns).group_by(*keys)
+    if buckets is not None:
+        query = query.where(db.tuple_(*keys).in_(list(buckets)))
+    return query
+
+
+# the upserts of the databases the rollup can be maintained on; the
+# statistics are computed from the Orders on any other database
+UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def supports(dialect) -> bool:
+    """Returns True when the rollup is maintained on a database dialect"""
+    return dialect.name in UPSERTS
+
+
+def _upsert(connection, table):
+    """Returns an INSERT ... ON CONFLICT of the database of a connection"""
+    return UPSERTS[connection.dialect.name](table)
+
+
+def _extreme(connection, pick: str, current, added):
+    """Returns the min or max of two amounts, either of which may be NULL"""
+    if connection.dialect.name == "postgresql":
+        return (db.func.least if pick == "min" else db.func.greatest)(current, added)
+    # the scalar min() and max() of SQLite are NULL when an argument is
+    return getattr(db.func, pick)(db.func.coalesce(current, added), db.func.coalesce(added, current))
+
+
+def _key(row) -> tuple:
+    """Returns the bucket of an Order row"""
+    return (row.order_date, row.status, row.payment_method or "")
+
+
+def _lock_order(key) -> tuple:
+    """Returns the sort key of a bucket, the order its rows are locked in"""
+    return (key[0], key[1].value, key[2])
+
+
+def refresh(connection, buckets) -> None:
+    """
+    Recomputes some buckets of the rollup from the Orders
+
+    Args:
+        connection: the connection of the transaction that changed the Orders
+        buckets (set): (order_date, OrderStatus, payment_method) tuples
+    """
+    buckets = {
+        (order_date, order_status, payment_method or "")
+        for order_date, order_status, payment_method in buckets
+    }
+    if not buckets:
+        return
+    table = OrderRollup.__table__
+    upsert = _upsert(connection, table).from_select(
+        [column.name for column in table.columns], aggregate_select(buckets)
+    )
+    upsert = upsert.on_conflict_do_update(
+        index_elements=table.primary_key.columns,
+        set_={
+            column.name: upsert.excluded[column.name]
+            for column in table.columns
+            if not column.primary_key
+        },
+    ).returning(table.c.order_date, table.c.status, table.c.payment_method)
+    refreshed = {tuple(row) for row in connection.execute(upsert)}
+
+    # buckets without any Orders left
+    empty = buckets - refreshed
+    if empty:
+        keys = (table.c.order_date, table.c.status, table.c.payment_method)
+        connection.execute(table.delete().where(db.tuple_(*keys).in_(list(empty))))
+
+
+def _deltas(removed, added) -> dict:
+    """
+    Returns the change of every bucket when some Order rows are replaced
+
+    Rows of the same Order that did not change cancel out. Every delta has
+    the counts and sums to add, the minimums and maximums of the added
+    amounts, and the removed amounts under "removed".
+    """
+    before = {row.id: row for row in removed}
+    after = {row.id: row for row in added}
+    unchanged = {order_id for order_id, row in after.items() if before.get(order_id) == row}
+    deltas = {}
+    for sign, rows in ((-1, before), (1, after)):
+        for row in rows.values():
+            if row.id in unchanged:
+                continue
+            delta = deltas.setdefault(_key(row), _empty_delta())
+            delta["order_count"] += sign
+            for amount in AMOUNTS:
+                value = getattr(row, amount)
+                if value is None:
+                    continue
+                value = float(value)
+                delta[f"{amount}_count"] += sign
+                delta[f"{amount}_sum"] += sign * value
+                if sign < 0:
+                    delta["removed"].append((amount, value))
+                    continue
+                for name, pick in ((f"{amount}_min", min), (f"{amount}_max", max)):
+                    delta[name] = value if delta[name] is None else pick(delta[name], value)
+            if sign < 0:
+                delta["removed"].append(("order", None))
+    return deltas
+
+
+def _empty_delta() -> dict:
+    """Returns the delta of a bucket that did not change"""
+    delta = {"order_count": 0, "removed": []}
+    for amount in AMOUNTS:
+        delta.update({f"{amount}_count": 0, f"{amount}_sum": 0.0, f"{amount}_min": None, f"{amount}_max": None})
+    return delta
+
+
+def _needs_aggregate(row, delta) -> bool:
+    """Returns True when the deltas cannot keep a bucket exact"""
+    if row is None or row.order_count + delta["order_count"] <= 0:
+        return True
+    for amount, value in delta["removed"]:
+        if amount == "order":
+            continue
+        low, high = getattr(row, f"{amount}_min"), getattr(row, f"{amount}_max")
+        if low is None or value <= low or value >= high:
+            return True
+    return False
+
+
+def _add_deltas(connection, deltas: dict) -> None:
+    """Adds the deltas of some buckets with one upsert"""
+    table = OrderRollup.__table__
+    rows = [
+        dict(
+            {name: value for name, value in delta.items() if name != "removed"},
+            order_date=key[0],
+            status=key[1],
+            payment_method=key[2],
+        )
+        for key, delta in sorted(deltas.items(), key=lambda item: _lock_order(item[0]))
+    ]
+    upsert = _upsert(connection, table).values(rows)
+    excluded = upsert.excluded
+    changes = {"order_count": table.c.order_count + excluded.order_count}
+    for amount in AMOUNTS:
+        count, total = table.c[f"{amount}_count"], table.c[f"{amount}_sum"]
+        changes[count.name] = count + excluded[count.name]
+        changes[total.name] = db.case(
+            (count + excluded[count.name] == 0, None),
+            else_=db.func.coalesce(total, 0) + db.func.coalesce(excluded[total.name], 0),
+        )
+        for pick in ("min", "max"):
+            name = f"{amount}_{pick}"
+            changes[name] = _extreme(connection, pick, table.c[name], excluded[name])
+    connection.execute(upsert.on_conflict_do_update(index_elements=table.primary_key.columns, set_=changes))
+
+
+def apply(connection, removed, added) -> None:
+    """
+    Changes the rollup for some Order rows that were replaced
+
+    Args:
+        connection: the connection of the transaction that changed the Orders
+        removed (list): the OrderRows as they were before the change,
+            locked with lock_rows() so they cannot change under it
+        added (list): the OrderRows as they are after the change
+    """
+    if not supports(connection.dialect):
+        return
+    deltas = _deltas([OrderRow(*row) for row in removed], [OrderRow(*row) for row in added])
+    if not deltas:
+        return
+    table = OrderRollup.__table__
+    keys = (table.c.order_date, table.c.status, table.c.payment_method)
+    shrinking = sorted((key for key, delta in deltas.items() if delta["removed"]), key=_lock_order)
+    aggregate, current = set(), {}
+    if shrinking:
+        # the lock waits for the writers of the buckets, so their minimums
+        # and maximums are final, and so is an aggregate read afterwards
+        current = {
+            tuple(row[:3]): row
+            for row in connection.execute(
+                db.select(table).where(db.tuple_(*keys).in_(shrinking)).order_by(*keys).with_for_update()
+            )
+        }
+        aggregate = {key for key in shrinking if _needs_aggregate(current.get(key), deltas[key])}
+    # a bucket whose last Orders left is removed without aggregating it
+    empty = {
+        key for key in aggregate if key in current and current[key].order_count + deltas[key]["order_count"] <= 0
+    }
+    if empty:
+        connection.execute(table.delete().where(db.tuple_(*keys).in_(list(empty))))
+    if aggregate - empty:
+        refresh(connection, aggregate - empty)
+    rest = {key: delta for key, delta in deltas.items() if key not in aggregate}
+    if rest:
+        _add_deltas(connection, rest)
+
+
+def lock_rows(connection, *criteria) -> list:
+    """Returns the OrderRows of the Orders that match some criteria, locked until the commit"""
+    return connection.execute(
+        db.select(*ROW_COLUMNS).where(*criteria).order_by(Order.id).with_for_update(of=Order)
+    ).all()
+
+
+def read_rows(connection, *criteria) -> list:
+    """Returns the OrderRows of the Orders that match some criteria"""
+    return connection.execute(db.select(*ROW_COLUMNS).where(*criteria)).all()
+
+
+def rebuild(connection) -> int:
+    """Recomputes the whole rollup and returns the number of buckets"""
+    table = OrderRollup.__table__
+    connection.execute(table.delete())
+    connection.execute(
+        table.insert().from_select(
+            [column.name for column in table.columns], aggregate_select()
+        )
+    )
+    buckets = connection.execute(db.select(db.func.count()).select_from(table)).scalar()
+    logger.info("Rebuilt %d Order rollup buckets", buckets)
+    return buckets
+
+
+######################################################################
+#  I N C R E M E N T A L   M A I N T E N A N C E
+######################################################################
+def _written_orders(session, *collections) -> list:
+    """Returns the ids of the Orders in some collections of the session that changed"""
+    return [
+        instance.id
+        for collection in collections
+        for instance in collection
+        if isinstance(instance, Order)
+        and instance.id is not None
+        and (collection is not session.dirty or session.is_modified(instance))
+    ]
+
+
+@event.listens_for(Session, "before_flush")
+def _remember_rows(session, flush_context, instances):
+    """Locks and remembers the rows of the Orders a flush is about to change"""
+    # pylint: disable=unused-argument
+    # read from the database because expired instances do not know them
+    ids = _written_orders(session, session.dirty, session.deleted)
+    if ids and supports(session.connection().dialect):
+        rows = lock_rows(session.connection(), Order.id.in_(ids))
+        session.info.setdefault(_REMOVED, []).extend(rows)
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_flushed(session, flush_context):
+    """Applies the Orders written by a flush to the rollup"""
+    # pylint: disable=unused-argument
+    removed = session.info.pop(_REMOVED, [])
+    if not supports(session.connection().dialect):
+        return
+    ids = _written_orders(session, session.new, session.dirty)
+    added = read_rows(session.connection(), Order.id.in_(ids)) if ids else []
+    if removed or added:
+        apply(session.connection(), removed, added)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _apply_bulk(orm_execute_state):
+    """Applies the Orders changed by a bulk statement to the rollup"""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not Order:
+        return None
+
+    connection = orm_execute_state.session.connection()
+    if not supports(connection.dialect):
+        return None
+    where = orm_execute_state.statement.whereclause
+    removed = lock_rows(connection, *([] if where is None else [where]))
+    result = orm_execute_state.invoke_statement()
+
+    added = []
+    if orm_execute_state.is_update and removed:
+        # the statement may have moved the Orders to other buckets
+        added = read_rows(connection, Order.id.in_([row.id for row in removed]))
+    apply(connection, removed, added)
+    return result
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rows(session):
+    """Forgets the rows remembered by a flush that failed"""
+    session.info.pop(_REMOVED, None)
@@ -0,0 +1,245 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Order Statistics
+
+Aggregates the Orders selected by an OrderQuery with GROUP BY statements
+so that the size of a report depends on the number of groups and not on
+the number of Orders. Every grouping returns the count of the Orders and
+the sum, minimum, maximum and average of their total_amount and
+shipping_cost.
+
+When the Orders are only filtered by status and date the statistics are
+read from the daily rollup table, which has at most one row per day,
+status and payment method, instead of from the Orders themselves. That
+is on PostgreSQL and SQLite, the databases the rollup is maintained on.
+"""
+import logging
+from collections import namedtuple
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from .persistent_base import db, DataValidationError
+from .order import Order, OrderStatus
+from .order_query import split_values
+from .order_rollup import OrderRollup, supports
+
+logger = logging.getLogger("flask.app")
+
+AMOUNTS = ("total_amount", "shipping_cost")
+PERIODS = ("day", "week", "month")
+GROUPINGS = ("status", "payment_method") + PERIODS
+DEFAULT_GROUPINGS = "status,payment_method,day"
+
+
+def parse_groupings(value) -> list:
+    """Parses the comma separated names of the groupings to compute"""
+    groupings = []
+    for name in split_values(value or DEFAULT_GROUPINGS):
+        if name not in GROUPINGS:
+            raise DataValidationError(
+                f"Cannot group by '{name}'. Use one of {', '.join(GROUPINGS)}."
+            )
+        if name not in groupings:
+            groupings.append(name)
+    return groupings
+
+
+######################################################################
+#  S O U R C E S
+######################################################################
+# Where the statistics are read from: the columns the groupings use, the
+# aggregate columns of every group and the WHERE criteria
+Source = namedtuple("Source", ["name", "keys", "aggregates", "criteria"])
+
+
+def average(total, count):
+    """
+    Returns the SQL expression of an average amount
+
+    The sum is rounded to cents first, so both sources agree on averages
+    that fall on half a cent although the rollup adds and subtracts the
+    doubles in another order than SUM() over the Orders.
+    """
+    return db.func.round(db.cast(total, db.Numeric), 2) / db.func.nullif(count, 0)
+
+
+def order_source(order_query) -> Source:
+    """Returns a Source that aggregates the Orders themselves"""
+    aggregates = [db.func.count(Order.id).label("count")]
+    for amount in AMOUNTS:
+        column = getattr(Order, amount)
+        aggregates += [
+            db.func.sum(column).label(f"{amount}_sum"),
+            db.func.min(column).label(f"{amount}_min"),
+            db.func.max(column).label(f"{amount}_max"),
+            average(db.func.sum(column), db.func.count(column)).label(f"{amount}_avg"),
+        ]
+    keys = {
+        "order_date": Order.order_date,
+        "status": Order.status,
+        "payment_method": Order.payment_method,
+    }
+    return Source("orders", keys, aggregates, order_query.criteria)
+
+
+# Filters of the Order list that can be answered from the rollup
+ROLLUP_FILTERS = {
+    "status": OrderRollup.status.in_,
+    "order-start": lambda start: OrderRollup.order_date >= start,
+    "order-end": lambda end: OrderRollup.order_date <= end,
+}
+
+
+def rollup_source(order_query) -> Source:
+    """Returns a Source that aggregates the daily rollup of the Orders"""
+    aggregates = [db.func.coalesce(db.func.sum(OrderRollup.order_count), 0).label("count")]
+    for amount in AMOUNTS:
+        count = db.func.sum(getattr(OrderRollup, f"{amount}_count"))
+        total = db.func.sum(getattr(OrderRollup, f"{amount}_sum"))
+        aggregates += [
+            total.label(f"{amount}_sum"),
+            db.func.min(getattr(OrderRollup, f"{amount}_min")).label(f"{amount}_min"),
+            db.func.max(getattr(OrderRollup, f"{amount}_max")).label(f"{amount}_max"),
+            average(total, count).label(f"{amount}_avg"),
+        ]
+    keys = {
+        "order_date": OrderRollup.order_date,
+        "status": OrderRollup.status,
+        "payment_method": db.func.nullif(OrderRollup.payment_method, ""),
+    }
+    criteria = [
+        ROLLUP_FILTERS[arg](value) for arg, value in order_query.values.items()
+    ]
+    return Source("rollup", keys, aggregates, criteria)
+
+
+class PeriodStart(FunctionElement):
+    """The first day of the week (a Monday) or of the month of a date"""
+
+    # pylint: disable=too-many-ancestors, abstract-method
+    type = db.Date()
+    name = "period_start"
+    inherit_cache = False
+
+    def __init__(self, period: str, order_date):
+        self.period = period
+        super().__init__(order_date)
+
+
+@compiles(PeriodStart)
+def _period_start(element, compiler, **kwargs):
+    """Compiles the start of a period with date_trunc"""
+    # a literal so that the SELECT and the GROUP BY use the same expression
+    period = db.literal_column(f"'{element.period}'")
+    return compiler.process(db.cast(db.func.date_trunc(period, *element.clauses), db.Date), **kwargs)
+
+
+@compiles(PeriodStart, "sqlite")
+def _period_start_sqlite(element, compiler, **kwargs):
+    """Compiles the start of a period with the date modifiers of SQLite"""
+    # six days back and on to the next Monday is the Monday of the week
+    modifiers = ("'-6 days'", "'weekday 1'") if element.period == "week" else ("'start of month'",)
+    return compiler.process(
+        db.func.date(*element.clauses, *(db.literal_column(modifier) for modifier in modifiers)), **kwargs
+    )
+
+
+def group_key(source: Source, grouping: str):
+    """Returns the SQL expression the rows of a grouping are grouped by"""
+    if grouping in PERIODS:
+        order_date = source.keys["order_date"]
+        if grouping == "day":
+            return order_date
+        return PeriodStart(grouping, order_date)
+    return source.keys[grouping]
+
+
+def _round(value):
+    """Rounds an aggregated amount to cents, keeping None for empty groups"""
+    return None if value is None else round(float(value), 2)
+
+
+def summarize(row) -> dict:
+    """Converts a row of aggregates into a dictionary"""
+    summary = {"count": row.count}
+    for amount in AMOUNTS:
+        summary[amount] = {
+            stat: _round(getattr(row, f"{amount}_{stat}"))
+            for stat in ("sum", "min", "max", "avg")
+        }
+    return summary
+
+
+def format_key(key):
+    """Returns a group key as it appears in JSON"""
+    if isinstance(key, OrderStatus):
+        return key.name
+    if hasattr(key, "isoformat"):
+        return key.isoformat()
+    return key
+
+
+######################################################################
+#  O R D E R   S T A T S
+######################################################################
+class OrderStats:
+    """
+    Statistics about the Orders that match an OrderQuery
+
+    Args:
+        order_query (OrderQuery): the filters to apply
+        groupings (list): names of the groupings to compute, see GROUPINGS
+        use_rollup (bool): read from the rollup when the filters allow it
+    """
+
+    def __init__(self, order_query, groupings, use_rollup=True):
+        self.groupings = groupings
+        rollup = use_rollup and supports(db.session.get_bind().dialect)
+        if rollup and set(order_query.values) <= set(ROLLUP_FILTERS):
+            self.source = rollup_source(order_query)
+        else:
+            self.source = order_source(order_query)
+
+    def total(self) -> dict:
+        """Returns the statistics over every matching Order"""
+        row = db.session.execute(
+            db.select(*self.source.aggregates).where(*self.source.criteria)
+        ).one()
+        return summarize(row)
+
+    def grouped(self, grouping: str) -> list:
+        """Returns the statistics of each group of a grouping"""
+        key = group_key(self.source, grouping).label("key")
+        rows = db.session.execute(
+            db.select(key, *self.source.aggregates)
+            .where(*self.source.criteria)
+            .group_by(key)
+            .order_by(key)
+        )
+        return [{"key": format_key(row.key), **summarize(row)} for row in rows]
+
+    def compute(self) -> dict:
+        """Returns the totals and every requested grouping"""
+        logger.info(
+            "Computing Order statistics by %s from the %s",
+            ", ".join(self.groupings),
+            self.source.name,
+        )
+        stats = {"total": self.total()}
+        for grouping in self.groupings:
+            stats[f"by_{grouping}"] = self.grouped(grouping)
+        return stats
@@ -0,0 +1,226 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Order Status Transitions
+
+The state machine of the Order statuses. Every action is declared in
+TRANSITIONS with the status it moves an Order to, the statuses it may
+move it from and the reason given when an Order is in any other status.
+An Order, or many Orders picked by id or by the filters of the Order
+list, are moved with one conditional UPDATE ... WHERE status IN (...)
+RETURNING. The status check and the write are one statement, so two
+requests cannot both move the same Order out of a status: the one that
+loses the race matches no row and is refused.
+
+The time every transition takes is kept in transition_latency and
+reported by GET /metrics.
+
+Usage:
+    order, current = transition(order_id, "ship")
+    result = bulk_transition("ship", ids=[1, 2, 3])
+"""
+import logging
+import time
+from collections import namedtuple
+from sqlalchemy.exc import SQLAlchemyError
+from service.common import metrics
+from .persistent_base import db, DataValidationError
+from .commit_hooks import record, Change, UPDATE
+from .order import Order, OrderStatus
+from .order_readers import ORDER_COLUMNS, OrderRecord, attach_items
+from . import order_rollup
+
+logger = logging.getLogger("flask.app")
+
+Transition = namedtuple("Transition", ["target", "sources", "refusal"])
+
+TRANSITIONS = {
+    "packing": Transition(
+        OrderStatus.PACKING,
+        (OrderStatus.STARTED, OrderStatus.PACKING),
+        "Orders that have been {status} cannot be set to PACKING",
+    ),
+    "ship": Transition(
+        OrderStatus.SHIPPING,
+        (OrderStatus.STARTED, OrderStatus.PACKING, OrderStatus.SHIPPING, OrderStatus.RETURNED),
+        "Orders that have been {status} cannot be shipped",
+    ),
+    "deliver": Transition(
+        OrderStatus.DELIVERED,
+        (OrderStatus.SHIPPING, OrderStatus.DELIVERED),
+        "Orders in {status} cannot be delivered",
+    ),
+    "cancel": Transition(
+        OrderStatus.CANCELLED,
+        (OrderStatus.STARTED, OrderStatus.PACKING, OrderStatus.SHIPPING, OrderStatus.CANCELLED),
+        "Orders that have been delivered cannot be cancelled",
+    ),
+}
+
+# how long transitions took, by action, and whether they moved the Orders
+transition_latency = metrics.LatencyStats()
+metrics.register("transitions", transition_latency.stats)
+
+
+def refusal(action: str, current: OrderStatus) -> str:
+    """Returns why an Order in some status cannot make a transition"""
+    return TRANSITIONS[action].refusal.format(status=current.name)
+
+
+def _move(transition_: Transition, scope: list, columns) -> list:
+    """Moves the Orders in scope that may make a transition, returns their rows"""
+    connection = db.session.connection()
+    # locking the rows first gives the rollup the statuses they come from
+    before = order_rollup.lock_rows(connection, *scope, Order.status.in_(transition_.sources))
+    if not before:
+        return []
+    rows = connection.execute(
+        db.update(Order)
+        .where(*scope, Order.status.in_(transition_.sources))
+        .values(status=transition_.target, version=Order.version + 1)
+        .returning(*columns)
+    ).all()
+    for row in rows:
+        record(db.session, Change(UPDATE, Order, row.id, {"id": row.id, "status": transition_.target}))
+    order_rollup.apply(
+        connection,
+        before,
+        [order_rollup.OrderRow(*row)._replace(status=transition_.target) for row in before],
+    )
+    return rows
+
+
+def _failed(action: str, error: SQLAlchemyError) -> DataValidationError:
+    """Rolls back a transition that could not be written and returns the error"""
+    db.session.rollback()
+    logger.error("Transition %s of Orders failed: %s", action, error)
+    return DataValidationError(f"Could not {action} the Orders: {getattr(error, 'orig', None) or error}")
+
+
+######################################################################
+#  O N E   O R D E R
+######################################################################
+def transition(order_id: int, action: str):
+    """
+    Moves an Order to the status of an action, if its status allows it
+
+    Returns:
+        tuple: the moved OrderRecord, with its Items, or None when the
+            Order was not moved, and the status the Order is in, which
+            is None when there is no such Order
+    """
+    transition_ = TRANSITIONS[action]
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        rows = _move(transition_, [Order.id == order_id], [getattr(Order, name) for name in ORDER_COLUMNS])
+        if rows:
+            order = attach_items([OrderRecord(rows[0])])[0]
+            db.session.commit()
+            outcome = "moved"
+            return order, order.status
+        current = db.session.execute(db.select(Order.status).where(Order.id == order_id)).scalar()
+        db.session.rollback()
+        outcome = "missing" if current is None else "refused"
+        return None, current
+    except SQLAlchemyError as error:
+        raise _failed(action, error) from error
+    finally:
+        transition_latency.observe(action, time.perf_counter() - start, outcome)
+
+
+######################################################################
+#  M A N Y   O R D E R S
+######################################################################
+def _rejected(transition_: Transition, scope: list, ids, missing: str) -> list:
+    """Returns the id and the reason of every Order in scope that was not moved"""
+    rows = db.session.connection().execute(
+        db.select(Order.id, Order.status)
+        .where(*scope, Order.status.not_in(transition_.sources))
+        .order_by(Order.id)
+    ).all()
+    rejected = [
+        {"id": row.id, "error": transition_.refusal.format(status=row.status.name)}
+        for row in rows
+    ]
+    if ids is not None:
+        found = {row.id for row in rows}
+        rejected += [{"id": order_id, "error": missing} for order_id in ids if order_id not in found]
+    return rejected
+
+
+def _matching_ids(criteria: list, max_orders: int):
+    """Returns the ids of the Orders that match some criteria, None if there are too many"""
+    ids = (
+        db.session.connection()
+        .execute(db.select(Order.id).where(*criteria).order_by(Order.id).limit(max_orders + 1))
+        .scalars()
+        .all()
+    )
+    return None if len(ids) > max_orders else ids
+
+
+def bulk_transition(action: str, ids=None, criteria=(), max_orders: int = None):
+    """
+    Moves many Orders to the status of an action
+
+    Args:
+        action (str): one of the TRANSITIONS
+        ids (list): the ids of the Orders, or None for every Order
+        criteria (list): more criteria the Orders must match, e.g. the
+            criteria of an OrderQuery
+        max_orders (int): the most Orders criteria without ids may match,
+            None for no limit
+
+    Returns:
+        dict: the "status" the Orders were moved to, the ids of the Orders
+            that were "transitioned" and the "rejected" ones, with an
+            error each, or None when the criteria matched more than
+            max_orders Orders and none was moved
+    """
+    transition_ = TRANSITIONS[action]
+    scope = list(criteria)
+    start = time.perf_counter()
+    if ids is None and max_orders is not None:
+        # a filter is held to the same bound as a list of ids
+        ids = _matching_ids(scope, max_orders)
+        if ids is None:
+            db.session.rollback()
+            transition_latency.observe(f"{action}_bulk", time.perf_counter() - start, "refused")
+            return None
+    if ids is not None:
+        ids = list(dict.fromkeys(ids))
+        scope.append(Order.id.in_(ids))
+    try:
+        rows = _move(transition_, scope, (Order.id,))
+        moved = {row.id for row in rows}
+        rejected = []
+        if ids is None or len(moved) < len(ids):
+            remaining = None if ids is None else [order_id for order_id in ids if order_id not in moved]
+            missing = "Order was not found or did not match the filter" if criteria else "Order was not found"
+            rejected = _rejected(transition_, scope, remaining, missing)
+        db.session.commit()
+    except SQLAlchemyError as error:
+        transition_latency.observe(f"{action}_bulk", time.perf_counter() - start, "error")
+        raise _failed(action, error) from error
+    transition_latency.observe(f"{action}_bulk", time.perf_counter() - start, "moved" if moved else "refused")
+    logger.info("Moved %d Orders to %s, rejected %d", len(moved), transition_.target.name, len(rejected))
+    return {
+        "status": transition_.target.name,
+        "transitioned": sorted(moved),
+        "rejected": rejected,
+    }
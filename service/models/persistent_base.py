@@ -16,21 +16,96 @@
 
 """
 Persistent Base class for database CRUD functions
+
+create(), update() and delete() commit at once, unless they are called
+inside a unit of work. Then they only flush, so ids are assigned and
+constraint errors are raised where they happen. The whole unit commits
+once at its end, or rolls back if it raises.
+
+Usage:
+    with unit_of_work():
+        order.create()
+        item.update()
+
+    @unit_of_work()
+    def handler():
+        ...
 """
 
 import logging
 from abc import abstractmethod
+from contextlib import contextmanager
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
 
 logger = logging.getLogger("flask.app")
 
 db = SQLAlchemy()
 
+# how many units of work of the session are open, in session.info
+_DEPTH = "unit_of_work_depth"
+
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class StaleVersionError(Exception):
+    """Used when a record was changed by another request since it was read"""
+
+
+######################################################################
+#  U N I T   O F   W O R K
+######################################################################
+def in_unit_of_work() -> bool:
+    """Returns True when the writes of the session are deferred to a unit of work"""
+    return db.session.info.get(_DEPTH, 0) > 0
+
+
+def _write_error(error: Exception, subject) -> Exception:
+    """Returns the error of the service for a failed flush or commit"""
+    if isinstance(error, StaleDataError):
+        # the UPDATE or DELETE is guarded by the version the record was read at
+        logger.warning("Stale version of record: %s", subject)
+        return StaleVersionError(f"{subject} was changed by another request")
+    logger.error("Error writing record: %s", subject)
+    return DataValidationError(error)
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Groups the writes of a block, or of a decorated function, in one transaction
+
+    Units of work nest: only the outermost one commits, so a function that
+    opens one can be called from another. When the block raises, the whole
+    transaction is rolled back and the error is raised again.
+
+    Raises:
+        StaleVersionError: when a record was changed by another request
+        DataValidationError: when the commit failed otherwise
+    """
+    session = db.session
+    depth = session.info.get(_DEPTH, 0)
+    session.info[_DEPTH] = depth + 1
+    try:
+        yield session
+    except BaseException:
+        if depth == 0:
+            session.rollback()
+        raise
+    finally:
+        session.info[_DEPTH] = depth
+    if depth == 0:
+        try:
+            session.commit()
+        except SQLAlchemyError as error:
+            session.rollback()
+            raise _write_error(error, "unit of work") from error
+
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
@@ -48,6 +123,26 @@ class PersistentBase:
     def deserialize(self, data: dict) -> None:
         """Convert a dictionary into an object"""
 
+    def _write(self, stage=None) -> None:
+        """Flushes the changes inside a unit of work, commits them otherwise"""
+        try:
+            if stage is not None:
+                stage(self)
+            if in_unit_of_work():
+                db.session.flush()
+            else:
+                db.session.commit()
+        except Exception as e:
+            # a unit of work rolls back the whole transaction when it ends
+            if not in_unit_of_work():
+                db.session.rollback()
+            raise _write_error(e, self._describe()) from e
+
+    def _describe(self) -> str:
+        """Names the record without loading it, for a session that may have failed"""
+        identity = inspect(self).identity
+        return f"{type(self).__name__} {identity[0] if identity else 'new'}"
+
     def create(self) -> None:
         """
         Creates a Account to the database
@@ -55,13 +150,7 @@ class PersistentBase:
         logger.info("Creating %s", self)
         # id must be none to generate next primary key
         self.id = None
-        try:
-            db.session.add(self)
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            logger.error("Error creating record: %s", self)
-            raise DataValidationError(e) from e
+        self._write(db.session.add)
 
     def update(self) -> None:
         """
@@ -70,34 +159,45 @@ class PersistentBase:
         logger.info("Updating %s", self)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
-        try:
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            logger.error("Error updating record: %s", self)
-            raise DataValidationError(e) from e
+        self._write()
 
     def delete(self) -> None:
         """Removes a Account from the data store"""
         logger.info("Deleting %s", self)
-        try:
-            db.session.delete(self)
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            logger.error("Error deleting record: %s", self)
-            raise DataValidationError(e) from e
+        self._write(db.session.delete)
+
+    @classmethod
+    def loader_options(cls, single: bool = False) -> list:
+        """
+        Returns the relationship loading options for read queries
+
+        Models with relationships override this so that reading a record
+        also loads its children without one extra query per record.
+
+        Args:
+            single (bool): True when a single record is being fetched
+        """
+        # pylint: disable=unused-argument
+        return []
 
     @classmethod
     def all(cls):
         """Returns all of the records in the database"""
         logger.info("Processing all records")
         # pylint: disable=no-member
-        return cls.query.all()
+        return cls.query.options(*cls.loader_options()).all()
+
+    @classmethod
+    def find_version(cls, by_id):
+        """Returns the version of a record without loading it, None if missing"""
+        # pylint: disable=no-member
+        return db.session.query(cls.version).filter(cls.id == by_id).scalar()
 
     @classmethod
     def find(cls, by_id):
         """Finds a record by it's ID"""
         logger.info("Processing lookup for id %s ...", by_id)
         # pylint: disable=no-member
-        return cls.query.session.get(cls, by_id)
+        return cls.query.session.get(
+            cls, by_id, options=cls.loader_options(single=True)
+        )
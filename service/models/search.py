@@ -0,0 +1,116 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Substring Search
+
+A LIKE '%name%' pattern cannot be served by a B-tree index. On PostgreSQL
+the pg_trgm GIN index created by the schema migrations serves it. Other
+databases (SQLite test runs) use the NgramIndex below, an in-process
+inverted index from every 1, 2 and 3 character gram to the rows that
+contain it, so a search only has to look at the rows that share the
+rarest gram of the search term instead of every row in the table.
+
+The in-process index lives in one process only, which is fine for tests
+and single process development servers but not for gunicorn workers
+sharing a database; use PostgreSQL there.
+"""
+import logging
+import threading
+
+logger = logging.getLogger("flask.app")
+
+GRAM_SIZE = 3
+
+
+def grams(text: str, size: int) -> set:
+    """Returns the distinct substrings of a given size in a text"""
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class NgramIndex:
+    """
+    Case-insensitive substring index over short text values
+
+    Keys are the primary keys of the indexed rows. Every search result
+    is verified against the indexed text so a match is always exact.
+    """
+
+    def __init__(self, gram_size: int = GRAM_SIZE):
+        self.gram_size = gram_size
+        self._texts = {}
+        self._postings = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._texts)
+
+    def _grams(self, text: str) -> set:
+        """Returns every gram of up to gram_size characters in a text"""
+        found = set()
+        for size in range(1, self.gram_size + 1):
+            found |= grams(text, size)
+        return found
+
+    def add(self, key, text) -> None:
+        """Indexes (or re-indexes) the text of a row"""
+        with self._lock:
+            self._discard(key)
+            if text is None:
+                return
+            text = text.lower()
+            self._texts[key] = text
+            for gram in self._grams(text):
+                self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key) -> None:
+        """Removes a row from the index"""
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key) -> None:
+        """Removes a row from the index while holding the lock"""
+        text = self._texts.pop(key, None)
+        if text is None:
+            return
+        for gram in self._grams(text):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(key)
+                if not postings:
+                    del self._postings[gram]
+
+    def clear(self) -> None:
+        """Empties the index"""
+        with self._lock:
+            self._texts.clear()
+            self._postings.clear()
+            self.loaded = False
+
+    def search(self, term: str) -> set:
+        """Returns the keys of the rows whose text contains a term"""
+        term = (term or "").lower()
+        with self._lock:
+            if not term:
+                return set(self._texts)
+            if len(term) <= self.gram_size:
+                return set(self._postings.get(term, ()))
+            # walk the rarest gram of the term and verify each candidate
+            term_grams = grams(term, self.gram_size)
+            postings = [self._postings.get(gram, set()) for gram in term_grams]
+            rarest = min(postings, key=len)
+            return {key for key in rarest if term in self._texts[key]}
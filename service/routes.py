@@ -22,8 +22,11 @@ This service implements a REST API that allows you to manage Orders for a financ
 Paths:
 ------
 GET / - Displays a UI for Selenium testing
-GET /orders - Returns a list all of the Orders
-GET /orders/{order_id} - Returns the Order with a given id number
+GET /orders - Returns a list all of the Orders (one page at a time with ?limit=&cursor=,
+               streamed as NDJSON or a chunked JSON array on request)
+GET /orders/{order_id} - Returns the Order with a given id number (cached in process)
+GET /orders?fields=id,status or ?view=summary - Returns only some fields of the Orders
+GET /orders/stats - Returns counts and amount statistics of the Orders grouped in SQL
 POST /orders - creates a new Order record in the database
 PUT /orders/{order_id} - updates an Order record in the database
 DELETE /orders/{order_id} - deletes an Order record in the database
@@ -33,26 +36,43 @@ PUT /orders/{order_id}/deliver - delivers an Order record in the database
 PUT /orders/{order_id}/packing - packs an Order record in the database
 PUT /orders/{order_id}/ship - ships an Order record in the database
 
+GET /orders?product_id={product_id} - Returns the Orders that contain a product
+GET /items?product_id={product_id} - Returns the Items of a product in every Order
 GET /orders/{order_id}/items - Returns a list all of the Items in an Order
 GET /orders/{order_id}/items/{item_id} - Returns the Item with a given id number
 POST /orders/{order_id}/items - creates a new Item record in the database
 PUT /orders/{order_id}/items/{item_id} - updates an Item record in the database
 DELETE /orders/{order_id}/items/{item_id} - deletes an Item record in the database
-"""
-import math
 
-from datetime import datetime
+GET /metrics - Returns the cache counters
+"""
+# pylint: disable=too-many-lines
+import itertools
 
 from flask import jsonify
 
-from flask import request, abort
+from flask import Response, request, abort, stream_with_context
 from flask import current_app as app  # Import Flask application
-from flask_restx import Resource, fields, reqparse
+from flask_restx import Resource, fields, reqparse, inputs
+from flask_restx.mask import Mask, ParseError
 
 # pylint: disable=cyclic-import
-from service.models import Order, Item
-from service.models.order import OrderStatus
+from service.models import Order, Item, DataValidationError, unit_of_work
+from service.models.order import OrderStatus, SUMMARY_FIELDS
+from service.models.order_query import OrderQuery, FILTERS
+from service.models.order_stats import OrderStats, GROUPINGS, parse_groupings
+from service.models.order_readers import make_reader, find_order_items
+from service.models.order_batch import create_orders, add_items
+from service.models.order_transitions import bulk_transition, transition, refusal, TRANSITIONS
 from service.common import status  # HTTP Status Codes
+from service.common import metrics
+from service.common.cache import order_cache, response_cache, missing_cache, MISSING_ENTRY_SIZE
+from service.common.shared_cache import shared_cache
+from service.common.singleflight import flights
+from service.common.assets import asset_store
+from service.common.etags import make_etag, etag_header, not_modified, version_matches
+from service.common.pagination import keyset_paginate, page_headers
+from service.common.representation import FieldPlan, dumps, loads
 from . import api
 
 
@@ -62,9 +82,21 @@ from . import api
 @app.route("/")
 def index():
     """Root URL response"""
+    if asset_store.built:
+        # the page points at the hashed assets, so it is revalidated every time
+        return asset_store.page("index.html"), status.HTTP_200_OK, {"Cache-Control": "no-cache"}
     return app.send_static_file("index.html")
 
 
+######################################################################
+# GET HASHED STATIC ASSETS
+######################################################################
+@app.route("/assets/<path:filename>")
+def assets(filename):
+    """Returns a hashed static asset, precompressed when the client accepts it"""
+    return asset_store.send(filename)
+
+
 # Define the model so that the docs reflect what can be sent
 item_create_model = api.model(
     "Item",
@@ -147,6 +179,119 @@ order_model = api.inherit(
     },
 )
 
+order_summary_model = api.model(
+    "OrderSummary",
+    {
+        "id": fields.Integer(description="The unique id of the Order"),
+        "customer_id": fields.Integer(description="The ID of the customer"),
+        "order_date": fields.Date(description="The date the Order was made"),
+        "status": fields.String(
+            enum=[e.name for e in OrderStatus], description="The status of the Order"
+        ),
+        "total_amount": fields.Float(description="The total cost of the Order"),
+    },
+)
+
+product_item_model = api.inherit(
+    "ProductItem",
+    item_model,
+    {"order": fields.Nested(order_summary_model, description="The Order of the Item")},
+)
+
+# the models compiled to render model objects without serialize()
+item_plan = FieldPlan(item_model)
+order_plan = FieldPlan(order_model)
+product_item_plan = FieldPlan(product_item_model)
+
+batch_result_model = api.model(
+    "BatchResult",
+    {
+        "index": fields.Integer(description="The position of the record in the batch"),
+        "id": fields.Integer(description="The id of the created record"),
+        "error": fields.String(description="Why the record was not created"),
+    },
+)
+
+batch_model = api.model(
+    "Batch",
+    {
+        "created": fields.Integer(description="The number of records created"),
+        "failed": fields.Integer(description="The number of records that were not created"),
+        "results": fields.List(
+            fields.Nested(batch_result_model, skip_none=True),
+            description="The outcome of every record, in the order they were posted",
+        ),
+    },
+)
+
+transition_create_model = api.model(
+    "TransitionRequest",
+    {
+        "ids": fields.List(fields.Integer, description="The ids of the Orders to move"),
+        "filter": fields.Raw(
+            description="Move the Orders that match these GET /orders filters, e.g. {\"status\": \"PACKING\"}"
+        ),
+    },
+)
+
+transition_rejection_model = api.model(
+    "TransitionRejection",
+    {
+        "id": fields.Integer(description="The id of the Order"),
+        "error": fields.String(description="Why the Order was not moved"),
+    },
+)
+
+transition_model = api.model(
+    "Transition",
+    {
+        "status": fields.String(description="The status the Orders were moved to"),
+        "transitioned": fields.List(fields.Integer, description="The ids of the Orders that were moved"),
+        "rejected": fields.List(
+            fields.Nested(transition_rejection_model),
+            description="The Orders that were not moved",
+        ),
+    },
+)
+
+amount_stats_model = api.model(
+    "AmountStats",
+    {
+        "sum": fields.Float(description="The sum of the amounts"),
+        "min": fields.Float(description="The smallest amount"),
+        "max": fields.Float(description="The largest amount"),
+        "avg": fields.Float(description="The average amount"),
+    },
+)
+
+group_stats_model = api.model(
+    "OrderGroupStats",
+    {
+        "key": fields.String(
+            description="The status, payment method or first day of the period"
+        ),
+        "count": fields.Integer(description="The number of Orders in the group"),
+        "total_amount": fields.Nested(amount_stats_model),
+        "shipping_cost": fields.Nested(amount_stats_model),
+    },
+)
+
+order_stats_model = api.model(
+    "OrderStats",
+    {
+        "total": fields.Nested(
+            group_stats_model, description="The statistics of every matching Order"
+        ),
+        **{
+            f"by_{grouping}": fields.List(
+                fields.Nested(group_stats_model),
+                description=f"The statistics by {grouping}, when requested",
+            )
+            for grouping in GROUPINGS
+        },
+    },
+)
+
 # query string arguments
 item_args = reqparse.RequestParser()
 item_args.add_argument(
@@ -164,57 +309,139 @@ item_args.add_argument(
     help="List Items with a specific name",
 )
 
-order_args = reqparse.RequestParser()
-order_args.add_argument(
+product_item_args = reqparse.RequestParser()
+product_item_args.add_argument(
+    "product_id",
+    type=int,
+    location="args",
+    required=True,
+    help="List the Items of a product across all Orders",
+)
+product_item_args.add_argument(
+    "limit",
+    type=inputs.int_range(1, app.config["PAGE_SIZE_MAX"]),
+    location="args",
+    required=False,
+    help="Return at most this many Items per page",
+)
+product_item_args.add_argument(
+    "cursor",
+    type=str,
+    location="args",
+    required=False,
+    help="Continue from the page position returned in the Link header",
+)
+
+order_view_args = reqparse.RequestParser()
+order_view_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Only return these fields, e.g. id,status,items{name,quantity}",
+)
+order_view_args.add_argument(
+    "view",
+    type=str,
+    choices=("full", "summary"),
+    default="full",
+    location="args",
+    required=False,
+    help="Return the full Order or only its summary fields",
+)
+
+order_filter_args = reqparse.RequestParser()
+order_filter_args.add_argument(
     "order-start",
     type=str,
     location="args",
     required=False,
     help="List Orders ordered after a date",
 )
-order_args.add_argument(
+order_filter_args.add_argument(
     "order-end",
     type=str,
     location="args",
     required=False,
     help="List Orders ordered before a date",
 )
-order_args.add_argument(
+order_filter_args.add_argument(
     "total-min",
     type=str,
-    default=0.0,
     location="args",
     required=False,
     help="List Orders with a total cost above a price point",
 )
-order_args.add_argument(
+order_filter_args.add_argument(
     "total-max",
     type=str,
-    default=math.inf,
     location="args",
     required=False,
     help="List Orders with a total cost below a price point",
 )
-order_args.add_argument(
+order_filter_args.add_argument(
     "customer-id",
     type=str,
     location="args",
     required=False,
     help="List Orders from a specific customer",
 )
-order_args.add_argument(
+order_filter_args.add_argument(
     "status",
     type=str,
+    action="append",
+    location="args",
+    required=False,
+    help="List Orders with one of these Order statuses (repeat or comma separate)",
+)
+order_filter_args.add_argument(
+    "product_id",
+    type=str,
     location="args",
     required=False,
-    help="List Orders with a specific Order status",
+    help="List Orders that contain an Item of a product",
 )
+
+order_args = order_view_args.copy()
+for argument in order_filter_args.args:
+    order_args.add_argument(argument)
 order_args.add_argument(
     "sort_by",
     type=str,
     location="args",
     required=False,
-    help="List Orders sorted by a particular metric",
+    help="Sort by order_date, total_amount or id, each optionally :asc (default :desc)",
+)
+order_args.add_argument(
+    "limit",
+    type=inputs.int_range(1, app.config["PAGE_SIZE_MAX"]),
+    location="args",
+    required=False,
+    help="Return at most this many Orders per page",
+)
+order_args.add_argument(
+    "cursor",
+    type=str,
+    location="args",
+    required=False,
+    help="Continue from the page position returned in the Link header",
+)
+order_args.add_argument(
+    "stream",
+    type=inputs.boolean,
+    default=False,
+    location="args",
+    required=False,
+    help="Stream the Orders as a chunked JSON array",
+)
+
+order_stats_args = order_filter_args.copy()
+order_stats_args.add_argument(
+    "group_by",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated groupings: status, payment_method, day, week or month",
 )
 
 
@@ -242,8 +469,11 @@ class OrderResource(Resource):
     # READ AN ORDER
     ######################################################################
     @api.doc("get_orders")
+    @api.expect(order_view_args, validate=True)
+    @api.header("ETag", "The version of the Order")
+    @api.response(304, "The Order matches the If-None-Match header")
     @api.response(404, "Order not found")
-    @api.marshal_with(order_model)
+    @api.response(status.HTTP_200_OK, "Success", order_model)
     def get(self, order_id):
         """
         Retrieve a single Order
@@ -251,29 +481,62 @@ class OrderResource(Resource):
         This endpoint will return a Order based on its id
         """
         app.logger.info("Request for order with id: %s", order_id)
-
-        order = Order.find(order_id)
-        if not order:
-            abort(
-                status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found."
+        mask = order_projection(order_view_args.parse_args())
+        selected = mask_fields(mask)
+
+        generation = shared_cache.generation(order_id)
+        key = ("order", order_id, str(mask) if mask else None)
+        response = cached_response(key, generation)
+        if response is not None:
+            return response
+        missing = ("order", order_id)
+        check_missing(missing, generation, f"Order with id '{order_id}' was not found.")
+
+        cached = cached_order(order_id, generation)
+        if cached is None and request.if_none_match:
+            # a poller that has the current version only costs the version lookup
+            version = Order.find_version(order_id)
+            if version is not None:
+                tag = make_etag("order", order_id, version, selected)
+                if not_modified(tag):
+                    return "", status.HTTP_304_NOT_MODIFIED, etag_header(tag)
+
+        if cached is None:
+            cached = flights.do(
+                flight_key(generation), lambda: load_order(order_id, mask, generation)
             )
-
-        app.logger.info("Returning order: %s", order.id)
-        return order.serialize(), status.HTTP_200_OK
+        version, data = cached
+        tag = make_etag("order", order_id, version, selected)
+        if not_modified(tag):
+            return "", status.HTTP_304_NOT_MODIFIED, etag_header(tag)
+
+        app.logger.info("Returning order: %s", order_id)
+        if isinstance(data, bytes):
+            if mask is None:
+                # the cached document is the full representation already
+                return cache_response(key, generation, data, tag)
+            data = api.marshal(loads(data), order_model, mask=mask)
+        return cache_response(key, generation, encode_json(data), tag)
 
     ######################################################################
     # UPDATE AN EXISTING ORDER
     ######################################################################
     @api.doc("update_orders")
+    @api.header("ETag", "The new version of the Order")
     @api.response(404, "Order not found")
     @api.response(400, "The posted Order data was not valid")
+    @api.response(409, "The Order was changed by another request while it was updated")
+    @api.response(412, "The Order is not in the version named by the If-Match header")
     @api.expect(order_model)
-    @api.marshal_with(order_model)
+    @api.response(status.HTTP_200_OK, "Success", order_model)
+    @unit_of_work()
     def put(self, order_id):
         """
         Update an Order
 
-        This endpoint will update an Order based the body that is posted
+        This endpoint will update an Order based the body that is posted.
+        With an If-Match header it is only updated if it is still in the
+        version of that ETag.
         """
         app.logger.info("Request to update order with id: %s", order_id)
         check_content_type("application/json")
@@ -283,6 +546,7 @@ class OrderResource(Resource):
             abort(
                 status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found."
             )
+        check_if_match(make_etag("order", order.id, order.version))
 
         # Update from the json in the body of the request
 
@@ -291,13 +555,15 @@ class OrderResource(Resource):
         order.deserialize(data)
         order.id = order_id
         order.update()
-        return order.serialize(), status.HTTP_200_OK
+        tag = make_etag("order", order.id, order.version)
+        return json_response(encode_json(order_plan.render(order)), status.HTTP_200_OK, etag_header(tag))
 
     ######################################################################
     # DELETE AN ORDER
     ######################################################################
     @api.doc("delete_orders")
     @api.response(204, "Order deleted")
+    @unit_of_work()
     def delete(self, order_id):
         """
         Delete a Order
@@ -324,68 +590,31 @@ class OrderCollection(Resource):
     ######################################################################
     # LIST ALL ORDERS
     ######################################################################
-    # flake8: noqa: C901
     @api.doc("list_orders")
     @api.expect(order_args, validate=True)
-    @api.marshal_list_with(order_model)
+    @api.produces(["application/json", "application/x-ndjson"])
+    @api.response(status.HTTP_200_OK, "Success", [order_model])
     def get(self):
         """Returns all Orders within a date range and total amount range if specified, sorted by order date or total amount."""
         app.logger.info("Request for Order list")
-
-        # try:
-        query = Order.query
         args = order_args.parse_args()
 
-        if args["status"]:
-            query = query.filter(Order.status == args["status"])
-
-        if args["order-start"]:
-            start_date = datetime.strptime(args["order-start"], "%Y-%m-%d").date()
-            query = query.filter(Order.order_date >= start_date)
-
-        if args["order-end"]:
-            end_date = datetime.strptime(args["order-end"], "%Y-%m-%d").date()
-            query = query.filter(Order.order_date <= end_date)
-
-        if args["total-min"] is not None and args["total-max"] is not None:
-            try:
-                total_min = float(args["total-min"])
-                total_max = float(args["total-max"])
-                query = query.filter(Order.total_amount.between(total_min, total_max))
-            except ValueError:
-                abort(
-                    status.HTTP_400_BAD_REQUEST,
-                    "Please enter valid minimum and maximum values. They should be decimal values.",
-                )
-        if args["customer-id"] is not None:
-            try:
-                customer_id = [int(args["customer-id"])]
-            except (TypeError, ValueError):
-                try:
-                    customer_id = args["customer-id"].split(",")
-                    customer_id = [int(c_id) for c_id in customer_id]
-                except (TypeError, ValueError):
-                    abort(
-                        status.HTTP_400_BAD_REQUEST,
-                        f"{args['customer-id']} is not a valid customer_id. Please enter an integer.",
-                    )
-
-            query = query.filter(Order.customer_id.in_(customer_id))
-            query_results = query.all()
-
-            if not query_results:
-                abort(
-                    status.HTTP_404_NOT_FOUND,
-                    f"{args['customer-id']} is not a valid customer_id. Please enter an integer.",
-                )
+        # validate every argument before a single statement is compiled
+        order_query = OrderQuery(args)
+        mask = order_projection(args)
 
-        if args["sort_by"] == "total_amount":
-            query = query.order_by(Order.total_amount.desc())
-        else:  # sort on "order_date" by default:
-            query = query.order_by(Order.order_date.desc())
+        mediatype = request.accept_mimetypes.best_match(
+            ["application/json", "application/x-ndjson"], default="application/json"
+        )
+        if mediatype == "application/x-ndjson" or args["stream"]:
+            orders, headers = list_orders(args, order_query, mask, streaming=True)
+            return stream_orders(orders, mediatype, headers, mask)
 
-        orders = query.all()
-        return [order.serialize() for order in orders], status.HTTP_200_OK
+        # identical concurrent listings share one query and one encoding
+        body, headers = flights.do(
+            flight_key(shared_cache.generation()), lambda: list_orders(args, order_query, mask)
+        )
+        return json_response(body, status.HTTP_200_OK, headers)
 
     ######################################################################
     # CREATE A NEW ORDER
@@ -393,7 +622,8 @@ class OrderCollection(Resource):
     @api.doc("create_orders")
     @api.response(400, "The posted data was not valid")
     @api.expect(order_create_model)
-    @api.marshal_with(order_model, code=201)
+    @api.response(status.HTTP_201_CREATED, "Order created", order_model)
+    @unit_of_work()
     def post(self):
         """
         Creates an Order
@@ -410,10 +640,122 @@ class OrderCollection(Resource):
 
         # Create a message to return
         app.logger.info("order with new id [%s] created!", order.id)
-        message = order.serialize()
+        message = encode_json(order_plan.render(order))
         location_url = api.url_for(OrderResource, order_id=order.id, _external=True)
 
-        return message, status.HTTP_201_CREATED, {"Location": location_url}
+        return json_response(message, status.HTTP_201_CREATED, {"Location": location_url})
+
+
+######################################################################
+#  PATH: /orders:batch
+######################################################################
+@api.route("/orders:batch")
+class OrderBatchResource(Resource):
+    """Creates many Orders at once"""
+
+    @api.doc("create_order_batch")
+    @api.expect([order_create_model])
+    @api.response(400, "The batch was not a list or none of its Orders were valid")
+    @api.response(207, "Some of the Orders were created", batch_model)
+    @api.response(413, "The batch has too many Orders")
+    @api.response(status.HTTP_201_CREATED, "Every Order was created", batch_model)
+    def post(self):
+        """
+        Creates a batch of Orders
+
+        Takes a list of Orders, with their Items, as they would be posted one
+        at a time. Every Order is validated first, then the valid ones are
+        inserted with multi-row INSERTs, a chunk per transaction. The result
+        of every Order, its id or its error, is returned in the same order.
+        """
+        check_content_type("application/json")
+        payloads = api.payload
+        if not isinstance(payloads, list) or not payloads:
+            abort(status.HTTP_400_BAD_REQUEST, "A batch must be a non empty list of Orders.")
+        if len(payloads) > app.config["ORDER_BATCH_MAX_SIZE"]:
+            abort(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                f"A batch holds at most {app.config['ORDER_BATCH_MAX_SIZE']} Orders.",
+            )
+        app.logger.info("Request to create a batch of %d Orders", len(payloads))
+        return batch_response(create_orders(payloads, app.config["ORDER_BATCH_CHUNK_SIZE"]))
+
+
+######################################################################
+#  PATH: /orders:{action}
+######################################################################
+@api.route(f"/orders:<any({', '.join(TRANSITIONS)}):action>")
+@api.param("action", f"The transition: {', '.join(TRANSITIONS)}")
+class OrderTransitionResource(Resource):
+    """Moves many Orders to a new status at once"""
+
+    @api.doc("transition_orders")
+    @api.expect(transition_create_model)
+    @api.response(400, "Neither ids nor a valid filter were given")
+    @api.response(413, "Too many ids, or a filter that matches too many Orders")
+    @api.marshal_with(transition_model)
+    def post(self, action):
+        """
+        Moves many Orders to the status of an action
+
+        Takes a list of Order "ids", a "filter" with the same names and values
+        as the GET /orders query string, or both. The Orders that may make
+        the transition are moved with one UPDATE, and the others are reported
+        with the reason they were rejected.
+        """
+        check_content_type("application/json")
+        body = api.payload
+        if not isinstance(body, dict) or not (body.get("ids") or body.get("filter")):
+            abort(status.HTTP_400_BAD_REQUEST, "Give the ids of the Orders, a filter or both.")
+        ids = body.get("ids")
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(order_id, int) for order_id in ids):
+                abort(status.HTTP_400_BAD_REQUEST, "The ids must be a list of integers.")
+            if len(ids) > app.config["TRANSITION_MAX_IDS"]:
+                abort(
+                    status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    f"A transition takes at most {app.config['TRANSITION_MAX_IDS']} ids.",
+                )
+        criteria = transition_criteria(body.get("filter") or {})
+        if ids is None and not criteria:
+            abort(status.HTTP_400_BAD_REQUEST, "A filter must not match every Order.")
+        app.logger.info("Request to %s Orders", action)
+        result = bulk_transition(action, ids, criteria, app.config["TRANSITION_MAX_IDS"])
+        if result is None:
+            abort(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                f"The filter matches more than {app.config['TRANSITION_MAX_IDS']} Orders.",
+            )
+        return result, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /orders/stats
+######################################################################
+@api.route("/orders/stats")
+class OrderStatsResource(Resource):
+    """Aggregated statistics about the Orders"""
+
+    @api.doc("order_stats")
+    @api.expect(order_stats_args, validate=True)
+    @api.response(400, "The filters or groupings were not valid")
+    @api.response(status.HTTP_200_OK, "Success", order_stats_model)
+    def get(self):
+        """
+        Returns Order statistics
+
+        Counts the Orders that match the same filters as the Order list and
+        sums, minimums, maximums and averages their total amount and shipping
+        cost, overall and grouped by status, payment method, day, week or month
+        """
+        app.logger.info("Request for Order statistics")
+        args = order_stats_args.parse_args()
+        stats = OrderStats(
+            OrderQuery(args),
+            parse_groupings(args["group_by"]),
+            use_rollup=app.config["ORDER_STATS_FROM_ROLLUP"],
+        )
+        return stats.compute(), status.HTTP_200_OK
 
 
 ######################################################################
@@ -427,6 +769,7 @@ class CancelOrderResource(Resource):
     @api.doc("cancel_orders")
     @api.response(404, "Order not found")
     @api.response(409, "Order cannot be cancelled")
+    @api.response(status.HTTP_200_OK, "Success", order_model)
     def put(self, order_id):
         """
         Cancel an Order
@@ -434,26 +777,7 @@ class CancelOrderResource(Resource):
         This endpoint will cancel an Order
         """
         app.logger.info("Request to cancel order with id: %s", order_id)
-
-        # See if the order exists and abort if it doesn't
-        order = Order.find(order_id)
-        if not order:
-            abort(
-                status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found."
-            )
-
-        # Abort Cancellation if order has been delivered
-        if order.status in (OrderStatus.DELIVERED, OrderStatus.RETURNED):
-            abort(
-                status.HTTP_409_CONFLICT,
-                "Orders that have been delivered cannot be cancelled",
-            )
-
-        # Update from the json in the body of the request
-        order.status = OrderStatus.CANCELLED
-        order.update()
-
-        return order.serialize(), status.HTTP_200_OK
+        return transition_response(order_id, "cancel")
 
 
 ######################################################################
@@ -467,27 +791,11 @@ class DeliverOrderResource(Resource):
     @api.doc("deliver_orders")
     @api.response(404, "Order not found")
     @api.response(409, "Order cannot be delivered")
+    @api.response(status.HTTP_200_OK, "Success", order_model)
     def put(self, order_id):
         """deliver the Order that has been shipped"""
         app.logger.info("Request to deliver order with id: %s", order_id)
-        order = Order.find(order_id)
-        if not order:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Orders with id {order_id} not found. Please enter a valid order id.",
-            )
-
-        # abort if invalid order status
-        if order.status not in (OrderStatus.SHIPPING, OrderStatus.DELIVERED):
-            abort(
-                status.HTTP_409_CONFLICT,
-                f"Orders in {order.status} cannot be delivered.",
-            )
-
-        order.status = OrderStatus.DELIVERED
-        order.update()
-
-        return order.serialize(), status.HTTP_200_OK
+        return transition_response(order_id, "deliver")
 
 
 ######################################################################
@@ -501,27 +809,11 @@ class PackOrderResource(Resource):
     @api.doc("pack_orders")
     @api.response(404, "Order not found")
     @api.response(409, "Order cannot be packed")
+    @api.response(status.HTTP_200_OK, "Success", order_model)
     def put(self, order_id):
         """Pack the Order that has not being shipped yet"""
         app.logger.info("Request to pack order with id: %s", order_id)
-        order = Order.find(order_id)
-        if not order:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Orders with id {order_id} not found. Please enter a valid order id.",
-            )
-
-        # abort if invalid order status
-        if order.status not in (OrderStatus.STARTED, OrderStatus.PACKING):
-            abort(
-                status.HTTP_409_CONFLICT,
-                f"Orders that have been {order.status} cannot be set to PACKING ",
-            )
-
-        order.status = OrderStatus.PACKING
-        order.update()
-
-        return order.serialize(), status.HTTP_200_OK
+        return transition_response(order_id, "packing")
 
 
 ######################################################################
@@ -535,27 +827,11 @@ class ShipOrderResource(Resource):
     @api.doc("ship_orders")
     @api.response(404, "Order not found")
     @api.response(409, "Order cannot be shipped")
+    @api.response(status.HTTP_200_OK, "Success", order_model)
     def put(self, order_id):
         """Ship all the items of the Order that have not being shipped yet"""
         app.logger.info("Request to ship order with id: %s", order_id)
-        order = Order.find(order_id)
-        if not order:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Order with id '{order_id}' could not be found.",
-            )
-
-        # abort if invalid order status
-        if order.status not in [OrderStatus.CANCELLED, OrderStatus.DELIVERED]:
-            order.status = OrderStatus.SHIPPING
-            order.update()
-        else:
-            abort(
-                status.HTTP_409_CONFLICT,
-                f"Order with id '{order_id}' has been DELIVERED/CANCELLED",
-            )
-
-        return order.serialize(), status.HTTP_200_OK
+        return transition_response(order_id, "ship")
 
 
 ######################################################################
@@ -578,8 +854,10 @@ class ItemResource(Resource):
     # GET A SINGLE ITEM IN AN ORDER
     ######################################################################
     @api.doc("get_items")
+    @api.header("ETag", "The version of the Item")
+    @api.response(304, "The Item matches the If-None-Match header")
     @api.response(404, "Item not found")
-    @api.marshal_with(item_model)
+    @api.response(status.HTTP_200_OK, "Success", item_model)
     def get(self, order_id, item_id):
         """
         Get an Item
@@ -590,29 +868,54 @@ class ItemResource(Resource):
             "Request to retrieve Item %s for Order id: %s", (item_id, order_id)
         )
 
+        generation = shared_cache.generation(order_id)
+        key = ("item", order_id, item_id)
+        response = cached_response(key, generation)
+        if response is not None:
+            return response
+        # an Item may be created under any Order, so a miss holds the
+        # generation of all Orders rather than the one in the path
+        missing = shared_cache.generation()
+        check_missing(key, missing, f"Item with id '{item_id}' could not be found.")
+
+        if request.if_none_match:
+            version = Item.find_version(item_id)
+            if version is not None:
+                tag = make_etag("item", item_id, version)
+                if not_modified(tag):
+                    return "", status.HTTP_304_NOT_MODIFIED, etag_header(tag)
+
         # See if the item exists and abort if it doesn't
         item = Item.find(item_id)
         if not item:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Item with id '{item_id}' could not be found.",
-            )
+            abort_missing(key, missing, f"Item with id '{item_id}' could not be found.")
 
-        return item.serialize(), status.HTTP_200_OK
+        tag = make_etag("item", item.id, item.version)
+        body = encode_json(item_plan.render(item))
+        if item.order_id != order_id:
+            # only the changes of its own Order invalidate a cached Item
+            return json_response(body, status.HTTP_200_OK, etag_header(tag))
+        return cache_response(key, generation, body, tag)
 
     ######################################################################
     # UPDATE AN ITEM
     ######################################################################
     @api.doc("update_items")
+    @api.header("ETag", "The new version of the Item")
     @api.response(404, "Item not found")
     @api.response(400, "The posted Item data was not valid")
+    @api.response(409, "The Item was changed by another request while it was updated")
+    @api.response(412, "The Item is not in the version named by the If-Match header")
     @api.expect(item_model)
-    @api.marshal_with(item_model)
+    @api.response(status.HTTP_200_OK, "Success", item_model)
+    @unit_of_work()
     def put(self, order_id, item_id):
         """
         Update an Item
 
-        This endpoint will update an Item based the body that is posted
+        This endpoint will update an Item based the body that is posted.
+        With an If-Match header it is only updated if it is still in the
+        version of that ETag.
         """
         app.logger.info(
             "Request to update Item %s for Order id: %s", (item_id, order_id)
@@ -626,6 +929,7 @@ class ItemResource(Resource):
                 status.HTTP_404_NOT_FOUND,
                 f"Order with id '{item_id}' could not be found.",
             )
+        check_if_match(make_etag("item", item.id, item.version))
 
         # Update from the json in the body of the request
         app.logger.debug("Payload = %s", api.payload)
@@ -635,13 +939,15 @@ class ItemResource(Resource):
         item.order_id = order_id
         item.update()
 
-        return item.serialize(), status.HTTP_200_OK
+        tag = make_etag("item", item.id, item.version)
+        return json_response(encode_json(item_plan.render(item)), status.HTTP_200_OK, etag_header(tag))
 
     ######################################################################
     # DELETE AN AN ITEM FROM AN ORDER
     ######################################################################
     @api.doc("delete_items")
     @api.response(204, "Item deleted")
+    @unit_of_work()
     def delete(self, order_id, item_id):
         """
         Delete an Item
@@ -673,34 +979,44 @@ class ItemCollection(Resource):
     ######################################################################
     @api.doc("list_items")
     @api.expect(item_args, validate=True)
-    @api.marshal_list_with(item_model)
+    @api.response(status.HTTP_200_OK, "Success", [item_model])
     def get(self, order_id):
         """Returns all of the Items for an Order"""
         app.logger.info("Request for all Items for Order with id: %s", order_id)
+        args = item_args.parse_args()
 
-        order = Order.find(order_id)
-        if not order:
+        unfiltered = not (args["product_id"] or args["name"])
+        generation = shared_cache.generation(order_id)
+        key = ("items", order_id, args["product_id"], args["name"])
+        response = cached_response(key, generation)
+        if response is not None:
+            return response
+        if unfiltered:
+            body = shared_cache.get("items", order_id, generation)
+            if body is not None:
+                return cache_response(key, generation, body)
+
+        criteria = []
+        if args["product_id"]:
+            criteria = [Item.product_id == int(args["product_id"])]
+        elif args["name"]:
+            criteria = Item.name_criteria(args["name"])
+        items = find_order_items(order_id, criteria)
+        if items is None:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Order with id '{order_id}' could not be found.",
             )
+        if args["product_id"] and not items:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                "Please enter valid product id.",
+            )
 
-        items = order.items
-        args = item_args.parse_args()
-
-        if args["product_id"]:
-            product_id = int(args["product_id"])
-            items = Item.find_by_product_id(order_id, product_id)
-            if not items:
-                abort(
-                    status.HTTP_400_BAD_REQUEST,
-                    "Please enter valid product id.",
-                )
-        elif args["name"]:
-            items = Item.find_by_name(order_id, args["name"])
-
-        results = [item.serialize() for item in items]
-        return results, status.HTTP_200_OK
+        body = encode_json(item_plan.render_many(items))
+        if unfiltered:
+            shared_cache.set("items", order_id, body, generation)
+        return cache_response(key, generation, body)
 
     ######################################################################
     # ADD AN ITEM TO AN ORDER
@@ -708,7 +1024,8 @@ class ItemCollection(Resource):
     @api.doc("create_items")
     @api.response(400, "The posted data was not valid")
     @api.expect(item_create_model)
-    @api.marshal_with(item_model, code=201)
+    @api.response(status.HTTP_201_CREATED, "Item created", item_model)
+    @unit_of_work()
     def post(self, order_id):
         """
         Creates an item and adds item to an order
@@ -737,13 +1054,80 @@ class ItemCollection(Resource):
             ItemResource, order_id=order.id, item_id=item.id, _external=True
         )
         app.logger.info("Item with id %s created for order with %s", item.id, order.id)
-        return (
-            item.serialize(),
+        return json_response(
+            encode_json(item_plan.render(item)),
             status.HTTP_201_CREATED,
             {"Location": location_url},
         )
 
 
+######################################################################
+#  PATH: /orders/{order_id}/items:batch
+######################################################################
+@api.route("/orders/<int:order_id>/items:batch")
+@api.param("order_id", "The Order identifier")
+class ItemBatchResource(Resource):
+    """Adds many Items to an Order at once"""
+
+    @api.doc("create_item_batch")
+    @api.expect([item_create_model])
+    @api.response(400, "The batch was not a list or one of its Items was not valid")
+    @api.response(404, "Order not found")
+    @api.response(413, "The batch has too many Items")
+    @api.response(status.HTTP_201_CREATED, "Every Item was added", batch_model)
+    def post(self, order_id):
+        """
+        Adds a batch of Items to an Order
+
+        Takes a list of Items as they would be posted one at a time. Every
+        Item is validated first and either all of them are added, with one
+        INSERT, or none is. The total amount of the Order grows by the total
+        price of the Items.
+        """
+        check_content_type("application/json")
+        payloads = api.payload
+        if not isinstance(payloads, list) or not payloads:
+            abort(status.HTTP_400_BAD_REQUEST, "A batch must be a non empty list of Items.")
+        if len(payloads) > app.config["ITEM_BATCH_MAX_SIZE"]:
+            abort(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                f"A batch holds at most {app.config['ITEM_BATCH_MAX_SIZE']} Items.",
+            )
+        app.logger.info("Request to add %d Items to Order %s", len(payloads), order_id)
+        results = add_items(order_id, payloads)
+        if results is None:
+            abort(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found.")
+        return batch_response(results)
+
+
+######################################################################
+#  PATH: /items
+######################################################################
+@api.route("/items", strict_slashes=False)
+class ProductItemCollection(Resource):
+    """Finds the Items of a product across all of the Orders"""
+
+    @api.doc("list_product_items")
+    @api.expect(product_item_args, validate=True)
+    @api.response(status.HTTP_200_OK, "Success", [product_item_model])
+    def get(self):
+        """
+        Returns the Items of a product in every Order
+
+        Each Item embeds the summary of its Order. The Items are returned one
+        page at a time, in id order, with the next page in the Link header.
+        """
+        args = product_item_args.parse_args()
+        app.logger.info("Request for Items of product %s", args["product_id"])
+        page = keyset_paginate(
+            Order.find_items_by_product_id(args["product_id"]),
+            [(Item.id, False)],
+            args["limit"] or app.config["PAGE_SIZE_DEFAULT"],
+            args["cursor"],
+        )
+        return product_item_plan.render_many(page.items), status.HTTP_200_OK, page_headers(page)
+
+
 ######################################################################
 # HEALTH CHECK
 ######################################################################
@@ -753,11 +1137,303 @@ def health():
     return jsonify(status=200, message="Response 200 OK"), status.HTTP_200_OK
 
 
+######################################################################
+# METRICS
+######################################################################
+@app.route("/metrics")
+def service_metrics():
+    """Returns the counters of the caches and other components"""
+    return jsonify(metrics.snapshot()), status.HTTP_200_OK
+
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
 
 
+def order_projection(args):
+    """
+    Returns the fields mask asked for with ?fields=, X-Fields or ?view=summary
+
+    The mask uses the flask-restx syntax so nested item fields can be
+    selected too, e.g. id,status,items{name,quantity}. None is returned
+    when the full Order representation was asked for.
+    """
+    mask = args["fields"] or request.headers.get(app.config["RESTX_MASK_HEADER"])
+    if not mask and args["view"] == "summary":
+        mask = ",".join(SUMMARY_FIELDS)
+    if not mask:
+        return None
+    try:
+        mask = Mask(mask)
+    except ParseError as parse_error:
+        raise DataValidationError(
+            f"Invalid fields '{mask}': {parse_error}"
+        ) from parse_error
+    Order.check_fields(list(mask))
+    return mask
+
+
+def mask_fields(mask):
+    """Returns the top level Order fields selected by a mask"""
+    return list(mask) if mask else None
+
+
+def cached_order(order_id, generation):
+    """
+    Returns the version and the JSON document of an Order from the caches
+
+    The in-process cache is tried first and then the cache shared by the
+    workers. Entries of an older generation were written before another
+    worker committed a change to the Order and are ignored.
+
+    Returns:
+        tuple: the version and the document, or None on a miss
+    """
+    entry = order_cache.get(order_id)
+    if entry is not None and entry[0] == generation:
+        return entry[1:]
+    data = shared_cache.get("order", order_id, generation)
+    if data is None:
+        return None
+    version, _, body = data.partition(b"\n")
+    order_cache.set(order_id, (generation, int(version), body), size=len(body))
+    return int(version), body
+
+
+def load_order(order_id, mask, generation):
+    """
+    Reads an Order for OrderResource.get and caches it when possible
+
+    The full Order is read and encoded once when a cache is enabled
+    because any projection can be served from it, otherwise only the
+    selected fields are read.
+
+    Returns:
+        tuple: the version and the JSON document or the rendered Order
+    """
+    token = order_cache.token()
+    caching = order_cache.enabled or shared_cache.enabled
+    order = Order.find(order_id, None if caching else mask_fields(mask))
+    if not order:
+        abort_missing(("order", order_id), generation, f"Order with id '{order_id}' was not found.")
+    if not caching:
+        return order.version, marshal_orders(order, mask)
+    body = encode_json(order_plan.render(order))
+    shared_cache.set("order", order_id, b"%d\n%s" % (order.version, body), generation)
+    order_cache.set(order_id, (generation, order.version, body), token, len(body))
+    return order.version, body
+
+
+def list_orders(args, order_query, mask, streaming=False):
+    """
+    Reads the Orders of a listing, or a page of them
+
+    Returns:
+        tuple: an iterator over the Orders when streaming, otherwise the
+        encoded list, and the response headers of the page
+    """
+    reader = make_reader(order_query, mask_fields(mask))
+    headers = {}
+    if args["limit"] is None and args["cursor"] is None:
+        statement = reader.ordered()
+        if streaming:
+            orders = reader.stream(statement, app.config["STREAM_BATCH_SIZE"])
+        else:
+            orders = reader.all(statement)
+    else:
+        limit = args["limit"] or app.config["PAGE_SIZE_DEFAULT"]
+        page = keyset_paginate(reader.filtered(), order_query.sort_keys, limit, args["cursor"])
+        orders = reader.load(page.items)
+        headers = page_headers(page)
+
+    # an unknown customer is reported from the one query that was run
+    if args["customer-id"] and not args["cursor"]:
+        orders = iter(orders)
+        first = next(orders, None)
+        if first is None:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"{args['customer-id']} is not a valid customer_id. Please enter an integer.",
+            )
+        orders = itertools.chain([first], orders)
+
+    if streaming:
+        return orders, headers
+    return encode_json(marshal_orders(list(orders), mask)), headers
+
+
+def flight_key(*extra):
+    """
+    Returns the single flight key of a GET request
+
+    The key is the route with its query arguments in a normal order and
+    the fields mask header, so equivalent requests share one read. The
+    extra parts are generations of the shared cache: a request that comes
+    in after a write committed does not join a read that started before.
+    """
+    return (
+        request.path,
+        tuple(sorted(request.args.items(multi=True))),
+        request.headers.get(app.config["RESTX_MASK_HEADER"]),
+        *extra,
+    )
+
+
+def check_missing(key, generation, message):
+    """Answers 404 Not Found for a record known not to exist"""
+    if missing_cache.get(key) == generation:
+        abort(status.HTTP_404_NOT_FOUND, message)
+
+
+def abort_missing(key, generation, message):
+    """
+    Remembers that a record was not found and answers 404 Not Found
+
+    The entry holds a generation that was read before the lookup and that
+    creating the record bumps, so the entry is stale at once in every worker.
+    """
+    missing_cache.set(key, generation, size=MISSING_ENTRY_SIZE)
+    abort(status.HTTP_404_NOT_FOUND, message)
+
+
+def cached_response(key, generation):
+    """
+    Answers a GET request from the response cache
+
+    Returns:
+        the 200 or 304 response, or None when the cache has no current
+        entry for the key
+    """
+    entry = response_cache.get(key)
+    if entry is None or entry[0] != generation:
+        return None
+    _, tag, body = entry
+    if tag and not_modified(tag):
+        return "", status.HTTP_304_NOT_MODIFIED, etag_header(tag)
+    return json_response(body, status.HTTP_200_OK, etag_header(tag) if tag else None)
+
+
+def cache_response(key, generation, body: bytes, tag: str = None):
+    """Stores the encoded body of a GET response and returns the response"""
+    response_cache.set(key, (generation, tag, body), size=len(body))
+    return json_response(body, status.HTTP_200_OK, etag_header(tag) if tag else None)
+
+
+def check_if_match(tag: str) -> None:
+    """Answers 412 Precondition Failed when If-Match names another version"""
+    if not version_matches(tag):
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            "The record was changed since it was read. Read it again and retry with its new ETag.",
+        )
+
+
+def transition_response(order_id: int, action: str):
+    """
+    Moves an Order through a transition and returns it
+
+    The status is checked by the UPDATE itself, so a request that loses a
+    race against another transition of the Order gets 409 Conflict.
+    """
+    order, current = transition(order_id, action)
+    if current is None:
+        abort(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found.")
+    if order is None:
+        abort(status.HTTP_409_CONFLICT, refusal(action, current))
+    tag = make_etag("order", order.id, order.version)
+    return json_response(encode_json(order_plan.render(order)), status.HTTP_200_OK, etag_header(tag))
+
+
+def transition_criteria(filters) -> list:
+    """Returns the criteria of the filters of a bulk transition"""
+    if not isinstance(filters, dict):
+        abort(status.HTTP_400_BAD_REQUEST, "The filter must be an object of GET /orders filters.")
+    names = {flt.arg for flt in FILTERS}
+    unknown = set(filters) - names
+    if unknown:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"Cannot filter on {', '.join(sorted(unknown))}. Use {', '.join(sorted(names))}.",
+        )
+    args = {
+        name: [str(value) for value in values] if isinstance(values, list) else str(values)
+        for name, values in filters.items()
+    }
+    return OrderQuery(args).criteria
+
+
+def batch_response(results: list):
+    """Returns the response of a batch from the results of its records"""
+    results = [dict(result, index=index) for index, result in enumerate(results)]
+    created = sum("id" in result for result in results)
+    failed = len(results) - created
+    if not failed:
+        code = status.HTTP_201_CREATED
+    elif created:
+        code = status.HTTP_207_MULTI_STATUS
+    else:
+        code = status.HTTP_400_BAD_REQUEST
+    body = {"created": created, "failed": failed, "results": results}
+    return api.marshal(body, batch_model), code
+
+
+def encode_json(data) -> bytes:
+    """Encodes a rendered document once so it can be cached as bytes"""
+    return dumps(data)
+
+
+def json_response(body: bytes, code: int, headers: dict = None):
+    """Returns a pre-encoded JSON document as it is"""
+    return Response(body, code, headers, mimetype="application/json")
+
+
+def marshal_orders(orders, mask=None):
+    """Renders one or more Orders, limited to a fields mask"""
+    selected = mask_fields(mask)
+    if mask and not all(value is True for value in mask.values()):
+        # masks of nested fields, e.g. items{name}, go through flask-restx
+        if isinstance(orders, list):
+            data = order_plan.render_many(orders, selected)
+        else:
+            data = order_plan.render(orders, selected)
+        return api.marshal(data, order_model, mask=mask)
+    if isinstance(orders, list):
+        return order_plan.render_many(orders, selected)
+    return order_plan.render(orders, selected)
+
+
+def stream_orders(orders, mediatype, headers, mask=None):
+    """
+    Streams Orders to the client as they are read from the database
+
+    Queries should be read with yield_per (a server side cursor) so
+    memory stays flat however many Orders match. Orders are written as
+    NDJSON (one per line) for application/x-ndjson and as a chunked JSON
+    array otherwise.
+    """
+    ndjson = mediatype == "application/x-ndjson"
+
+    def generate():
+        separator = b"" if ndjson else b"["
+        for order in orders:
+            body = dumps(marshal_orders(order, mask))
+            if ndjson:
+                yield body + b"\n"
+            else:
+                yield separator + body
+                separator = b","
+        if not ndjson:
+            yield b"[]" if separator == b"[" else b"]"
+
+    return Response(
+        stream_with_context(generate()),
+        status=status.HTTP_200_OK,
+        headers=headers,
+        mimetype=mediatype,
+    )
+
+
 def check_content_type(content_type):
     """Checks that the media type is correct"""
     if "Content-Type" not in request.headers:
@@ -0,0 +1,125 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Static Assets
+"""
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service import config
+from service.common import status
+from service.common.assets import asset_store, build_assets, hashed_name, main, IMMUTABLE
+
+
+######################################################################
+#  S T A T I C   A S S E T   T E S T   C A S E S
+######################################################################
+class TestAssets(TestCase):
+    """Static Asset Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Builds the assets once for all tests"""
+        cls.directory = tempfile.mkdtemp(prefix="orders-assets-")
+        cls.manifest = build_assets(config.STATIC_DIR, cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Removes the built assets"""
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        """This runs before each test"""
+        self.client = app.test_client()
+        asset_store.configure(self.directory)
+
+    def tearDown(self):
+        """This runs after each test"""
+        asset_store.configure(app.config["ASSET_DIR"])
+
+    def test_build(self):
+        """It should write hashed and precompressed copies of the static files"""
+        entry = self.manifest["js/rest_api.js"]
+        self.assertRegex(entry["path"], r"^js/rest_api\.[0-9a-f]{10}\.js$")
+        self.assertIn("gzip", entry["encodings"])
+        with open(os.path.join(config.STATIC_DIR, "js", "rest_api.js"), "rb") as file:
+            source = file.read()
+        self.assertEqual(entry["path"], hashed_name("js/rest_api.js", source))
+        with open(os.path.join(self.directory, entry["path"] + ".gz"), "rb") as file:
+            self.assertEqual(gzip.decompress(file.read()), source)
+        # images are already compressed
+        self.assertEqual(self.manifest["images/newapp-icon.png"]["encodings"], [])
+
+    def test_index_points_at_assets(self):
+        """It should serve the home page with the hashed asset URLs"""
+        resp = self.client.get("/")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Cache-Control"], "no-cache")
+        page = resp.get_data(as_text=True)
+        self.assertIn(f'src="assets/{self.manifest["js/rest_api.js"]["path"]}"', page)
+        self.assertNotIn('"static/', page)
+
+    def test_send_asset(self):
+        """It should serve the precompressed copy with long lived caching"""
+        path = self.manifest["js/rest_api.js"]["path"]
+        resp = self.client.get(f"/assets/{path}", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.headers["Cache-Control"], IMMUTABLE)
+        self.assertEqual(resp.mimetype, "text/javascript")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        compressed = gzip.decompress(resp.data)
+        resp.close()
+
+        resp = self.client.get(f"/assets/{path}")
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.data, compressed)
+        resp.close()
+
+        image = self.manifest["images/newapp-icon.png"]["path"]
+        resp = self.client.get(f"/assets/{image}", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertNotIn("Vary", resp.headers)
+        resp.close()
+
+    def test_unknown_asset(self):
+        """It should not serve files that are not hashed assets"""
+        for path in ("js/rest_api.js", "manifest.json", "../config.py"):
+            resp = self.client.get(f"/assets/{path}")
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unbuilt(self):
+        """It should serve the static home page when no assets were built"""
+        asset_store.configure("")
+        self.assertFalse(asset_store.built)
+        resp = self.client.get("/")
+        self.assertIn('"static/js/rest_api.js"', resp.get_data(as_text=True))
+        resp.close()
+
+    def test_main(self):
+        """It should build the assets from the command line"""
+        target = os.path.join(self.directory, "cli")
+        with patch("builtins.print") as print_mock:
+            main([config.STATIC_DIR, target])
+        self.assertTrue(os.path.exists(os.path.join(target, "manifest.json")))
+        print_mock.assert_called_once()
+        self.assertRaises(FileNotFoundError, build_assets, os.path.join(self.directory, "none"), target)
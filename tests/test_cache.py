@@ -0,0 +1,118 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Read-through Cache
+"""
+
+from unittest import TestCase
+from service.common.cache import LRUCache, changed_orders
+from service.models import Order, Item
+from service.models.commit_hooks import Change, INSERT, UPDATE, DELETE
+
+
+class FakeClock:
+    """A clock that only moves when told to"""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(TestCase):
+    """LRUCache Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.clock = FakeClock()
+        self.cache = LRUCache(max_bytes=100, ttl=10, clock=self.clock)
+
+    def test_get_and_set(self):
+        """It should return what was stored and count hits and misses"""
+        self.assertIsNone(self.cache.get(1))
+        self.assertTrue(self.cache.set(1, {"id": 1}))
+        self.assertEqual(self.cache.get(1), {"id": 1})
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+        self.assertEqual(stats["bytes"], LRUCache.size_of({"id": 1}))
+
+    def test_evicts_least_recently_used(self):
+        """It should evict the least recently used entries over the budget"""
+        for key in range(3):
+            self.cache.set(key, "x", size=40)
+        self.assertIsNone(self.cache.get(0))
+        self.cache.get(1)
+        self.cache.set(3, "x", size=40)
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), "x")
+        self.assertEqual(self.cache.stats()["evictions"], 2)
+        # values bigger than the whole budget are not stored
+        self.assertFalse(self.cache.set(4, "x", size=101))
+        # storing a key again replaces its size
+        self.cache.set(1, "y", size=10)
+        self.assertEqual(self.cache.stats()["bytes"], 50)
+
+    def test_expires(self):
+        """It should treat entries older than the TTL as missing"""
+        self.cache.set(1, "x")
+        self.clock.now = 9.9
+        self.assertEqual(self.cache.get(1), "x")
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_token(self):
+        """It should not store a value read before an invalidation"""
+        token = self.cache.token()
+        self.cache.delete(1)
+        self.assertFalse(self.cache.set(1, "stale", token))
+        self.assertTrue(self.cache.set(1, "fresh", self.cache.token()))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.stats()["invalidations"], 2)
+
+    def test_disabled(self):
+        """It should not store anything without a memory budget"""
+        self.cache.configure(0, 10)
+        self.assertFalse(self.cache.enabled)
+        self.assertFalse(self.cache.set(1, "x"))
+        self.assertIsNone(self.cache.get(1))
+
+
+######################################################################
+#  I N V A L I D A T I O N   T E S T   C A S E S
+######################################################################
+class TestInvalidation(TestCase):
+    """Order cache invalidation Tests"""
+
+    def test_changed_orders(self):
+        """It should find the Orders touched by Order and Item changes"""
+        changes = [
+            Change(UPDATE, Order, 1, {"id": 1}),
+            Change(INSERT, Item, 10, {"id": 10, "order_id": 2}),
+            Change(DELETE, Item, 11, {"id": 11}),
+            Change(UPDATE, Item, 12, {"id": 12, "order_id": 2}, {"order_id": 3}),
+        ]
+        self.assertEqual(changed_orders(changes), {1, 2, 3})
+        self.assertIsNone(changed_orders([Change(DELETE, Order, None, {})]))
+        self.assertIsNone(changed_orders([Change(UPDATE, Item, None, {})]))
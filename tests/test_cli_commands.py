@@ -24,7 +24,13 @@ from click.testing import CliRunner
 
 # pylint: disable=unused-import
 from wsgi import app  # noqa: F401
-from service.common.cli_commands import db_create  # noqa: E402
+from service.common.cli_commands import (  # noqa: E402
+    db_create,
+    db_upgrade,
+    db_downgrade,
+    rollup_rebuild,
+)
+from service.models.migrations import MIGRATIONS  # noqa: E402
 
 
 class TestFlaskCLI(TestCase):
@@ -34,9 +40,45 @@ class TestFlaskCLI(TestCase):
         self.runner = CliRunner()
 
     @patch("service.common.cli_commands.db")
-    def test_db_create(self, db_mock):
+    @patch("service.common.cli_commands.shared_cache")
+    def test_db_create(self, cache_mock, db_mock):
         """It should call the db-create command"""
         db_mock.return_value = MagicMock()
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+            cache_mock.purge.assert_called_once_with()
+
+    @patch("service.common.cli_commands.migrations")
+    def test_db_upgrade(self, migrations_mock):
+        """It should call the db-upgrade command"""
+        migrations_mock.upgrade.return_value = list(MIGRATIONS)
+        migrations_mock.current_version.return_value = MIGRATIONS[-1].version
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(db_upgrade, ["--target", "1"])
+            self.assertEqual(result.exit_code, 0)
+            migrations_mock.upgrade.assert_called_once_with(1)
+            self.assertIn("Applied 1", result.output)
+
+    @patch("service.common.cli_commands.migrations")
+    def test_db_downgrade(self, migrations_mock):
+        """It should call the db-downgrade command"""
+        migrations_mock.downgrade.return_value = list(MIGRATIONS)
+        migrations_mock.current_version.return_value = 0
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(db_downgrade)
+            self.assertEqual(result.exit_code, 0)
+            migrations_mock.downgrade.assert_called_once_with(None)
+            self.assertIn("Schema is at version 0", result.output)
+
+    @patch("service.common.cli_commands.db")
+    @patch("service.common.cli_commands.order_rollup")
+    def test_rollup_rebuild(self, rollup_mock, db_mock):
+        """It should call the rollup-rebuild command"""
+        rollup_mock.rebuild.return_value = 7
+        db_mock.return_value = MagicMock()
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(rollup_rebuild)
+            self.assertEqual(result.exit_code, 0)
+            rollup_mock.rebuild.assert_called_once()
+            self.assertIn("Rebuilt 7 rollup buckets", result.output)
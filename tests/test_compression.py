@@ -0,0 +1,102 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for Response Compression
+"""
+
+import gzip
+from unittest import TestCase
+from flask import Response
+from wsgi import app
+from service.common.compression import (
+    ResponseCompressor,
+    compress_chunks,
+    negotiate,
+)
+
+BODY = b'{"name":"widget","quantity":1},' * 100
+
+
+######################################################################
+#  C O M P R E S S I O N   T E S T   C A S E S
+######################################################################
+class TestCompression(TestCase):
+    """Response Compression Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.compressor = ResponseCompressor(min_size=64, level=6)
+
+    def _compress(self, response, accept="gzip"):
+        """Runs the compressor on a response of a request"""
+        with app.test_request_context(headers={"Accept-Encoding": accept}):
+            return self.compressor.compress(response)
+
+    def test_negotiate(self):
+        """It should pick the best accepted coding"""
+        cases = {
+            "gzip, deflate": "gzip",
+            "gzip;q=0": None,
+            "identity": None,
+            "*": "gzip",
+            "": None,
+        }
+        for header, expected in cases.items():
+            with app.test_request_context(headers={"Accept-Encoding": header}):
+                self.assertEqual(negotiate(["gzip"]), expected, header)
+        with app.test_request_context(headers={"Accept-Encoding": "gzip;q=0.5, br"}):
+            self.assertEqual(negotiate(["br", "gzip"]), "br")
+
+    def test_compress_body(self):
+        """It should gzip a large JSON body and weaken its ETag"""
+        response = Response(BODY, mimetype="application/json")
+        response.set_etag("order-1-v1")
+        response = self._compress(response)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(response.get_data()), BODY)
+        self.assertEqual(response.headers["Content-Length"], str(len(response.get_data())))
+        self.assertEqual(response.get_etag(), ("order-1-v1", True))
+        stats = self.compressor.stats()
+        self.assertEqual((stats["compressed"], stats["bytes_in"]), (1, len(BODY)))
+        self.assertLess(stats["bytes_out"], stats["bytes_in"])
+
+    def test_compress_stream(self):
+        """It should gzip a streamed body chunk by chunk"""
+        chunks = [b'{"id":%d}\n' % number for number in range(1000)]
+        response = self._compress(Response(iter(chunks), mimetype="application/x-ndjson"))
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.response)), b"".join(chunks))
+        self.assertEqual(self.compressor.stats()["streamed"], 1)
+        self.assertEqual(gzip.decompress(b"".join(compress_chunks([], "gzip"))), b"")
+
+    def test_not_compressed(self):
+        """It should send small, binary, failed and encoded responses as they are"""
+        responses = [
+            Response(b"{}", mimetype="application/json"),
+            Response(BODY, mimetype="image/png"),
+            Response(BODY, status=404, mimetype="application/json"),
+            Response(BODY, mimetype="application/json", headers={"Content-Encoding": "br"}),
+        ]
+        for response in responses:
+            self.assertEqual(self._compress(response).get_data(), response.get_data())
+        response = self._compress(Response(BODY, mimetype="application/json"), accept="identity")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.compressor.configure(False, 0, 1)
+        response = self._compress(Response(BODY, mimetype="text/html"))
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(self.compressor.stats()["compressed"], 0)
@@ -147,6 +147,20 @@ class TestItem(TestCase):
         for item in Item.all():
             self.assertEqual(item.order.id, order.id)
 
+    def test_move_item_bumps_both_orders(self):
+        """It should bump the versions of both Orders when an Item moves"""
+        source, target = OrderFactory(), OrderFactory()
+        ItemFactory(order=source)
+        source.create()
+        target.create()
+        versions = (source.version, target.version)
+
+        item = Item.find(source.items[0].id)
+        item.order_id = target.id
+        item.update()
+        self.assertEqual(Order.find(source.id).version, versions[0] + 1)
+        self.assertEqual(Order.find(target.id).version, versions[1] + 1)
+
     def test_update_order_item(self):
         """It should Update an orders item"""
         orders = Order.all()
@@ -214,3 +228,49 @@ class TestItem(TestCase):
 
         found = Item.find_by_name(items[0].order_id, "XYZ")
         self.assertEqual(found, [])
+
+    def test_find_by_name_with_ngram_index(self):
+        """It should find Items by Name through the in-process index"""
+        Item.configure_search("ngram")
+        try:
+            self.assertTrue(Item.uses_name_index())
+            order = OrderFactory()
+            order.create()
+            ruler = ItemFactory(order=order, name="Ruler")
+            ruler.create()
+            pencil = ItemFactory(order=order, name="pencil")
+            pencil.create()
+
+            found = Item.find_by_name(order.id, "ULE")
+            self.assertEqual([item.id for item in found], [ruler.id])
+            self.assertTrue(Item.name_index.loaded)
+
+            # committed changes keep the index up to date
+            pencil.name = "ruled pencil"
+            pencil.update()
+            extra = ItemFactory(order=order, name="rule book")
+            extra.create()
+            found = Item.find_by_name(order.id, "rule")
+            self.assertEqual(
+                sorted(item.id for item in found), sorted([ruler.id, pencil.id, extra.id])
+            )
+            ruler.delete()
+            self.assertNotIn(ruler.id, Item.search_names("rule"))
+
+            # a bulk delete empties the index until the next search
+            db.session.query(Item).delete()
+            db.session.commit()
+            self.assertFalse(Item.name_index.loaded)
+            self.assertEqual(Item.find_by_name(order.id, "rule"), [])
+        finally:
+            Item.configure_search("auto")
+
+    def test_configure_search(self):
+        """It should only accept known search backends"""
+        self.assertRaises(DataValidationError, Item.configure_search, "fulltext")
+        Item.configure_search("trigram")
+        self.assertFalse(Item.uses_name_index())
+        Item.configure_search("auto")
+        self.assertEqual(
+            Item.uses_name_index(), db.engine.dialect.name != "postgresql"
+        )
@@ -23,8 +23,10 @@ import os
 from unittest import TestCase
 from unittest.mock import patch
 from datetime import date, datetime, timedelta
+from sqlalchemy.exc import OperationalError
 from service.models.order import OrderStatus
-from service.models import Order, Item, DataValidationError, db
+from service.models import Order, Item, DataValidationError, StaleVersionError, db, unit_of_work
+from service.models.commit_hooks import after_commit, _callbacks
 
 from wsgi import app
 from tests.factories import OrderFactory, ItemFactory
@@ -280,6 +282,29 @@ class TestOrder(TestCase):
         order = Order.find(order.id)
         self.assertEqual(order.customer_id, 55)
 
+    def test_update_stale_order(self):
+        """It should not update or delete an Order that was changed since it was read"""
+        order = OrderFactory()
+        order.create()
+        order = Order.find(order.id)
+        self.assertEqual(order.version, 1)
+        # another request updates the Order in the meantime
+        with db.engine.begin() as connection:
+            connection.execute(
+                db.update(Order).where(Order.id == order.id).values(version=Order.version + 1)
+            )
+        order.customer_id = 77
+        self.assertRaises(StaleVersionError, order.update)
+        self.assertNotEqual(Order.find(order.id).customer_id, 77)
+
+        order = Order.find(order.id)
+        with db.engine.begin() as connection:
+            connection.execute(
+                db.update(Order).where(Order.id == order.id).values(version=Order.version + 1)
+            )
+        self.assertRaises(StaleVersionError, order.delete)
+        self.assertIsNotNone(Order.find(order.id))
+
     @patch("service.models.db.session.commit")
     def test_update_order_failed(self, exception_mock):
         """It should not update an Order on database error"""
@@ -287,6 +312,25 @@ class TestOrder(TestCase):
         order = OrderFactory()
         self.assertRaises(DataValidationError, order.update)
 
+    def test_configure_loading(self):
+        """It should only accept known item loading strategies"""
+        self.assertRaises(
+            DataValidationError, Order.configure_loading, "eager", "joined"
+        )
+        Order.configure_loading("subquery", "selectin")
+        try:
+            self.assertEqual(Order.collection_loading, "subquery")
+            self.assertEqual(Order.single_loading, "selectin")
+            order = OrderFactory()
+            order.items.append(ItemFactory())
+            order.create()
+            order_id = order.id
+            db.session.expunge_all()
+            self.assertEqual(len(Order.all()[0].items), 1)
+            self.assertEqual(len(Order.find(order_id).items), 1)
+        finally:
+            Order.configure_loading("selectin", "joined")
+
     def test_find_by_date_range(self):
         """Test finding orders by date range."""
         logging.info(
@@ -314,6 +358,89 @@ class TestOrder(TestCase):
             )
 
 
+######################################################################
+#  U N I T   O F   W O R K   T E S T   C A S E S
+######################################################################
+class TestUnitOfWork(TestCaseBase):
+    """Unit of Work Tests"""
+
+    def _count(self):
+        """Returns the number of Orders another connection sees"""
+        with db.engine.connect() as connection:
+            return connection.execute(db.select(db.func.count()).select_from(Order)).scalar()
+
+    def test_one_commit(self):
+        """It should commit the writes of a unit of work once, at its end"""
+        commits = []
+        after_commit(commits.append)
+        try:
+            with unit_of_work():
+                orders = [OrderFactory() for _ in range(3)]
+                for order in orders:
+                    order.create()
+                    self.assertIsNotNone(order.id)
+                orders[0].customer_id = 99
+                orders[0].update()
+                orders[1].delete()
+                self.assertEqual(self._count(), 0)
+        finally:
+            _callbacks.remove(commits.append)
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(self._count(), 2)
+        self.assertEqual(Order.find(orders[0].id).customer_id, 99)
+
+    def test_rollback(self):
+        """It should roll back a unit of work that raises"""
+        with self.assertRaises(KeyError):
+            with unit_of_work():
+                OrderFactory().create()
+                raise KeyError("failed")
+        self.assertEqual(self._count(), 0)
+
+        order = OrderFactory()
+        order.create()
+        with self.assertRaises(DataValidationError):
+            with unit_of_work():
+                OrderFactory().create()
+                ItemFactory(order=None, order_id=0).create()  # no such Order
+        self.assertEqual(self._count(), 1)
+
+    def test_nested(self):
+        """It should only commit when the outermost unit of work ends"""
+
+        @unit_of_work()
+        def create_two():
+            OrderFactory().create()
+            OrderFactory().create()
+
+        with unit_of_work():
+            create_two()
+            self.assertEqual(self._count(), 0)
+            create_two()
+        self.assertEqual(self._count(), 4)
+        create_two()
+        self.assertEqual(self._count(), 6)
+
+    def test_failed_commit(self):
+        """It should roll back and report a commit that failed"""
+        order = OrderFactory()
+        order.create()
+        error = OperationalError("COMMIT", {}, Exception("connection lost"))
+        with patch.object(db.session, "commit", side_effect=error):
+            with self.assertRaises(DataValidationError):
+                with unit_of_work():
+                    OrderFactory().create()
+        self.assertEqual(self._count(), 1)
+
+        order = Order.find(order.id)
+        with db.engine.begin() as connection:
+            connection.execute(db.update(Order).where(Order.id == order.id).values(version=Order.version + 1))
+        with self.assertRaises(StaleVersionError):
+            with unit_of_work():
+                order.customer_id = 12
+        self.assertNotEqual(Order.find(order.id).customer_id, 12)
+
+
 ######################################################################
 #  T E S T   E X C E P T I O N   H A N D L E R S
 ######################################################################
@@ -0,0 +1,99 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Fast JSON Representation
+"""
+
+import json
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+from flask_restx import Model, fields
+from wsgi import app
+from service import api
+from service.common import representation
+from service.common.representation import FieldPlan, dumps, loads, output_json
+from service.routes import order_model, item_model, order_plan, item_plan
+from tests.factories import OrderFactory, ItemFactory
+
+
+######################################################################
+#  R E P R E S E N T A T I O N   T E S T   C A S E S
+######################################################################
+class TestRepresentation(TestCase):
+    """Fast JSON Representation Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.app_context().push()
+
+    def _order_with_items(self):
+        """Returns a transient Order with two Items"""
+        order = OrderFactory()
+        for _ in range(2):
+            order.items.append(ItemFactory(order=None, order_id=order.id))
+        return order
+
+    def test_render_matches_marshal(self):
+        """It should render the same document as serialize() and marshal()"""
+        order = self._order_with_items()
+        self.assertEqual(order_plan.render(order), api.marshal(order.serialize(), order_model))
+        item = order.items[0]
+        self.assertEqual(item_plan.render(item), api.marshal(item.serialize(), item_model))
+        self.assertEqual(order_plan.render(order)["status"], order.status.name)
+
+    def test_render_selected_fields(self):
+        """It should only read and render the selected fields"""
+        order = self._order_with_items()
+        document = order_plan.render(order, ["id", "order_date"])
+        self.assertEqual(document, {"id": order.id, "order_date": order.order_date.isoformat()})
+        self.assertEqual(len(order_plan.render_many([order, order], ["id"])), 2)
+
+    def test_render_nulls(self):
+        """It should render missing values as null"""
+        order = OrderFactory(order_notes=None, expected_date=None)
+        document = order_plan.render(order)
+        self.assertIsNone(document["order_notes"])
+        self.assertIsNone(document["expected_date"])
+        self.assertEqual(document["items"], [])
+
+    def test_dumps(self):
+        """It should encode decimals and dates"""
+        data = {"amount": Decimal("1.50"), "day": date(2024, 3, 1)}
+        expected = {"amount": 1.5, "day": "2024-03-01"}
+        self.assertEqual(loads(dumps(data)), expected)
+        self.assertRaises(TypeError, dumps, {"value": object()})
+        with patch.object(representation, "orjson", None):
+            self.assertEqual(json.loads(dumps(data)), expected)
+            self.assertEqual(loads(b'{"id":1}'), {"id": 1})
+
+    def test_output_json(self):
+        """It should make a JSON response with the headers of the resource"""
+        with app.test_request_context():
+            response = output_json({"id": 1}, 201, {"Location": "/api/orders/1"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual(response.headers["Location"], "/api/orders/1")
+        self.assertEqual(response.get_json(), {"id": 1})
+
+    def test_unknown_field_types(self):
+        """It should copy the values of fields without a converter"""
+        plan = FieldPlan(Model("Thing", {"payload": fields.Raw(attribute="values")}))
+        self.assertEqual(plan.render(SimpleNamespace(values={"a": [1]})), {"payload": {"a": [1]}})
@@ -3,14 +3,22 @@ TestYourResourceModel API Service Test Suite
 """
 
 import os
+import gzip
+import json
 import logging
 from unittest import TestCase
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from wsgi import app
 
-# from service.models.order import OrderStatus
+from service.models.order import OrderStatus
 from service.common import status
-from service.models import db, Order
+from service.common.query_counter import QueryCounter
+from service.common.cache import order_cache, response_cache
+from service.common.shared_cache import shared_cache
+from service.common.compression import compressor
+from service.models import db, Order, Item, StaleVersionError
 from tests.factories import OrderFactory, ItemFactory
 
 DATABASE_URI = os.getenv(
@@ -311,6 +319,27 @@ class TestOrderService(TestCase):
         updated_order = resp.get_json()
         self.assertEqual(updated_order["shipping_address"], "New Road New City")
 
+    def test_write_responses_match_reads(self):
+        """It should answer writes with the documents that reads return"""
+        order = self._create_orders(1)[0]
+        item = ItemFactory(order_id=order.id)
+        created = self.client.post(f"{BASE_URL}/{order.id}/items", json=item.serialize())
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+        item_url = f"{BASE_URL}/{order.id}/items/{created.get_json()['id']}"
+        self.assertEqual(created.get_json(), self.client.get(item_url).get_json())
+
+        updated = self.client.put(item_url, json=dict(created.get_json(), name="renamed"))
+        self.assertEqual(updated.status_code, status.HTTP_200_OK)
+        self.assertEqual(updated.get_json(), self.client.get(item_url).get_json())
+        self.assertEqual(updated.headers["ETag"], self.client.get(item_url).headers["ETag"])
+
+        order_url = f"{BASE_URL}/{order.id}"
+        data = self.client.get(order_url).get_json()
+        updated = self.client.put(order_url, json=dict(data, shipping_address="New Road"))
+        self.assertEqual(updated.status_code, status.HTTP_200_OK)
+        self.assertEqual(updated.get_json(), self.client.get(order_url).get_json())
+        self.assertEqual(updated.headers["ETag"], self.client.get(order_url).headers["ETag"])
+
     def test_update_nonexistent_order(self):
         """It should not Update an Order that doesn't exist"""
         # Create an Order to update
@@ -830,6 +859,407 @@ class TestOrderService(TestCase):
         for order in data:
             self.assertEqual(order["status"], test_status.name)
 
+    def test_query_orders_single_statement(self):
+        """It should look Orders up by customer with a single statement"""
+        self._store_orders_with_items(3, customer_id=42)
+        with QueryCounter() as counter:
+            resp = self.client.get(f"{BASE_URL}?customer-id=42")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 3)
+        self.assertEqual(len(counter.matching('FROM "order"')), 1)
+
+        with QueryCounter() as counter:
+            resp = self.client.get(f"{BASE_URL}?customer-id=987654&view=summary")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(counter.count, 1)
+
+    def test_query_orders_sort_and_status_lists(self):
+        """It should sort Orders on several keys and filter on several statuses"""
+        for amount in (30.0, 10.0, 20.0):
+            OrderFactory(total_amount=amount, status=OrderStatus.STARTED).create()
+        OrderFactory(total_amount=15.0, status=OrderStatus.PACKING).create()
+        OrderFactory(total_amount=25.0, status=OrderStatus.SHIPPING).create()
+
+        resp = self.client.get(
+            f"{BASE_URL}?status=STARTED,PACKING&sort_by=total_amount:asc,order_date"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        amounts = [order["total_amount"] for order in resp.get_json()]
+        self.assertEqual(amounts, [10.0, 15.0, 20.0, 30.0])
+
+        resp = self.client.get(f"{BASE_URL}?status=SHIPPING&status=PACKING")
+        self.assertEqual(len(resp.get_json()), 2)
+
+        resp = self.client.get(f"{BASE_URL}?sort_by=customer_id")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}?status=LOST")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}?order-start=not-a-date")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    #  P A G I N A T I O N   T E S T   C A S E S
+    ######################################################################
+
+    def test_paginate_orders(self):
+        """It should page through Orders forwards and backwards with cursors"""
+        for order in OrderFactory.create_batch(7, order_date=date(2024, 1, 1)):
+            order.create()
+        expected = [
+            order["id"] for order in self.client.get(BASE_URL).get_json()
+        ]
+        self.assertEqual(len(expected), 7)
+
+        # walk forwards
+        seen = []
+        pages = []
+        url = f"{BASE_URL}?limit=3"
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            pages.append(resp)
+            seen.extend(order["id"] for order in resp.get_json())
+            cursor = resp.headers.get("X-Next-Cursor")
+            url = f"{BASE_URL}?limit=3&cursor={cursor}" if cursor else None
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertNotIn("X-Prev-Cursor", pages[0].headers)
+        self.assertIn('rel="next"', pages[0].headers["Link"])
+
+        # and back again from the last page
+        cursor = pages[-1].headers["X-Prev-Cursor"]
+        resp = self.client.get(f"{BASE_URL}?limit=3&cursor={cursor}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([order["id"] for order in resp.get_json()], expected[3:6])
+        cursor = resp.headers["X-Prev-Cursor"]
+        resp = self.client.get(f"{BASE_URL}?limit=3&cursor={cursor}")
+        self.assertEqual([order["id"] for order in resp.get_json()], expected[0:3])
+        self.assertNotIn("X-Prev-Cursor", resp.headers)
+        self.assertIn("X-Next-Cursor", resp.headers)
+
+    def test_paginate_orders_with_filters(self):
+        """It should page through filtered Orders sorted by total amount"""
+        for i in range(6):
+            OrderFactory(
+                customer_id=7, total_amount=10.0 * (i % 3), status=OrderStatus.STARTED
+            ).create()
+        OrderFactory(customer_id=8, total_amount=5.0).create()
+
+        query = "customer-id=7&status=STARTED&total-min=0&total-max=100&sort_by=total_amount"
+        expected = self.client.get(f"{BASE_URL}?{query}").get_json()
+        seen = []
+        cursor = ""
+        while True:
+            resp = self.client.get(f"{BASE_URL}?{query}&limit=4&cursor={cursor}")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend(resp.get_json())
+            cursor = resp.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 6)
+        amounts = [order["total_amount"] for order in seen]
+        self.assertEqual(amounts, sorted(amounts, reverse=True))
+
+    def test_paginate_orders_null_sort_keys(self):
+        """It should page through Orders whose sort keys are NULL"""
+        for amount in (None, 10.0, None, 20.0, None, 10.0, None):
+            resp = self.client.post(BASE_URL, json=dict(OrderFactory().serialize(), total_amount=amount))
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        for sort_by in ("total_amount", "total_amount:asc"):
+            expected = self.client.get(BASE_URL, query_string={"sort_by": sort_by}).get_json()
+            pages = []
+            cursor = ""
+            while cursor is not None:
+                resp = self.client.get(BASE_URL, query_string={"sort_by": sort_by, "limit": 2, "cursor": cursor})
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                pages.append(resp)
+                cursor = resp.headers.get("X-Next-Cursor")
+            self.assertEqual([order for page in pages for order in page.get_json()], expected)
+            self.assertEqual(len(pages), 4)
+            # NULLs sort as larger than every amount
+            amounts = [order["total_amount"] for order in expected]
+            self.assertEqual(amounts[-4:] if sort_by.endswith("asc") else amounts[:4], [None] * 4)
+
+            # and back from the last page
+            cursor = pages[-1].headers["X-Prev-Cursor"]
+            resp = self.client.get(BASE_URL, query_string={"sort_by": sort_by, "limit": 2, "cursor": cursor})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json(), expected[4:6])
+
+    def test_paginate_orders_bad_cursor(self):
+        """It should not accept a malformed cursor or an out of range limit"""
+        OrderFactory().create()
+        resp = self.client.get(f"{BASE_URL}?limit=1&cursor=not-a-cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}?limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # a cursor only makes sense for the sort order it was issued for
+        OrderFactory().create()
+        cursor = self.client.get(f"{BASE_URL}?limit=1").headers["X-Next-Cursor"]
+        resp = self.client.get(
+            f"{BASE_URL}?limit=1&sort_by=total_amount&cursor={cursor}"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    #  S P A R S E   F I E L D S E T   T E S T   C A S E S
+    ######################################################################
+
+    def test_list_orders_summary_view(self):
+        """It should list only the summary fields of Orders"""
+        order_ids = self._store_orders_with_items(3)
+        with QueryCounter() as counter:
+            resp = self.client.get(f"{BASE_URL}?view=summary")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertCountEqual([order["id"] for order in data], order_ids)
+        for order in data:
+            self.assertEqual(
+                set(order),
+                {"id", "customer_id", "order_date", "status", "total_amount"},
+            )
+        # the items are skipped and the long text columns are not read
+        self.assertEqual(counter.count, 1)
+        self.assertNotIn("order_notes", counter.statements[0])
+        self.assertNotIn("shipping_address", counter.statements[0])
+
+    def test_get_order_with_fields(self):
+        """It should return only the requested fields of an Order"""
+        order_id = self._store_orders_with_items(1, items_per_order=2)[0]
+        resp = self.client.get(f"{BASE_URL}/{order_id}?fields=id,status")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(resp.get_json()), {"id", "status"})
+
+        # nested item fields can be selected too
+        resp = self.client.get(f"{BASE_URL}/{order_id}?fields=id,items{{name,quantity}}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data["items"]), 2)
+        for item in data["items"]:
+            self.assertEqual(set(item), {"name", "quantity"})
+
+        # the flask-restx X-Fields header works the same way
+        resp = self.client.get(
+            f"{BASE_URL}/{order_id}", headers={"X-Fields": "total_amount"}
+        )
+        self.assertEqual(resp.get_json(), {"total_amount": resp.get_json()["total_amount"]})
+
+        resp = self.client.get(f"{BASE_URL}/{order_id}?view=summary")
+        self.assertNotIn("items", resp.get_json())
+
+    def test_list_orders_with_fields(self):
+        """It should list and stream only the requested fields of Orders"""
+        self._create_orders(4)
+        resp = self.client.get(f"{BASE_URL}?fields=id,total_amount&sort_by=total_amount&limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 2)
+        self.assertEqual(set(data[0]), {"id", "total_amount"})
+        cursor = resp.headers["X-Next-Cursor"]
+        resp = self.client.get(
+            f"{BASE_URL}?fields=id,total_amount&sort_by=total_amount&limit=2&cursor={cursor}"
+        )
+        self.assertEqual(len(resp.get_json()), 2)
+
+        resp = self.client.get(
+            f"{BASE_URL}?fields=id,status", headers={"Accept": "application/x-ndjson"}
+        )
+        for line in resp.get_data(as_text=True).splitlines():
+            self.assertEqual(set(json.loads(line)), {"id", "status"})
+
+        resp = self.client.get(f"{BASE_URL}?fields=id,items{{name}}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        for order in resp.get_json():
+            self.assertEqual(set(order), {"id", "items"})
+            for item in order["items"]:
+                self.assertEqual(set(item), {"name"})
+
+    def test_orders_with_bad_fields(self):
+        """It should not accept unknown or malformed fields"""
+        order_id = self._create_orders(1)[0].id
+        resp = self.client.get(f"{BASE_URL}/{order_id}?fields=id,password")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}?fields=id,items{{name")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}?view=tiny")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    #  S T R E A M I N G   T E S T   C A S E S
+    ######################################################################
+
+    def test_stream_orders_as_ndjson(self):
+        """It should stream Orders as newline delimited JSON"""
+        self._create_orders(5)
+        expected = self.client.get(BASE_URL).get_json()
+        resp = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        self.assertTrue(resp.is_streamed)
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_stream_orders_as_json_array(self):
+        """It should stream filtered Orders as a chunked JSON array"""
+        orders = self._create_orders(6)
+        test_status = orders[0].status
+        query = f"status={test_status.name}&sort_by=total_amount"
+        expected = self.client.get(f"{BASE_URL}?{query}").get_json()
+        resp = self.client.get(f"{BASE_URL}?{query}&stream=true")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/json")
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.get_json(), expected)
+
+        # a page can be streamed too and keeps its cursor headers
+        resp = self.client.get(f"{BASE_URL}?{query}&stream=true&limit=1")
+        self.assertEqual(resp.get_json(), expected[:1])
+        if len(expected) > 1:
+            self.assertIn("X-Next-Cursor", resp.headers)
+
+        # an empty result is still valid JSON
+        resp = self.client.get(f"{BASE_URL}?stream=true&order-start=2999-01-01")
+        self.assertEqual(resp.get_json(), [])
+
+    ######################################################################
+    #  Q U E R Y   C O S T   T E S T   C A S E S
+    ######################################################################
+
+    def _store_orders_with_items(self, count, items_per_order=2, **kwargs):
+        """Stores Orders with Items directly for query cost tests"""
+        orders = []
+        for _ in range(count):
+            order = OrderFactory(id=None, **kwargs)
+            for _ in range(items_per_order):
+                order.items.append(ItemFactory(id=None, order=None))
+            orders.append(order)
+        db.session.add_all(orders)
+        db.session.commit()
+        order_ids = [order.id for order in orders]
+        # start with an empty identity map like a fresh request would
+        db.session.expunge_all()
+        return order_ids
+
+    def test_list_orders_query_count(self):
+        """It should list Orders with their Items in a constant number of queries"""
+        self._store_orders_with_items(20)
+        with QueryCounter() as small:
+            resp = self.client.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 20)
+
+        self._store_orders_with_items(480)
+        with QueryCounter() as large:
+            resp = self.client.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 500)
+        self.assertTrue(all(len(order["items"]) == 2 for order in data))
+
+        # one query for the orders and one batched query for all their items
+        self.assertEqual(small.count, 2)
+        self.assertEqual(large.count, small.count)
+
+    def test_get_order_query_count(self):
+        """It should read an Order with its Items in a single query"""
+        order_id = self._store_orders_with_items(1, items_per_order=3)[0]
+        with QueryCounter() as counter:
+            resp = self.client.get(f"{BASE_URL}/{order_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()["items"]), 3)
+        self.assertEqual(counter.count, 1)
+
+    ######################################################################
+    #  S T A T I S T I C S   T E S T   C A S E S
+    ######################################################################
+
+    def _store_stats_orders(self):
+        """Stores Orders with known amounts for the statistics tests"""
+        rows = [
+            (date(2024, 3, 4), OrderStatus.PACKING, "CREDIT", 100.0, 10.0),
+            (date(2024, 3, 4), OrderStatus.SHIPPING, "CREDIT", 50.0, 5.0),
+            (date(2024, 3, 6), OrderStatus.PACKING, "DEBIT", 30.0, 0.0),
+            (date(2024, 4, 1), OrderStatus.DELIVERED, "DEBIT", 20.0, 2.5),
+        ]
+        for order_date, order_status, payment_method, total, shipping in rows:
+            OrderFactory(
+                order_date=order_date,
+                status=order_status,
+                payment_method=payment_method,
+                total_amount=total,
+                shipping_cost=shipping,
+            ).create()
+
+    def test_order_stats(self):
+        """It should aggregate the Orders by status, payment method and day"""
+        self._store_stats_orders()
+        resp = self.client.get(f"{BASE_URL}/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["total"]["count"], 4)
+        self.assertEqual(
+            data["total"]["total_amount"],
+            {"sum": 200.0, "min": 20.0, "max": 100.0, "avg": 50.0},
+        )
+        self.assertEqual(data["total"]["shipping_cost"]["sum"], 17.5)
+
+        by_status = {group["key"]: group for group in data["by_status"]}
+        self.assertEqual(by_status["PACKING"]["count"], 2)
+        self.assertEqual(by_status["PACKING"]["total_amount"]["avg"], 65.0)
+        self.assertNotIn("CANCELLED", by_status)
+        by_payment = {group["key"]: group["count"] for group in data["by_payment_method"]}
+        self.assertEqual(by_payment, {"CREDIT": 2, "DEBIT": 2})
+        self.assertEqual(
+            [(group["key"], group["count"]) for group in data["by_day"]],
+            [("2024-03-04", 2), ("2024-03-06", 1), ("2024-04-01", 1)],
+        )
+        self.assertNotIn("by_month", data)
+
+    def test_order_stats_by_period_with_filters(self):
+        """It should apply the Order list filters before grouping by week and month"""
+        self._store_stats_orders()
+        resp = self.client.get(
+            f"{BASE_URL}/stats",
+            query_string={"group_by": "week,month", "status": "packing,shipping"},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["total"]["count"], 3)
+        self.assertEqual(
+            [(group["key"], group["count"]) for group in data["by_week"]],
+            [("2024-03-04", 3)],
+        )
+        self.assertEqual(data["by_month"][0]["key"], "2024-03-01")
+        self.assertEqual(data["by_month"][0]["total_amount"]["sum"], 180.0)
+        self.assertNotIn("by_status", data)
+
+        resp = self.client.get(
+            f"{BASE_URL}/stats", query_string={"total-min": "1000", "group_by": "status"}
+        )
+        data = resp.get_json()
+        self.assertEqual(data["total"]["count"], 0)
+        self.assertIsNone(data["total"]["total_amount"]["sum"])
+        self.assertEqual(data["by_status"], [])
+
+    def test_order_stats_single_statement_per_grouping(self):
+        """It should compute each grouping with one GROUP BY statement"""
+        self._store_stats_orders()
+        with QueryCounter() as counter:
+            resp = self.client.get(f"{BASE_URL}/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(counter.count, 4)
+        self.assertEqual(len(counter.matching("GROUP BY")), 3)
+
+    def test_order_stats_bad_arguments(self):
+        """It should not compute statistics for bad groupings or filters"""
+        resp = self.client.get(f"{BASE_URL}/stats", query_string={"group_by": "year"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}/stats", query_string={"order-start": "x"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     ######################################################################
     #  I T E M   T E S T   C A S E S
     ######################################################################
@@ -1132,3 +1562,630 @@ class TestOrderService(TestCase):
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         data = resp.get_json()
         self.assertEqual(data, [])
+
+    ######################################################################
+    #  P R O D U C T   L O O K U P   T E S T   C A S E S
+    ######################################################################
+
+    def _store_product_orders(self):
+        """Stores three Orders, two of them with Items of product 42"""
+        orders = []
+        for product_ids in ([42, 7], [7], [42]):
+            order = OrderFactory(id=None, status=OrderStatus.PACKING)
+            for product_id in product_ids:
+                order.items.append(ItemFactory(id=None, order=None, product_id=product_id))
+            orders.append(order)
+        db.session.add_all(orders)
+        db.session.commit()
+        order_ids = [order.id for order in orders]
+        db.session.expunge_all()
+        return order_ids
+
+    def test_list_items_by_product(self):
+        """It should list the Items of a product in every Order with one join"""
+        order_ids = self._store_product_orders()
+        with QueryCounter() as counter:
+            resp = self.client.get("/api/items", query_string={"product_id": 42})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([item["product_id"] for item in data], [42, 42])
+        self.assertEqual([item["order"]["id"] for item in data], [order_ids[0], order_ids[2]])
+        self.assertEqual(data[0]["order"]["status"], "PACKING")
+        self.assertEqual(set(data[0]["order"]), {"id", "customer_id", "order_date", "status", "total_amount"})
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(len(counter.matching("JOIN")), 1)
+
+    def test_list_items_by_product_pages(self):
+        """It should page through the Items of a product"""
+        self._store_product_orders()
+        resp = self.client.get("/api/items", query_string={"product_id": 42, "limit": 1})
+        self.assertEqual(len(resp.get_json()), 1)
+        first = resp.get_json()[0]["id"]
+        resp = self.client.get(
+            "/api/items",
+            query_string={"product_id": 42, "limit": 1, "cursor": resp.headers["X-Next-Cursor"]},
+        )
+        self.assertEqual(len(resp.get_json()), 1)
+        self.assertGreater(resp.get_json()[0]["id"], first)
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+
+    def test_list_items_by_product_bad_request(self):
+        """It should require an integer product_id"""
+        resp = self.client.get("/api/items")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get("/api/items", query_string={"product_id": "x"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_orders_by_product(self):
+        """It should list the Orders that contain a product"""
+        order_ids = self._store_product_orders()
+        resp = self.client.get(BASE_URL, query_string={"product_id": "42", "sort_by": "id:asc"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([order["id"] for order in resp.get_json()], [order_ids[0], order_ids[2]])
+        resp = self.client.get(BASE_URL, query_string={"product_id": "7,42", "view": "summary"})
+        self.assertEqual(len(resp.get_json()), 3)
+        resp = self.client.get(BASE_URL, query_string={"product_id": "abc"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    #  C O N D I T I O N A L   G E T   T E S T   C A S E S
+    ######################################################################
+
+    def test_get_order_not_modified(self):
+        """It should answer a matching If-None-Match from the version alone"""
+        order_id = self._store_orders_with_items(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{order_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+        self.assertTrue(etag.startswith('"order-'))
+
+        db.session.expunge_all()
+        order_cache.clear()
+        shared_cache.clear()
+        with QueryCounter() as counter:
+            resp = self.client.get(f"{BASE_URL}/{order_id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers["ETag"], etag)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(counter.matching("FROM item"), [])
+
+        # another projection of the same version has another tag
+        resp = self.client.get(
+            f"{BASE_URL}/{order_id}", query_string={"view": "summary"}, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_order_etag_changes(self):
+        """It should change the ETag of an Order when it or its Items change"""
+        order = self._create_orders(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{order.id}").headers["ETag"]
+
+        item = ItemFactory(order_id=order.id)
+        resp = self.client.post(f"{BASE_URL}/{order.id}/items", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.get(f"{BASE_URL}/{order.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()["items"]), 1)
+        etag = resp.headers["ETag"]
+
+        data = resp.get_json()
+        data["order_notes"] = "Leave at the door"
+        data["items"] = []
+        resp = self.client.put(f"{BASE_URL}/{order.id}", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(f"{BASE_URL}/{order.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_move_item_between_orders(self):
+        """It should serve both Orders fresh when an Item moves between them"""
+        orders = self._create_orders(2)
+        source, target = orders[0], orders[1]
+        resp = self.client.post(f"{BASE_URL}/{source.id}/items", json=ItemFactory(order_id=source.id).serialize())
+        item = resp.get_json()
+        etags = {}
+        for order in (source, target):
+            resp = self.client.get(f"{BASE_URL}/{order.id}")
+            etags[order.id] = resp.headers["ETag"]
+            self.client.get(f"{BASE_URL}/{order.id}", query_string={"view": "summary"})
+        self.client.get(f"{BASE_URL}/{source.id}/items/{item['id']}")
+
+        resp = self.client.put(f"{BASE_URL}/{target.id}/items/{item['id']}", json=item)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        for order, count in ((source, 0), (target, 1)):
+            resp = self.client.get(f"{BASE_URL}/{order.id}", headers={"If-None-Match": etags[order.id]})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(resp.get_json()["items"]), count)
+            self.assertNotEqual(resp.headers["ETag"], etags[order.id])
+        resp = self.client.get(f"{BASE_URL}/{source.id}/items/{item['id']}")
+        self.assertEqual(resp.get_json()["order_id"], target.id)
+
+    def test_get_item_not_modified(self):
+        """It should answer a conditional GET of an Item"""
+        order = self._create_orders(1)[0]
+        item = ItemFactory(order_id=order.id)
+        resp = self.client.post(f"{BASE_URL}/{order.id}/items", json=item.serialize())
+        item_id = resp.get_json()["id"]
+        url = f"{BASE_URL}/{order.id}/items/{item_id}"
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["id"], item_id)
+        etag = resp.headers["ETag"]
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        data = self.client.get(url).get_json()
+        data["quantity"] += 1
+        resp = self.client.put(url, json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_conditional_get_not_found(self):
+        """It should not answer 304 for an Order or Item that does not exist"""
+        resp = self.client.get(f"{BASE_URL}/0", headers={"If-None-Match": '"order-0-v1"'})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.get(f"{BASE_URL}/0/items/0", headers={"If-None-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    ######################################################################
+    #  O R D E R   C A C H E   T E S T   C A S E S
+    ######################################################################
+
+    def test_get_order_from_cache(self):
+        """It should serve repeated reads of an Order from the cache"""
+        order_id = self._store_orders_with_items(1)[0]
+        order_cache.clear()
+        first = self.client.get(f"{BASE_URL}/{order_id}")
+        with QueryCounter() as counter:
+            second = self.client.get(f"{BASE_URL}/{order_id}")
+            summary = self.client.get(f"{BASE_URL}/{order_id}", query_string={"view": "summary"})
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+        self.assertEqual(set(summary.get_json()), {"id", "customer_id", "order_date", "status", "total_amount"})
+
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        stats = resp.get_json()["response_cache"]
+        self.assertGreaterEqual(stats["hits"], 1)
+        self.assertGreaterEqual(stats["entries"], 2)
+        self.assertGreaterEqual(resp.get_json()["order_cache"]["hits"], 1)
+
+    def test_order_cache_invalidation(self):
+        """It should not serve an Order from the cache after it changed"""
+        order = self._create_orders(1)[0]
+        item = ItemFactory(order_id=order.id, quantity=1)
+        item_id = self.client.post(f"{BASE_URL}/{order.id}/items", json=item.serialize()).get_json()["id"]
+        self.assertEqual(self.client.get(f"{BASE_URL}/{order.id}").get_json()["items"][0]["quantity"], 1)
+
+        data = self.client.get(f"{BASE_URL}/{order.id}/items/{item_id}").get_json()
+        data["quantity"] = 5
+        self.client.put(f"{BASE_URL}/{order.id}/items/{item_id}", json=data)
+        self.assertEqual(self.client.get(f"{BASE_URL}/{order.id}").get_json()["items"][0]["quantity"], 5)
+
+        self.client.delete(f"{BASE_URL}/{order.id}")
+        resp = self.client.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_order_from_shared_cache(self):
+        """It should serve an Order encoded by another worker without a query"""
+        order_id = self._store_orders_with_items(1)[0]
+        first = self.client.get(f"{BASE_URL}/{order_id}")
+        # a fresh worker only has the shared documents
+        order_cache.clear()
+        response_cache.clear()
+        with QueryCounter() as counter:
+            second = self.client.get(f"{BASE_URL}/{order_id}")
+            items = self.client.get(f"{BASE_URL}/{order_id}/items")
+            items_again = self.client.get(f"{BASE_URL}/{order_id}/items")
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+        self.assertEqual(second.content_type, "application/json")
+        self.assertEqual([item["name"] for item in items.get_json()], [item["name"] for item in first.get_json()["items"]])
+        self.assertEqual(items_again.data, items.data)
+        stats = self.client.get("/metrics").get_json()["shared_cache"]
+        self.assertGreaterEqual(stats["hits"], 1)
+
+    def test_shared_cache_invalidation(self):
+        """It should not serve the documents of an Order after it changed"""
+        order = self._create_orders(1)[0]
+        self.assertEqual(self.client.get(f"{BASE_URL}/{order.id}/items").get_json(), [])
+        self.client.get(f"{BASE_URL}/{order.id}")
+
+        item = ItemFactory(order_id=order.id)
+        resp = self.client.post(f"{BASE_URL}/{order.id}/items", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.client.get(f"{BASE_URL}/{order.id}/items").get_json()), 1)
+        self.assertEqual(len(self.client.get(f"{BASE_URL}/{order.id}").get_json()["items"]), 1)
+
+        # another worker committed a change: the local entry is stale too
+        shared_cache.invalidate(order.id)
+        with QueryCounter() as counter:
+            self.client.get(f"{BASE_URL}/{order.id}")
+        self.assertGreaterEqual(counter.count, 1)
+
+    def test_response_cache(self):
+        """It should answer repeated GETs of Items from the encoded responses"""
+        order = self._create_orders(1)[0]
+        item = ItemFactory(order_id=order.id, name="hammer")
+        item_id = self.client.post(f"{BASE_URL}/{order.id}/items", json=item.serialize()).get_json()["id"]
+        url = f"{BASE_URL}/{order.id}/items/{item_id}"
+        first = self.client.get(url)
+        names = self.client.get(f"{BASE_URL}/{order.id}/items", query_string={"name": "ham"})
+        with QueryCounter() as counter:
+            second = self.client.get(url)
+            not_modified = self.client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+            names_again = self.client.get(f"{BASE_URL}/{order.id}/items", query_string={"name": "ham"})
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(names_again.data, names.data)
+
+        # another Item of the Order invalidates every response of the Order
+        other = ItemFactory(order_id=order.id, name="hammer drill")
+        self.client.post(f"{BASE_URL}/{order.id}/items", json=other.serialize())
+        self.assertEqual(len(self.client.get(f"{BASE_URL}/{order.id}/items", query_string={"name": "ham"}).get_json()), 2)
+
+    def test_item_of_another_order_not_cached(self):
+        """It should not cache an Item read through another Order"""
+        orders = self._create_orders(2)
+        item = ItemFactory(order_id=orders[0].id)
+        item_id = self.client.post(f"{BASE_URL}/{orders[0].id}/items", json=item.serialize()).get_json()["id"]
+        url = f"{BASE_URL}/{orders[1].id}/items/{item_id}"
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        with QueryCounter() as counter:
+            self.client.get(url)
+        self.assertGreaterEqual(counter.count, 1)
+
+    ######################################################################
+    #  S I N G L E   F L I G H T   T E S T   C A S E S
+    ######################################################################
+
+    def test_concurrent_identical_listings(self):
+        """It should answer identical concurrent listings with the same body"""
+        self._store_orders_with_items(5, status=OrderStatus.SHIPPING)
+        before = self.client.get("/metrics").get_json()["singleflight"]
+
+        def list_shipping(_):
+            return app.test_client().get(BASE_URL, query_string={"status": "SHIPPING"})
+
+        with ThreadPoolExecutor(4) as pool:
+            responses = list(pool.map(list_shipping, range(8)))
+        self.assertEqual({resp.status_code for resp in responses}, {status.HTTP_200_OK})
+        self.assertEqual(len({resp.data for resp in responses}), 1)
+        self.assertEqual(len(responses[0].get_json()), 5)
+        after = self.client.get("/metrics").get_json()["singleflight"]
+        reads = after["leaders"] + after["coalesced"] - before["leaders"] - before["coalesced"]
+        self.assertEqual(reads, 8)
+        self.assertEqual(after["in_flight"], 0)
+
+    ######################################################################
+    #  N E G A T I V E   C A C H E   T E S T   C A S E S
+    ######################################################################
+
+    def test_missing_order_cached(self):
+        """It should answer repeated lookups of a missing Order without a query"""
+        order = OrderFactory()
+        resp = self.client.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        with QueryCounter() as counter:
+            resp = self.client.get(f"{BASE_URL}/{order.id}")
+            summary = self.client.get(f"{BASE_URL}/{order.id}", query_string={"view": "summary"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(summary.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(counter.count, 0)
+        self.assertIn("was not found", resp.get_json()["message"])
+
+        # creating the Order makes it visible at once
+        db.session.add(order)
+        db.session.commit()
+        resp = self.client.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_missing_item_cached(self):
+        """It should answer repeated lookups of a missing Item without a query"""
+        order = self._create_orders(1)[0]
+        data = ItemFactory(order_id=order.id).serialize()
+        item = Item().deserialize(data)
+        item.id = data["id"]
+        url = f"{BASE_URL}/{order.id}/items/{item.id}"
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        with QueryCounter() as counter:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(counter.count, 0)
+        stats = self.client.get("/metrics").get_json()["missing_cache"]
+        self.assertGreaterEqual(stats["hits"], 1)
+
+        db.session.add(item)
+        db.session.commit()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_missing_item_created_in_other_order(self):
+        """It should find a missing Item once it is created in another Order"""
+        orders = self._create_orders(2)
+        data = ItemFactory(order_id=orders[1].id).serialize()
+        item = Item().deserialize(data)
+        item.id = data["id"]
+        url = f"{BASE_URL}/{orders[0].id}/items/{item.id}"
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        db.session.add(item)
+        db.session.commit()
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["order_id"], orders[1].id)
+
+    ######################################################################
+    #  C O M P R E S S I O N   T E S T   C A S E S
+    ######################################################################
+
+    def test_compressed_listing(self):
+        """It should gzip listings for clients that accept it"""
+        self._create_orders(5)
+        plain = self.client.get(BASE_URL)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertLess(len(resp.data), len(plain.data))
+        self.assertEqual(json.loads(gzip.decompress(resp.data)), plain.get_json())
+
+        # small documents are not worth it
+        resp = self.client.get(f"{BASE_URL}?fields=id&limit=1", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_compressed_stream(self):
+        """It should gzip streamed listings as they are written"""
+        self._create_orders(3)
+        headers = {"Accept": "application/x-ndjson", "Accept-Encoding": "gzip"}
+        resp = self.client.get(BASE_URL, headers=headers)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.headers)
+        lines = gzip.decompress(resp.data).decode("utf-8").splitlines()
+        self.assertEqual(len(lines), 3)
+
+    def test_compressed_order_keeps_etag(self):
+        """It should weaken the ETag of a compressed Order and still match it"""
+        order = self._create_orders(1)[0]
+        headers = {"Accept-Encoding": "gzip"}
+        with patch.object(compressor, "min_size", 0):
+            resp = self.client.get(f"{BASE_URL}/{order.id}", headers=headers)
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            etag = resp.headers["ETag"]
+            self.assertTrue(etag.startswith("W/"))
+            resp = self.client.get(f"{BASE_URL}/{order.id}", headers={**headers, "If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    ######################################################################
+    #  B A T C H   T E S T   C A S E S
+    ######################################################################
+
+    def test_create_order_batch(self):
+        """It should create a batch of Orders and report every one of them"""
+        orders = [OrderFactory() for _ in range(3)]
+        for order in orders:
+            order.items.append(ItemFactory(order=None, order_id=order.id))
+        resp = self.client.post(f"{BASE_URL}:batch", json=[order.serialize() for order in orders])
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual((data["created"], data["failed"]), (3, 0))
+        self.assertEqual([result["index"] for result in data["results"]], [0, 1, 2])
+        for order, result in zip(orders, data["results"]):
+            self.assertNotIn("error", result)
+            resp = self.client.get(f"{BASE_URL}/{result['id']}")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json()["shipping_address"], order.shipping_address)
+            self.assertEqual(len(resp.get_json()["items"]), 1)
+
+    def test_create_order_batch_with_errors(self):
+        """It should create the valid Orders of a batch and report the others"""
+        valid = OrderFactory().serialize()
+        resp = self.client.post(f"{BASE_URL}:batch", json=[valid, {"customer_id": 1}])
+        self.assertEqual(resp.status_code, 207)
+        data = resp.get_json()
+        self.assertEqual((data["created"], data["failed"]), (1, 1))
+        self.assertIn("id", data["results"][0])
+        self.assertEqual(data["results"][1]["index"], 1)
+        self.assertIn("missing", data["results"][1]["error"])
+
+        resp = self.client.post(f"{BASE_URL}:batch", json=[{"customer_id": 1}])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.get_json()["failed"], 1)
+
+    def test_bad_order_batch(self):
+        """It should not accept batches that are not lists or are too large"""
+        for body in ({"customer_id": 1}, []):
+            resp = self.client.post(f"{BASE_URL}:batch", json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        with patch.dict(app.config, {"ORDER_BATCH_MAX_SIZE": 1}):
+            resp = self.client.post(f"{BASE_URL}:batch", json=[{}, {}])
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        resp = self.client.post(f"{BASE_URL}:batch", data="[]", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_create_item_batch(self):
+        """It should add a batch of Items to an Order and its total"""
+        order = self._create_orders(1)[0]
+        items = [ItemFactory(order=None).serialize() for _ in range(3)]
+        resp = self.client.post(f"{BASE_URL}/{order.id}/items:batch", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual((data["created"], data["failed"]), (3, 0))
+
+        resp = self.client.get(f"{BASE_URL}/{order.id}/items")
+        self.assertEqual(sorted(item["id"] for item in resp.get_json()), [result["id"] for result in data["results"]])
+        body = self.client.get(f"{BASE_URL}/{order.id}").get_json()
+        expected = float(order.total_amount or 0) + sum(float(item["total_price"]) for item in items)
+        self.assertAlmostEqual(body["total_amount"], expected, places=2)
+
+    def test_bad_item_batch(self):
+        """It should not add a batch of Items with errors, too many or for no Order"""
+        order = self._create_orders(1)[0]
+        url = f"{BASE_URL}/{order.id}/items:batch"
+        resp = self.client.post(url, json=[ItemFactory(order=None).serialize(), {"name": "widget"}])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.get_json()["created"], 0)
+        self.assertEqual(self.client.get(url.replace(":batch", "")).get_json(), [])
+        for body in ({"name": "widget"}, []):
+            resp = self.client.post(url, json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        with patch.dict(app.config, {"ITEM_BATCH_MAX_SIZE": 1}):
+            resp = self.client.post(url, json=[{}, {}])
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        resp = self.client.post(f"{BASE_URL}/0/items:batch", json=[ItemFactory(order=None).serialize()])
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    ######################################################################
+    #  B U L K   T R A N S I T I O N   T E S T   C A S E S
+    ######################################################################
+
+    def test_bulk_ship(self):
+        """It should ship a list of Orders and report the rejected ones"""
+        ids = []
+        for order_status in (OrderStatus.STARTED, OrderStatus.PACKING, OrderStatus.DELIVERED):
+            resp = self.client.post(BASE_URL, json=OrderFactory(status=order_status).serialize())
+            ids.append(resp.get_json()["id"])
+        resp = self.client.post(f"{BASE_URL}:ship", json={"ids": ids})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["transitioned"], ids[:2])
+        self.assertEqual([rejection["id"] for rejection in data["rejected"]], ids[2:])
+        resp = self.client.get(f"{BASE_URL}/{ids[0]}")
+        self.assertEqual(resp.get_json()["status"], "SHIPPING")
+
+    def test_bulk_transition_by_filter(self):
+        """It should cancel the Orders that match a filter"""
+        ids = []
+        for customer_id, order_status in (
+            (7001, OrderStatus.STARTED), (7001, OrderStatus.DELIVERED), (7002, OrderStatus.STARTED)
+        ):
+            order = OrderFactory(customer_id=customer_id, status=order_status)
+            ids.append(self.client.post(BASE_URL, json=order.serialize()).get_json()["id"])
+        resp = self.client.post(
+            f"{BASE_URL}:cancel", json={"filter": {"customer-id": 7001, "status": ["STARTED", "PACKING", "SHIPPING"]}}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        expected = ids[:1]
+        self.assertEqual(resp.get_json()["transitioned"], expected)
+
+    def test_transition_race(self):
+        """It should let only one of two racing transitions move an Order"""
+        order = OrderFactory(status=OrderStatus.SHIPPING)
+        order_id = self.client.post(BASE_URL, json=order.serialize()).get_json()["id"]
+
+        def move(action):
+            return app.test_client().put(f"{BASE_URL}/{order_id}/{action}")
+
+        for _ in range(5):
+            with ThreadPoolExecutor(2) as pool:
+                responses = list(pool.map(move, ["deliver", "cancel"]))
+            codes = sorted(resp.status_code for resp in responses)
+            self.assertEqual(codes, [status.HTTP_200_OK, status.HTTP_409_CONFLICT])
+            winner = next(resp for resp in responses if resp.status_code == status.HTTP_200_OK)
+            resp = self.client.get(f"{BASE_URL}/{order_id}")
+            self.assertEqual(resp.get_json()["status"], winner.get_json()["status"])
+            self.assertEqual(resp.headers["ETag"], winner.headers["ETag"])
+            self.client.put(f"{BASE_URL}/{order_id}", json=dict(resp.get_json(), status="SHIPPING"))
+        metrics = self.client.get("/metrics").get_json()["transitions"]
+        self.assertGreaterEqual(metrics["deliver"]["count"] + metrics["cancel"]["count"], 10)
+
+    ######################################################################
+    #  I F - M A T C H   T E S T   C A S E S
+    ######################################################################
+
+    def test_update_order_if_match(self):
+        """It should only update an Order in the version of its If-Match header"""
+        order = self._create_orders(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{order.id}")
+        etag = resp.headers["ETag"]
+        data = dict(resp.get_json(), order_notes="first")
+        resp = self.client.put(f"{BASE_URL}/{order.id}", json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        new_etag = resp.headers["ETag"]
+        self.assertNotEqual(new_etag, etag)
+
+        # a writer that read the old version loses
+        resp = self.client.put(f"{BASE_URL}/{order.id}", json=dict(data, order_notes="second"), headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.client.get(f"{BASE_URL}/{order.id}").get_json()["order_notes"], "first")
+
+        for header in (new_etag, f"W/{new_etag}", f'"x", {new_etag[:-1]}-abcdef0123"', "*"):
+            resp = self.client.put(f"{BASE_URL}/{order.id}", json=data, headers={"If-Match": header})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK, header)
+            new_etag = resp.headers["ETag"]
+
+    def test_update_item_if_match(self):
+        """It should only update an Item in the version of its If-Match header"""
+        order = self._create_orders(1)[0]
+        resp = self.client.post(f"{BASE_URL}/{order.id}/items", json=ItemFactory(order=None, order_id=order.id).serialize())
+        item = resp.get_json()
+        url = f"{BASE_URL}/{order.id}/items/{item['id']}"
+        etag = self.client.get(url).headers["ETag"]
+        resp = self.client.put(url, json=dict(item, quantity=3), headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        resp = self.client.put(url, json=dict(item, quantity=4), headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.client.get(url).get_json()["quantity"], 3)
+
+    def test_update_stale_order(self):
+        """It should refuse an update that lost a race with another writer"""
+        order = self._create_orders(1)[0]
+        data = self.client.get(f"{BASE_URL}/{order.id}").get_json()
+        with patch.object(Order, "update", side_effect=StaleVersionError("changed")):
+            resp = self.client.put(f"{BASE_URL}/{order.id}", json=data, headers={"If-Match": "*"})
+            self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+            resp = self.client.put(f"{BASE_URL}/{order.id}", json=data)
+            self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(resp.get_json()["error"], "Conflict")
+
+    def test_concurrent_updates(self):
+        """It should not lose any update of writers that retry on 412"""
+        order = self._create_orders(1)[0]
+        url = f"{BASE_URL}/{order.id}"
+        self.client.put(url, json=dict(self.client.get(url).get_json(), shipping_cost=0))
+
+        def add_one(_):
+            client = app.test_client()
+            retries = 0
+            while True:
+                resp = client.get(url)
+                data = resp.get_json()
+                data["shipping_cost"] += 1
+                resp = client.put(url, json=data, headers={"If-Match": resp.headers["ETag"]})
+                if resp.status_code == status.HTTP_200_OK:
+                    return retries
+                self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+                retries += 1
+
+        with ThreadPoolExecutor(8) as pool:
+            retries = list(pool.map(add_one, range(40)))
+        self.assertEqual(self.client.get(url).get_json()["shipping_cost"], 40)
+        logging.getLogger().info("40 updates needed %d retries", sum(retries))
+
+    def test_bad_bulk_transition(self):
+        """It should not move Orders without ids or a valid filter"""
+        for body in ({}, [], {"ids": "1"}, {"ids": [1, "2"]}, {"filter": {"status": ""}},
+                     {"filter": {"color": "red"}}, {"filter": "STARTED"}, {"filter": {"status": "LOST"}}):
+            resp = self.client.post(f"{BASE_URL}:deliver", json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, body)
+        with patch.dict(app.config, {"TRANSITION_MAX_IDS": 1}):
+            resp = self.client.post(f"{BASE_URL}:deliver", json={"ids": [1, 2]})
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        for order in OrderFactory.create_batch(2, customer_id=7003, status=OrderStatus.SHIPPING):
+            self.client.post(BASE_URL, json=order.serialize())
+        with patch.dict(app.config, {"TRANSITION_MAX_IDS": 1}):
+            resp = self.client.post(f"{BASE_URL}:deliver", json={"filter": {"customer-id": 7003}})
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertIn("matches more than 1 Orders", resp.get_json()["message"])
+        resp = self.client.post(f"{BASE_URL}:return", json={"ids": [1]})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,75 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the in-process Substring Search index
+"""
+
+from unittest import TestCase
+from service.models.search import NgramIndex, grams
+
+
+######################################################################
+#  N G R A M   I N D E X   T E S T   C A S E S
+######################################################################
+class TestNgramIndex(TestCase):
+    """NgramIndex Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.index = NgramIndex()
+        for key, text in enumerate(["Ruler", "Pencil", "Eraser", "Rubber band"]):
+            self.index.add(key, text)
+
+    def test_grams(self):
+        """It should split a text into grams"""
+        self.assertEqual(grams("abcd", 3), {"abc", "bcd"})
+        self.assertEqual(grams("ab", 3), set())
+
+    def test_search(self):
+        """It should find every row containing a term regardless of case"""
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.search("r"), {0, 1, 2, 3} - {1})
+        self.assertEqual(self.index.search("RU"), {0, 3})
+        self.assertEqual(self.index.search("ber b"), {3})
+        self.assertEqual(self.index.search("rubbers"), set())
+        self.assertEqual(self.index.search("xyz"), set())
+        self.assertEqual(self.index.search(""), {0, 1, 2, 3})
+
+    def test_search_verifies_candidates(self):
+        """It should not match rows that only share the grams of a term"""
+        self.index.add(4, "abcxbcd")
+        self.assertEqual(self.index.search("abcd"), set())
+        self.assertEqual(self.index.search("xbcd"), {4})
+
+    def test_reindex_and_remove(self):
+        """It should replace and remove the text of a row"""
+        self.index.add(0, "Protractor")
+        self.assertEqual(self.index.search("ruler"), set())
+        self.assertEqual(self.index.search("tract"), {0})
+        self.index.remove(1)
+        self.index.remove(99)
+        self.assertEqual(self.index.search("pencil"), set())
+        self.index.add(2, None)
+        self.assertEqual(len(self.index), 2)
+
+    def test_clear(self):
+        """It should empty the index"""
+        self.index.loaded = True
+        self.index.clear()
+        self.assertEqual(len(self.index), 0)
+        self.assertFalse(self.index.loaded)
+        self.assertEqual(self.index.search("r"), set())
@@ -0,0 +1,96 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for Single Flight
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from service.common.singleflight import SingleFlight
+
+THREADS = 8
+
+
+######################################################################
+#  S I N G L E   F L I G H T   T E S T   C A S E S
+######################################################################
+class TestSingleFlight(TestCase):
+    """SingleFlight Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.flights = SingleFlight()
+        self.calls = 0
+        self.release = threading.Event()
+
+    def slow_read(self):
+        """A read that stays in flight until the test releases it"""
+        self.calls += 1
+        self.release.wait(10)
+        return b"result"
+
+    def wait_for_callers(self, count):
+        """Waits until some callers joined the read in flight"""
+        for _ in range(1000):
+            if self.flights.stats()["coalesced"] >= count:
+                return
+            threading.Event().wait(0.01)
+
+    def test_coalesces_concurrent_reads(self):
+        """It should run one read for concurrent callers of a key"""
+        with ThreadPoolExecutor(THREADS) as pool:
+            futures = [pool.submit(self.flights.do, "key", self.slow_read) for _ in range(THREADS)]
+            self.wait_for_callers(THREADS - 1)
+            self.release.set()
+            results = [future.result(10) for future in futures]
+        self.assertEqual(results, [b"result"] * THREADS)
+        self.assertEqual(self.calls, 1)
+        stats = self.flights.stats()
+        self.assertEqual((stats["leaders"], stats["coalesced"], stats["in_flight"]), (1, THREADS - 1, 0))
+
+    def test_shares_errors(self):
+        """It should raise the error of the read in every caller"""
+
+        def failing_read():
+            self.release.wait(10)
+            raise ValueError("no database")
+
+        with ThreadPoolExecutor(2) as pool:
+            futures = [pool.submit(self.flights.do, "key", failing_read) for _ in range(2)]
+            self.wait_for_callers(1)
+            self.release.set()
+            for future in futures:
+                self.assertRaises(ValueError, future.result, 10)
+        self.assertEqual(self.flights.stats()["errors"], 1)
+
+    def test_runs_again_after_the_flight(self):
+        """It should not share a read with callers that come after it"""
+        self.release.set()
+        self.assertEqual(self.flights.do("key", self.slow_read), b"result")
+        self.assertEqual(self.flights.do("key", self.slow_read), b"result")
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.flights.do("other", lambda: 42), 42)
+
+    def test_disabled(self):
+        """It should run every read when it is disabled"""
+        self.flights.enabled = False
+        self.release.set()
+        self.flights.do("key", self.slow_read)
+        self.flights.do("key", self.slow_read)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.flights.stats()["leaders"], 0)